@@ -0,0 +1,308 @@
+"""要約処理全体（do() → yoyaku_gemini → txt_to_html）のオフライン・ベンチマーク
+
+OpenAI API の代わりにローカルのモックサーバー（mock_openai.py）、YouTube の
+ストーリーボードの代わりに合成シートを返すサーバー（storyboard_server.py）を起動し、
+合成したローリング字幕の VTT（5分〜10時間）を動画の長さごとに要約する。
+各サイズは別プロセスで実行し、実行時間・クリティカルパス・リクエスト数・
+ピークメモリ（RSS）を表示して、保存済みの基準値（baseline.json）と比べる。
+
+    python bench/bench_e2e.py [--sizes 5,30,120,600] [--latency 0.3] [--jitter 0.1] [--rate-429 0.02]
+                              [--detail] [--save-baseline] [--strict]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+RESULT_PREFIX = 'BENCH_RESULT '
+VIDEO_ID = 'benchvideo1'
+# 基準値と比べるときの項目と表示名
+COMPARED = (
+    ('wall_seconds', '実行時間', 's'),
+    ('api_calls', 'API呼び出し', '件'),
+    ('peak_rss_mb', 'ピークRSS', 'MB'),
+)
+
+
+def peak_rss_mb():
+    """このプロセスのピークメモリ（RSS、MB）。取得できなければ None。"""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux は KB、macOS はバイト単位
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return round(counters.PeakWorkingSetSize / (1024 * 1024), 1)
+    return None
+
+
+# ---------------------- 子プロセス（1サイズ分の実行） ---------------------- #
+
+def run_child(args):
+    """1サイズ分の要約処理を実行し、結果を RESULT_PREFIX 付きの1行の JSON で出力する"""
+    from concurrent.futures import ThreadPoolExecutor
+    from openai import OpenAI, AsyncOpenAI
+
+    import tracing
+    import ret_youyaku_html as r
+    from llm_engine import AsyncLLMEngine, LLM_ASYNC
+    from youtube_transcript_downloader import dl_images
+    from fixtures import write_rolling_vtt
+    from storyboard_server import storyboard_metadata
+
+    title = f"Benchmark {args.minutes} min"
+    output_dir = os.path.join(args.work, f"{args.minutes}min")
+    images_dir = os.path.join(output_dir, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+    vtt_path = os.path.join(output_dir, 'bench.vtt')
+    cues = write_rolling_vtt(vtt_path, args.minutes, lang=args.lang, seed=args.seed)
+    metadata = storyboard_metadata(args.storyboard_url, VIDEO_ID, title, args.minutes * 60)
+
+    # 共有クライアント（get_client / get_async_engine が返すもの）をモックサーバー向けにしておく
+    if LLM_ASYNC:
+        r._engine = AsyncLLMEngine(AsyncOpenAI(base_url=args.openai_url, api_key='bench', max_retries=0))
+    else:
+        r._client = OpenAI(base_url=args.openai_url, api_key='bench', max_retries=0)
+
+    tracer = tracing.Tracer()
+    started = time.perf_counter()
+    with tracing.activate(tracer), tracing.span('bench', minutes=args.minutes):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            images_future = executor.submit(tracing.traced('download_storyboard', dl_images),
+                                            metadata, images_dir, output_dir)
+            r.do(vtt_path, title, output_dir, url=f"https://www.youtube.com/watch?v={VIDEO_ID}&t=",
+                 images_future=images_future, description="ベンチマーク用の動画です。",
+                 detail_mode=args.detail)
+    wall = time.perf_counter() - started
+    tracer.export(output_dir)
+    tracer.print_summary()
+
+    with open(os.path.join(output_dir, 'run_report.json'), encoding='utf-8') as f:
+        stages = json.load(f)['stages']
+    total = stages.pop('total', {})
+    result = {
+        "minutes": args.minutes,
+        "cues": cues,
+        "wall_seconds": round(wall, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "requests": total.get('requests', 0),
+        "api_calls": total.get('api_calls', 0),
+        "retries": total.get('retries', 0),
+        "errors": total.get('errors', 0),
+        "stages": {name: s['requests'] for name, s in stages.items()},
+        "critical_path": [
+            [depth, span.name, round(span.duration, 3)]
+            for depth, span in tracer.critical_path()
+            if span.duration >= tracing.TRACE_MIN_SECONDS
+        ],
+    }
+    print(RESULT_PREFIX + json.dumps(result, ensure_ascii=False))
+
+
+# ---------------------- 親プロセス（サーバー起動・集計・基準値との比較） ---------------------- #
+
+def run_size(args, minutes, work, openai_url, storyboard_url):
+    """子プロセスで1サイズ分を実行し、結果の辞書を返す（失敗時は None）"""
+    env = dict(os.environ)
+    env.update({
+        # 同じプロンプトでも毎回 API（モック）を呼ぶ
+        'LLM_CACHE': '0',
+        'TUBE_CACHE_DIR': os.path.join(work, 'cache'),
+        'NO_PROXY': ','.join(filter(None, [env.get('NO_PROXY'), '127.0.0.1', 'localhost'])),
+        'PYTHONIOENCODING': 'utf-8',
+    })
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '--minutes', str(minutes), '--work', work, '--lang', args.lang, '--seed', str(args.seed),
+               '--openai-url', openai_url, '--storyboard-url', storyboard_url]
+    if args.detail:
+        command.append('--detail')
+    log_path = os.path.join(work, f"{minutes}min.log")
+    with open(log_path, 'w', encoding='utf-8') as log:
+        completed = subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT, cwd=work)
+    with open(log_path, encoding='utf-8', errors='replace') as log:
+        lines = log.read().splitlines()
+    for line in reversed(lines):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"⚠️ {minutes}分の実行に失敗しました（終了コード {completed.returncode}）。ログの末尾:")
+    for line in lines[-20:]:
+        print(f"    {line}")
+    return None
+
+
+def config_of(args):
+    return {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "rate_429": args.rate_429,
+        "storyboard_delay": args.storyboard_delay,
+        "detail": args.detail,
+        "lang": args.lang,
+        "seed": args.seed,
+        "llm_async": os.environ.get('LLM_ASYNC', '0') == '1',
+    }
+
+
+def print_results(results):
+    print("\n=== 結果 ===")
+    print(f"{'長さ':>6} {'cue数':>7} {'実行時間':>9} {'API呼出':>7} {'429':>5} {'再試行':>6} "
+          f"{'シート':>6} {'ピークRSS':>10}")
+    for res in results:
+        rss = f"{res['peak_rss_mb']:.0f}MB" if res['peak_rss_mb'] is not None else "-"
+        print(f"{res['minutes']:>5}分 {res['cues']:>7,} {res['wall_seconds']:>8.2f}s {res['api_calls']:>7} "
+              f"{res['server']['429']:>5} {res['retries']:>6} {res['server']['sheets']:>6} {rss:>10}")
+
+    for res in results:
+        stages = ", ".join(f"{name} {count}" for name, count in res['stages'].items())
+        print(f"\n--- {res['minutes']}分: ステージ別リクエスト（{stages}）")
+        print("クリティカルパス:")
+        for depth, name, duration in res['critical_path']:
+            if depth <= 3:
+                print(f"  {'  ' * depth}{name:<{40 - 2 * depth}} {duration:7.2f}s")
+
+
+def compare_baseline(results, baseline, config, tolerance):
+    """基準値と比べて表示し、許容範囲を超えて悪化した項目の数を返す"""
+    print(f"\n=== 基準値との比較（{baseline.get('created', '?')} / {baseline.get('machine', '?')}）===")
+    if baseline.get('config') != config:
+        print("⚠️ 基準値と実行条件が異なるため、比較は参考値です")
+    regressions = 0
+    saved = baseline.get('results', {})
+    for res in results:
+        base = saved.get(str(res['minutes']))
+        if base is None:
+            print(f"  {res['minutes']}分: 基準値なし")
+            continue
+        parts = []
+        for key, label, unit in COMPARED:
+            now, before = res.get(key), base.get(key)
+            if now is None or not before:
+                continue
+            change = (now - before) / before
+            mark = ""
+            if change > tolerance:
+                mark = " ⚠️"
+                regressions += 1
+            parts.append(f"{label} {now:g}{unit}（基準 {before:g}{unit}, {change * 100:+.0f}%）{mark}")
+        print(f"  {res['minutes']}分: " + " / ".join(parts))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="要約処理全体のオフライン・ベンチマーク")
+    parser.add_argument('--sizes', default='5,30,120,600', help="動画の長さ（分）のカンマ区切り")
+    parser.add_argument('--latency', type=float, default=0.3, help="モック API の平均応答秒数")
+    parser.add_argument('--jitter', type=float, default=0.1, help="応答秒数のゆらぎ（±秒）")
+    parser.add_argument('--rate-429', type=float, default=0.02, help="429 を返す割合（0〜1）")
+    parser.add_argument('--storyboard-delay', type=float, default=0.05, help="シート1枚の取得にかかる秒数")
+    parser.add_argument('--detail', action='store_true', help="詳細モードで実行する")
+    parser.add_argument('--lang', default='en', choices=('en', 'ja'), help="合成字幕の言語")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基準値の JSON ファイル")
+    parser.add_argument('--save-baseline', action='store_true', help="今回の結果を基準値として保存する")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="悪化とみなす割合（既定 20%%）")
+    parser.add_argument('--strict', action='store_true', help="悪化した項目があれば終了コード 1 で終わる")
+    parser.add_argument('--keep', action='store_true', help="出力フォルダを削除せずに残す")
+    # 子プロセス用
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--minutes', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--work', help=argparse.SUPPRESS)
+    parser.add_argument('--openai-url', help=argparse.SUPPRESS)
+    parser.add_argument('--storyboard-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return 0
+
+    from mock_openai import MockOpenAIServer
+    from storyboard_server import StoryboardServer
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    mock = MockOpenAIServer(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429, seed=args.seed)
+    storyboard = StoryboardServer(delay=args.storyboard_delay)
+    openai_url = mock.start()
+    storyboard_url = storyboard.start()
+    work = tempfile.mkdtemp(prefix='bench_e2e_')
+    print(f"モック API: {openai_url} / ストーリーボード: {storyboard_url}")
+    print(f"作業フォルダ: {work}")
+
+    results = []
+    try:
+        for minutes in sizes:
+            mock.reset_stats()
+            storyboard.reset_stats()
+            print(f"▶ {minutes}分の動画を要約中...", flush=True)
+            res = run_size(args, minutes, work, openai_url, storyboard_url)
+            if res is None:
+                continue
+            res['server'] = {
+                "429": mock.stats['429'],
+                "by_type": {k: v for k, v in mock.stats.items() if k != '429'},
+                "sheets": storyboard.stats['sheets'],
+            }
+            print(f"  {res['wall_seconds']:.2f}s / API呼び出し {res['api_calls']} 件 / "
+                  f"ピークRSS {res['peak_rss_mb']}MB", flush=True)
+            results.append(res)
+    finally:
+        mock.stop()
+        storyboard.stop()
+        if not args.keep:
+            import shutil
+            shutil.rmtree(work, ignore_errors=True)
+
+    if not results:
+        return 1
+    print_results(results)
+
+    config = config_of(args)
+    regressions = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_baseline(results, json.load(f), config, args.tolerance)
+    if args.save_baseline:
+        baseline = {
+            "created": time.strftime('%Y-%m-%d'),
+            "machine": f"{platform.system()} {platform.machine()} / Python {platform.python_version()}",
+            "config": config,
+            "results": {
+                str(res['minutes']): {key: res[key] for key, _, _ in COMPARED}
+                for res in results
+            },
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n✅ 基準値を保存しました: {args.baseline}")
+    if regressions and args.strict:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""ローリング字幕の重なり除去（transcript.overlap_length）のベンチマーク
+
+自動生成字幕を模した英語・日本語の cue 列を作り、従来の「長さごとに endswith を
+試す」方法と overlap_length の結果が一致することを確かめてから、所要時間を比べる。
+あわせて、重なり除去を使う各処理（build_blocks / TranscriptIndex /
+build_transcript_blocks）の所要時間も表示する。
+
+また、60分相当の字幕のランダムな範囲について、TranscriptIndex 経由の
+build_section_text（[MM:SS] マーカーあり・なし）と get_subtitle_for_range が、
+範囲ごとに重複除去をやり直す従来の実装と同じ文字列を返すことを確かめる。
+
+    python bench/bench_overlap.py [cue数]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcript import Transcript, TranscriptIndex, overlap_length  # noqa: E402
+from fixtures import make_captions  # noqa: E402
+
+
+def legacy_overlap_length(prev, text, max_overlap=50):
+    """従来の方法（長い方から1文字ずつ endswith を試す）"""
+    for overlap_len in range(min(len(prev), len(text), max_overlap), 2, -1):
+        if prev.endswith(text[:overlap_len]):
+            return overlap_len
+    return 0
+
+
+def legacy_merge(texts):
+    """従来の範囲ごとの重複除去（markers=True のときは角括弧だけの項目を独立させる）"""
+    merged = []
+    for text, markers in texts:
+        if markers and text.startswith('[') and text.endswith(']'):
+            merged.append(text)
+            continue
+        if merged and text == merged[-1]:
+            continue
+        prev = merged[-1] if merged else None
+        if prev is not None and not (markers and prev.startswith('[') and prev.endswith(']')):
+            overlap = legacy_overlap_length(prev, text)
+            if overlap:
+                merged[-1] = prev + text[overlap:]
+                continue
+        merged.append(text)
+    return ' '.join(merged)
+
+
+def legacy_section_text(entries, start_sec, end_sec, timestamps):
+    """TranscriptIndex 導入前の build_section_text（制御文字の除去は省略）"""
+    texts = []
+    last_marker_sec = -999
+    for entry_start, _entry_end, text in entries:
+        if entry_start < start_sec:
+            continue
+        if entry_start >= end_sec:
+            break
+        if timestamps and entry_start - last_marker_sec >= 60:
+            m, s = divmod(int(entry_start), 60)
+            texts.append((f"[{m:02d}:{s:02d}]", True))
+            last_marker_sec = entry_start
+        texts.append((text, True))
+    return legacy_merge(texts)
+
+
+def legacy_subtitle_text(entries, start_sec, end_sec):
+    """TranscriptIndex 導入前の get_subtitle_for_range の連結部分（角括弧の cue も連結する）"""
+    return legacy_merge([(text, False) for start, _end, text in entries if start_sec <= start < end_sec])
+
+
+def check_ranges(r, transcript, n_ranges=300, seed=0):
+    """ランダムな範囲で TranscriptIndex 経由の結果が従来の範囲ごとの重複除去と一致するか確かめる"""
+    rnd = random.Random(seed)
+    duration = transcript.duration
+    for _ in range(n_ranges):
+        start = rnd.uniform(0, duration)
+        end = start + rnd.uniform(30, 900)
+        for timestamps in (True, False):
+            if r.build_section_text(transcript, start, end, timestamps) != \
+                    legacy_section_text(transcript, start, end, timestamps):
+                raise AssertionError(f"build_section_text が一致しません ({start:.1f}〜{end:.1f}, "
+                                     f"timestamps={timestamps})")
+        if r.get_subtitle_for_range(transcript, start, end) != \
+                r.format_subtitle_text(legacy_subtitle_text(transcript, start, end)):
+            raise AssertionError(f"get_subtitle_for_range が一致しません ({start:.1f}〜{end:.1f})")
+    return n_ranges
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def bench_pairs(entries, max_overlap):
+    pairs = [(entries[i - 1][2], entries[i][2]) for i in range(1, len(entries))]
+    t_old, old = timed(lambda: [legacy_overlap_length(a, b, max_overlap) for a, b in pairs])
+    t_new, new = timed(lambda: [overlap_length(a, b, max_overlap) for a, b in pairs])
+    if old != new:
+        raise AssertionError(f"結果が一致しません (max_overlap={max_overlap})")
+    return t_old, t_new
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    import ret_youyaku_html as r
+
+    print(f"=== 重なり除去ベンチマーク（{n:,} cue）===")
+    for lang in ('en', 'ja'):
+        entries = make_captions(n, lang, seed=1)
+        print(f"\n[{lang}]")
+        for max_overlap in (50, 80, 200):
+            t_old, t_new = bench_pairs(entries, max_overlap)
+            print(f"  cue 間の重なり（最大 {max_overlap:>3} 文字）: 従来 {t_old:.3f}s → {t_new:.3f}s"
+                  f"（{t_old / t_new:.1f} 倍）")
+
+        transcript = Transcript(*zip(*entries))
+        t_blocks, _ = timed(r.build_blocks, transcript)
+        t_index, _ = timed(TranscriptIndex, transcript)
+        t_display, _ = timed(r.build_transcript_blocks, transcript)
+        print(f"  build_blocks: {t_blocks:.3f}s / TranscriptIndex: {t_index:.3f}s / "
+              f"build_transcript_blocks: {t_display:.3f}s")
+
+        sixty = Transcript(*zip(*make_captions(lang=lang, seed=1, duration=3600)))
+        print(f"  範囲の取り出し: {check_ranges(r, sixty)} 範囲で従来の範囲ごとの重複除去と一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""ベンチマーク用の合成データ（自動生成字幕風の cue 列と VTT ファイル）"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcript import Transcript  # noqa: E402
+
+EN_WORDS = (
+    "so today we are going to talk about how the model handles long context and what "
+    "happens when you scale the data pipeline to many machines because performance really matters"
+).split()
+JA_TEXT = "今日は長い文脈をモデルがどう扱うかについてお話しします。データの流れを何台ものマシンに広げたときに何が起きるのか、性能がなぜ大事なのかを見ていきましょう。"
+
+
+def make_captions(n=None, lang='en', seed=0, duration=None):
+    """自動生成字幕風の cue 列 [(start, end, text), ...] を作る
+
+    n 個、または開始秒が duration（秒）に達するまで作る。
+    約半数の cue は前の cue の末尾を先頭に繰り返し（ローリング表示）、
+    一部は前と全く同じ cue、まれに [音楽] のような角括弧だけの cue を混ぜる。
+    """
+    rnd = random.Random(seed)
+    entries = []
+    t = 0.0
+    prev = ""
+    while (n is None or len(entries) < n) and (duration is None or t < duration):
+        if lang == 'en':
+            new = " ".join(rnd.choice(EN_WORDS) for _ in range(rnd.randint(3, 9)))
+        else:
+            i = rnd.randrange(len(JA_TEXT))
+            new = (JA_TEXT * 2)[i:i + rnd.randint(8, 24)]
+        r = rnd.random()
+        if prev and r < 0.5:
+            keep = rnd.randint(3, min(40, len(prev)))
+            text = prev[-keep:] + (" " if lang == 'en' else "") + new
+        elif prev and r < 0.58:
+            text = prev
+        elif r < 0.6:
+            text = "[Music]" if lang == 'en' else "[音楽]"
+        else:
+            text = new
+        duration_sec = rnd.uniform(1.0, 4.0)
+        entries.append((round(t, 3), round(t + duration_sec, 3), text))
+        t += rnd.uniform(0.8, 3.0)
+        prev = text
+    return entries
+
+
+def write_rolling_vtt(path, minutes, lang='en', seed=0):
+    """minutes 分の自動生成字幕風の VTT ファイルを書き出し、cue 数を返す"""
+    entries = make_captions(lang=lang, seed=seed, duration=minutes * 60)
+    Transcript(*zip(*entries)).write_vtt(path)
+    return len(entries)
@@ -0,0 +1,228 @@
+"""OpenAI 互換の chat completions をローカルで返すモックサーバー（ベンチマーク用）
+
+POST /v1/chat/completions に対し、指定した遅延（平均 ± ゆらぎ）のあとで応答を返す。
+一定の割合で 429（retry-after-ms 付き）を返し、レート制限時の再試行も再現する。
+Structured Outputs（response_format の json_schema）は名前で見分け、
+_WindowOutline / _SectionSummary / _PolishResult の形の JSON を、プロンプトの内容
+（ブロックID・セクション数など）に合わせて組み立てる。それ以外は短い日本語の文章を返す。
+
+    python bench/mock_openai.py [--port 8000] [--latency 0.3] [--jitter 0.1] [--rate-429 0.02]
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+_BLOCK_ID_RE = re.compile(r'^\[(\d+)\]', re.MULTILINE)
+_QUOTA_RE = re.compile(r'ちょうど (\d+) 個')
+_SECTION_COUNT_RE = re.compile(r'全(\d+)セクション')
+
+SUMMARY_PARAGRAPH = (
+    "この区間では、長い文脈を扱うときにモデルの注意がどのように分散するかを、"
+    "実際の計測結果を示しながら説明しています。データの流れを複数のマシンに広げた場合の"
+    "ボトルネックと、その解消のために取った手順が順を追って紹介されます。"
+)
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _window_outline(prompt):
+    """窓の字幕に含まれるブロックIDから、指定数のセクションを等間隔に選ぶ"""
+    ids = [int(m) for m in _BLOCK_ID_RE.findall(prompt)]
+    match = _QUOTA_RE.search(prompt)
+    quota = int(match.group(1)) if match else 1
+    if not ids:
+        return {"sections": []}
+    quota = max(1, min(quota, len(ids)))
+    picks = [ids[round(k * len(ids) / quota)] for k in range(quota)]
+    return {"sections": [{"start_block_id": i, "heading": f"話題{i}"} for i in picks]}
+
+
+def _section_summary(prompt):
+    return {
+        "heading": "長い文脈の扱いと分散処理のボトルネックを実測で確認",
+        "summary": f"**結論**: 計測に基づいて手順を改善しています。\n\n{SUMMARY_PARAGRAPH}\n\n- 要点1\n- 要点2",
+    }
+
+
+def _polish_result(prompt):
+    match = _SECTION_COUNT_RE.search(prompt)
+    n = int(match.group(1)) if match else 1
+    return {"sections": [
+        {"heading": f"セクション{k + 1}の話題と結論をまとめた見出し", "merge_with_previous": False}
+        for k in range(n)
+    ]}
+
+
+STRUCTURED_RESPONSES = {
+    "_WindowOutline": _window_outline,
+    "_SectionSummary": _section_summary,
+    "_PolishResult": _polish_result,
+}
+
+
+def _text_response(prompt):
+    if "ポイント" in prompt:
+        return "動画のポイント\n" + SUMMARY_PARAGRAPH
+    return SUMMARY_PARAGRAPH
+
+
+class MockOpenAIServer:
+    """モックサーバー本体。start() で別スレッドに起動し、base_url を返す。
+
+    stats にはリクエストの種類（スキーマ名、テキストは 'text'）ごとの件数と、
+    '429' の件数が入る。reset_stats() で数え直す。
+    """
+
+    def __init__(self, latency=0.3, jitter=0.1, rate_429=0.0, retry_after=0.2, seed=0,
+                 host='127.0.0.1', port=0, rpm=10000, tpm=10_000_000):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.tpm = tpm
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-openai', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = Counter()
+
+    def _draw(self):
+        """このリクエストの (遅延秒, 429 にするか, 応答ID) を決める"""
+        with self._lock:
+            self._ids += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            limited = self._random.random() < self.rate_429
+            return delay, limited, self._ids
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def respond(self, body):
+        """リクエスト本文（dict）から (ステータス, ヘッダー, 応答本文) を作る"""
+        delay, limited, response_id = self._draw()
+        if limited:
+            self._count('429')
+            time.sleep(min(delay, 0.05))
+            headers = {"retry-after-ms": str(int(self.retry_after * 1000))}
+            error = {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                               "code": "rate_limit_exceeded", "param": None}}
+            return 429, headers, error
+
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(m.get("content") or "") for m in messages)
+        fmt = body.get("response_format") or {}
+        schema = (fmt.get("json_schema") or {}).get("name") if fmt.get("type") == "json_schema" else None
+        if schema in STRUCTURED_RESPONSES:
+            content = json.dumps(STRUCTURED_RESPONSES[schema](prompt), ensure_ascii=False)
+        else:
+            content = _text_response(prompt)
+        self._count(schema or 'text')
+        time.sleep(delay)
+
+        prompt_tokens = _estimate_tokens(prompt)
+        completion_tokens = _estimate_tokens(content)
+        headers = {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(self.rpm - 1),
+            "x-ratelimit-reset-requests": "6ms",
+            "x-ratelimit-limit-tokens": str(self.tpm),
+            "x-ratelimit-remaining-tokens": str(max(0, self.tpm - prompt_tokens)),
+            "x-ratelimit-reset-tokens": "6ms",
+        }
+        response = {
+            "id": f"chatcmpl-mock-{response_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            },
+        }
+        return 200, headers, response
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    body = None
+                if not self.path.rstrip('/').endswith('/chat/completions') or not isinstance(body, dict):
+                    status, headers, payload = 404, {}, {"error": {"message": "not found", "type": "invalid_request_error"}}
+                else:
+                    status, headers, payload = server.respond(body)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 互換のモックサーバー")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.3, help="応答までの平均秒数")
+    parser.add_argument('--jitter', type=float, default=0.1, help="遅延のゆらぎ（± 秒）")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="429 を返す割合（0〜1）")
+    args = parser.parse_args()
+    server = MockOpenAIServer(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429, port=args.port)
+    print(f"モックサーバー: {server.base_url}（Ctrl+C で終了）")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""合成ストーリーボード（複数コマを並べたシート画像）を返すローカル HTTP サーバー（ベンチマーク用）
+
+GET /{format_id}/{番号}.jpg でシート画像を、GET /thumb.jpg でサムネイルを返す。
+スライド中心の講演を模して、数コマずつ同じ画面が続く絵を描く（dHash による
+重複コマの統合も動く）。storyboard_metadata() は yt-dlp の formats と同じ形の
+ストーリーボード形式（sb0〜sb2）を、このサーバーの URL で組み立てる。
+"""
+import io
+import time
+import random
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PIL import Image, ImageDraw
+
+# YouTube のストーリーボードに近い形式: (format_id, 幅, 高さ, 列, 行, 1コマの秒数)
+STORYBOARD_FORMATS = (
+    ('sb0', 160, 90, 5, 5, 2.0),
+    ('sb1', 80, 45, 10, 10, 5.0),
+    ('sb2', 48, 27, 10, 10, 10.0),
+)
+# 同じスライドが続くコマ数
+SLIDE_CELLS = 7
+
+
+def draw_sheet(format_id, index, width, height, cols, rows):
+    """シート画像（JPEG のバイト列）を描く"""
+    image = Image.new('RGB', (cols * width, rows * height))
+    draw = ImageDraw.Draw(image)
+    for c in range(cols * rows):
+        x, y = (c % cols) * width, (c // cols) * height
+        slide = (index * cols * rows + c) // SLIDE_CELLS
+        rnd = random.Random(f"{format_id}-{slide}")
+        draw.rectangle([x, y, x + width - 1, y + height - 1],
+                       fill=((slide * 53) % 255, (slide * 97) % 255, (slide * 31) % 255))
+        for _ in range(6):
+            a, b = rnd.randrange(width), rnd.randrange(height)
+            draw.rectangle([x + a // 2, y + b // 2,
+                            x + a // 2 + rnd.randrange(2, max(3, width // 2)),
+                            y + b // 2 + rnd.randrange(2, max(3, height // 2))],
+                           fill=(rnd.randrange(255),) * 3)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+class StoryboardServer:
+    """合成ストーリーボードのサーバー。start() で別スレッドに起動し、base_url を返す。
+
+    シート画像は初回の要求時に描いて覚えておく。delay 秒の遅延を入れて
+    ネットワーク越しの取得を模す。stats['sheets'] / stats['thumbnail'] に取得件数が入る。
+    """
+
+    def __init__(self, delay=0.05, host='127.0.0.1', port=0):
+        self.delay = delay
+        self.stats = Counter()
+        self._sheets = {}
+        self._lock = threading.Lock()
+        self._formats = {f[0]: f for f in STORYBOARD_FORMATS}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='storyboard', daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = Counter()
+
+    def sheet(self, format_id, index):
+        key = (format_id, index)
+        with self._lock:
+            data = self._sheets.get(key)
+        if data is None:
+            _, width, height, cols, rows, _ = self._formats[format_id]
+            data = draw_sheet(format_id, index, width, height, cols, rows)
+            with self._lock:
+                self._sheets[key] = data
+        return data
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                data = None
+                try:
+                    if parts == ['thumb.jpg']:
+                        data = draw_sheet('thumb', 0, 1280, 720, 1, 1)
+                        key = 'thumbnail'
+                    elif len(parts) == 2 and parts[0] in server._formats:
+                        data = server.sheet(parts[0], int(parts[1].split('.')[0]))
+                        key = 'sheets'
+                except ValueError:
+                    data = None
+                if data is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                with server._lock:
+                    server.stats[key] += 1
+                time.sleep(server.delay)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def storyboard_metadata(base_url, video_id, title, duration, description=""):
+    """resolve_video_metadata() と同じ形のメタ情報を、このサーバーの URL で作る"""
+    storyboards = []
+    for format_id, width, height, cols, rows, interval in STORYBOARD_FORMATS:
+        fragment_duration = cols * rows * interval
+        n_fragments = max(1, int(-(-duration // fragment_duration)))
+        storyboards.append({
+            'format_id': format_id,
+            'format_note': 'storyboard',
+            'width': width,
+            'height': height,
+            'columns': cols,
+            'rows': rows,
+            'fps': 1 / interval,
+            'fragments': [
+                {'url': f"{base_url}/{format_id}/{i}.jpg", 'duration': fragment_duration}
+                for i in range(n_fragments)
+            ],
+        })
+    return {
+        "video_id": video_id,
+        "url": f"https://www.youtube.com/watch?v={video_id}",
+        "title": title,
+        "description": description,
+        "duration": duration,
+        "chapters": [],
+        "thumbnails": [{'url': f"{base_url}/thumb.jpg", 'width': 1280, 'height': 720, 'id': 'maxresdefault'}],
+        "storyboards": storyboards,
+        "uploader": "bench",
+        "channel": "bench",
+        "upload_date": "20260101",
+        "view_count": 0,
+    }
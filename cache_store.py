@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+# キャッシュの保存先（環境変数で変更可能、既定はこのスクリプトと同じ階層の cache/）
+CACHE_DIR = os.environ.get(
+    'TUBE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+)
+
+# 動画ごとのキャッシュの有効期限（時間）。ストーリーボードのURLは署名付きで
+# 数時間で失効するため、既定はそれより短くしている。
+VIDEO_CACHE_TTL_HOURS = float(os.environ.get('VIDEO_CACHE_TTL_HOURS', '6'))
+
+
+def _write_json_atomic(path, data):
+    """JSONを一時ファイルに書いてから置き換える（途中で落ちても壊れたファイルを残さない）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# ====================== 動画ごとのキャッシュ ====================== #
+
+def _video_cache_path(video_id, name):
+    return os.path.join(CACHE_DIR, 'videos', video_id, f"{name}.json")
+
+
+def load_video_cache(video_id, name, ttl_hours=None):
+    """video_id ごとのキャッシュを読み込む。無い・期限切れ・壊れている場合は None。
+
+    Args:
+        video_id: 動画ID
+        name: キャッシュの種類（'metadata' / 'transcript_list' / 'transcript' など）
+        ttl_hours: 有効期限（時間）。省略時は VIDEO_CACHE_TTL_HOURS
+    """
+    if ttl_hours is None:
+        ttl_hours = VIDEO_CACHE_TTL_HOURS
+    path = _video_cache_path(video_id, name)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry.get('saved_at', 0) > ttl_hours * 3600:
+        return None
+    return entry.get('data')
+
+
+def save_video_cache(video_id, name, data):
+    """video_id ごとのキャッシュを保存する（失敗しても処理は継続）"""
+    try:
+        _write_json_atomic(_video_cache_path(video_id, name), {'saved_at': time.time(), 'data': data})
+    except Exception as e:
+        print(f"⚠️ キャッシュ保存エラー: {name} ({str(e)})")
+
+
+# ====================== LLM 応答キャッシュ ====================== #
+
+# モデル・メッセージ・応答形式が完全に同じ呼び出しは、前回の結果を再利用する。
+# 合計サイズが上限を超えたら、最後に使われた時刻（mtime）が古いものから削除する。
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE', '1') != '0'
+LLM_CACHE_MAX_MB = float(os.environ.get('LLM_CACHE_MAX_MB', '500'))
+
+_llm_cache_lock = threading.Lock()
+_llm_cache_size = None  # 初回アクセス時にディレクトリを走査して求める
+
+
+def _llm_cache_dir():
+    return os.path.join(CACHE_DIR, 'llm')
+
+
+def _llm_cache_path(key):
+    return os.path.join(_llm_cache_dir(), key[:2], f"{key}.json")
+
+
+def llm_cache_key(model, messages, response_format=None):
+    """モデル名・メッセージ・応答スキーマから内容アドレス（SHA256）を作る
+
+    response_format は Pydantic モデル（Structured Outputs）または None。
+    スキーマ自体をキーに含めるので、モデル定義を変えれば自動的に別エントリになる。
+    """
+    schema = response_format.model_json_schema() if response_format is not None else None
+    payload = json.dumps(
+        {"model": model, "messages": messages, "response_format": schema},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_llm_cache(key):
+    """キャッシュ済みの応答（JSON化した結果）を返す。無ければ None。"""
+    if not LLM_CACHE_ENABLED:
+        return None
+    path = _llm_cache_path(key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  # LRU 用に最終使用時刻を更新
+    except OSError:
+        pass
+    return entry.get('data')
+
+
+def save_llm_cache(key, data):
+    """応答を保存し、必要ならサイズ上限まで古いエントリを削除する（失敗しても処理は継続）"""
+    global _llm_cache_size
+    if not LLM_CACHE_ENABLED:
+        return
+    path = _llm_cache_path(key)
+    try:
+        _write_json_atomic(path, {'saved_at': time.time(), 'data': data})
+        size = os.path.getsize(path)
+    except Exception as e:
+        print(f"⚠️ LLMキャッシュ保存エラー: {str(e)}")
+        return
+
+    with _llm_cache_lock:
+        if _llm_cache_size is None:
+            _llm_cache_size = _scan_llm_cache()[1]
+        else:
+            _llm_cache_size += size
+        if _llm_cache_size > LLM_CACHE_MAX_MB * 1024 * 1024:
+            _llm_cache_size = _evict_llm_cache(LLM_CACHE_MAX_MB * 1024 * 1024 * 0.9)
+
+
+def _scan_llm_cache():
+    """キャッシュ内の全エントリ [(mtime, size, path), ...] と合計サイズを返す"""
+    entries = []
+    total = 0
+    for root, _dirs, files in os.walk(_llm_cache_dir()):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    return entries, total
+
+
+def _evict_llm_cache(target_bytes):
+    """最終使用時刻の古い順に削除して target_bytes 以下にし、残りの合計サイズを返す"""
+    entries, total = _scan_llm_cache()
+    entries.sort()
+    removed = 0
+    for _mtime, size, path in entries:
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        print(f"🧹 LLMキャッシュ: 古いエントリを {removed} 件削除しました")
+    return total
+
+
+# ====================== 出力フォルダ内のチェックポイント ====================== #
+
+class RunCheckpoint:
+    """動画の出力フォルダ内 _checkpoints/ に、ステージごとの途中結果を保存する。
+
+    各エントリは入力のキー（ハッシュ等）と一緒に保存し、読み込み時にキーが
+    一致しなければ無効（None）として扱う。key=None で保存・読み込みすると
+    キーの照合をせず、内容の比較は呼び出し側に任せる。
+    """
+
+    def __init__(self, output_dir):
+        self.dir = os.path.join(output_dir, '_checkpoints')
+
+    def _path(self, name):
+        return os.path.join(self.dir, f"{name}.json")
+
+    def load(self, name, key=None):
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if key is not None and entry.get('key') != key:
+            return None
+        return entry.get('data')
+
+    def save(self, name, data, key=None):
+        try:
+            _write_json_atomic(self._path(name), {'key': key, 'saved_at': time.time(), 'data': data})
+        except Exception as e:
+            print(f"⚠️ チェックポイント保存エラー: {name} ({str(e)})")
+
+    def names(self, prefix=""):
+        """保存済みエントリ名の一覧（prefix で絞り込み）"""
+        try:
+            files = os.listdir(self.dir)
+        except OSError:
+            return []
+        return [f[:-5] for f in files if f.endswith('.json') and f.startswith(prefix)]
+
+    def remove(self, name):
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
@@ -0,0 +1,211 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import openai
+
+from rate_limiter import RateLimitScheduler, estimate_tokens, parse_reset_seconds
+
+# OpenAI 呼び出しの同時実行数の上限（全ステージ・全動画で共有）。
+# 実際の同時実行数はこの範囲内で RateLimitScheduler が増減させる。
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '32'))
+# 429・5xx・接続エラー時の再試行回数（待ち時間は retry-after または指数バックオフ）
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '5'))
+# 1 にすると AsyncOpenAI + asyncio のイベントループで全リクエストを処理する
+LLM_ASYNC = os.environ.get('LLM_ASYNC', '0') == '1'
+
+_executor = None
+_scheduler = None
+_executor_lock = threading.Lock()
+
+
+def get_scheduler():
+    """プロセス共有の RateLimitScheduler を返す"""
+    global _scheduler
+    with _executor_lock:
+        if _scheduler is None:
+            _scheduler = RateLimitScheduler(LLM_MAX_CONCURRENCY)
+        return _scheduler
+
+
+def shared_executor():
+    """スレッドモードで OpenAI 呼び出しに使う、プロセス共有のスレッドプールを返す。
+
+    ステージごと・動画ごとにプールを作らず、同時実行数を LLM_MAX_CONCURRENCY の
+    1か所で調整する。このプールでは API 呼び出し1回分だけを実行し、プール内から
+    さらにプールへ投入して待つことはしない（飽和時のデッドロックを避けるため）。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, LLM_MAX_CONCURRENCY), thread_name_prefix='llm')
+        return _executor
+
+
+def chain_futures(futures, then):
+    """futures がすべて終わったら then(結果のリスト) を呼び、その Future の結果を返す Future を作る。
+
+    then は新たなリクエストを投入して Future を返す関数（map の結果を reduce に渡す用途）。
+    待ち合わせは完了時のコールバックで行うため、共有スレッドプールやイベントループの
+    スレッドをブロックしない。いずれかが失敗したらその例外で終わる。
+    """
+    futures = list(futures)
+    chained = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def forward(source):
+        error = source.exception()
+        if error is not None:
+            chained.set_exception(error)
+        else:
+            chained.set_result(source.result())
+
+    def on_done(_future):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        try:
+            then([f.result() for f in futures]).add_done_callback(forward)
+        except BaseException as e:
+            chained.set_exception(e)
+
+    if not futures:
+        remaining[0] = 1
+        on_done(None)
+    for f in futures:
+        f.add_done_callback(on_done)
+    return chained
+
+
+def _retry_after(error):
+    """エラーレスポンスのヘッダーから待つべき秒数を取り出す（無ければ None）"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    ms = parse_reset_seconds(headers.get('retry-after-ms'))
+    if ms is not None:
+        return ms / 1000
+    for name in ('retry-after', 'x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens'):
+        seconds = parse_reset_seconds(headers.get(name))
+        if seconds is not None:
+            return seconds
+    return None
+
+
+def _is_retryable(error):
+    if isinstance(error, openai.RateLimitError):
+        # 残高不足はいくら待っても回復しない
+        return getattr(error, 'code', None) != 'insufficient_quota'
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _used_tokens(response):
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None)
+
+
+def _set_retries(stats, attempt):
+    if stats is not None:
+        stats['retries'] = attempt
+
+
+def _report_failure(scheduler, model, tokens, error, attempt):
+    """失敗をスケジューラに報告し、再試行するなら待ち時間（秒）、しないなら None を返す"""
+    rate_limited = isinstance(error, openai.RateLimitError)
+    retry_after = _retry_after(error) if rate_limited else None
+    scheduler.release(model, tokens, rate_limited=rate_limited, retry_after=retry_after)
+    if attempt >= LLM_MAX_RETRIES or not _is_retryable(error):
+        return None
+    delay = scheduler.backoff(attempt, retry_after)
+    print(f"  ⏳ {model}: {type(error).__name__} → {delay:.1f} 秒後に再試行 ({attempt + 1}/{LLM_MAX_RETRIES})")
+    return delay
+
+
+def chat_completion(client, model, messages, response_format=None, stats=None):
+    """同期クライアントで chat completions を1回呼ぶ（レート制限に合わせて待機・再試行する）。
+
+    response_format を渡すと Structured Outputs（beta.chat.completions.parse）を使う。
+    生のレスポンスヘッダーから x-ratelimit-* を読むため with_raw_response 経由で呼ぶ。
+    stats（辞書）を渡すと、成否にかかわらず再試行した回数を stats['retries'] に入れる。
+    """
+    scheduler = get_scheduler()
+    tokens = estimate_tokens(messages)
+    attempt = 0
+    while True:
+        scheduler.acquire(model, tokens)
+        try:
+            if response_format is not None:
+                raw = client.beta.chat.completions.with_raw_response.parse(
+                    model=model, messages=messages, response_format=response_format,
+                )
+            else:
+                raw = client.chat.completions.with_raw_response.create(model=model, messages=messages)
+            response = raw.parse()
+        except Exception as e:
+            delay = _report_failure(scheduler, model, tokens, e, attempt)
+            if delay is None:
+                _set_retries(stats, attempt)
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        scheduler.release(model, tokens, used_tokens=_used_tokens(response), headers=raw.headers)
+        _set_retries(stats, attempt)
+        return response
+
+
+class AsyncLLMEngine:
+    """AsyncOpenAI クライアントを専用のイベントループ（バックグラウンドスレッド）で動かす。
+
+    全リクエストが1つのイベントループ・1つの接続プール・1つのセマフォを共有するため、
+    数百件を同時に投げても OS スレッドは増えない。同期コードからは submit() で
+    コルーチンを投入し、concurrent.futures.Future として結果を受け取る。
+    送信の流量はスレッドモードと同じ RateLimitScheduler が調整する。
+    """
+
+    def __init__(self, client, scheduler=None):
+        self.client = client
+        self.scheduler = scheduler or get_scheduler()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='llm-engine', daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """コルーチンをエンジンのイベントループで実行し、concurrent.futures.Future を返す"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def chat(self, model, messages, response_format=None, stats=None):
+        """chat completions を1回呼ぶ（レート制限に合わせて待機・再試行する）。生のレスポンスを返す。
+
+        stats は chat_completion() と同じ（再試行した回数を stats['retries'] に入れる）。
+        """
+        tokens = estimate_tokens(messages)
+        attempt = 0
+        while True:
+            await self.scheduler.acquire_async(model, tokens)
+            try:
+                if response_format is not None:
+                    raw = await self.client.beta.chat.completions.with_raw_response.parse(
+                        model=model, messages=messages, response_format=response_format,
+                    )
+                else:
+                    raw = await self.client.chat.completions.with_raw_response.create(model=model, messages=messages)
+                response = raw.parse()
+            except Exception as e:
+                delay = _report_failure(self.scheduler, model, tokens, e, attempt)
+                if delay is None:
+                    _set_retries(stats, attempt)
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.scheduler.release(model, tokens, used_tokens=_used_tokens(response), headers=raw.headers)
+            _set_retries(stats, attempt)
+            return response
@@ -0,0 +1,209 @@
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+
+# レート上限の初期値（モデルごと）。最初のレスポンスのヘッダーを受け取ると実際の値に置き換える。
+LLM_DEFAULT_RPM = float(os.environ.get('LLM_DEFAULT_RPM', '500'))
+LLM_DEFAULT_TPM = float(os.environ.get('LLM_DEFAULT_TPM', '200000'))
+# 同時実行数の初期値。成功するたびに少しずつ増やし（加算増加）、429 で半分にする（乗算減少）
+LLM_INITIAL_CONCURRENCY = float(os.environ.get('LLM_INITIAL_CONCURRENCY', '4'))
+# 出力トークン数の見積もり（レスポンス受信後に実際の使用量で精算する）
+LLM_EST_OUTPUT_TOKENS = int(os.environ.get('LLM_EST_OUTPUT_TOKENS', '1000'))
+
+# 連続した 429 で何度も半減させないための間隔（秒）
+_DECREASE_INTERVAL = 2.0
+# 同時実行数の空きを待つときの確認間隔（秒）
+_POLL_INTERVAL = 0.05
+
+
+def estimate_tokens(messages, output_tokens=None):
+    """プロンプトの文字数からリクエストのトークン数を見積もる。
+
+    ASCII は約4文字で1トークン、日本語などそれ以外は1文字1トークンとして数える
+    （やや多めの見積もり）。出力分として output_tokens（既定 LLM_EST_OUTPUT_TOKENS）を加える。
+    """
+    if output_tokens is None:
+        output_tokens = LLM_EST_OUTPUT_TOKENS
+    total = 0
+    for m in messages:
+        content = m.get('content') or ''
+        ascii_chars = len(content.encode('ascii', 'ignore'))
+        total += (len(content) - ascii_chars) + ascii_chars // 4 + 4
+    return total + output_tokens
+
+
+def parse_reset_seconds(value):
+    """'1s' / '6m0s' / '20ms' / '0.5' のようなリセット時間を秒に変換する（解釈できなければ None）"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for num, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value):
+        matched = True
+        total += float(num) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return total if matched else None
+
+
+class _TokenBucket:
+    """1分あたり per_minute 個まで補充されるトークンバケット"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """amount 個取り出せるまでの待ち時間（秒）。容量を超える要求は満杯になれば通す。"""
+        self._refill(now)
+        need = min(amount, self.capacity)
+        if self.level >= need:
+            return 0.0
+        return (need - self.level) * 60 / self.capacity
+
+    def take(self, amount):
+        self.level -= amount
+
+    def refund(self, amount):
+        """見積もりとの差分を戻す（負なら追加で差し引く）"""
+        self.level = min(self.capacity, self.level + amount)
+
+    def set_limit(self, per_minute):
+        self.capacity = per_minute
+        self.level = min(self.level, per_minute)
+
+    def clamp(self, remaining):
+        self.level = min(self.level, remaining)
+
+
+class _ModelState:
+    def __init__(self, max_concurrency):
+        self.requests = _TokenBucket(LLM_DEFAULT_RPM)
+        self.tokens = _TokenBucket(LLM_DEFAULT_TPM)
+        self.limit = min(float(max_concurrency), max(1.0, LLM_INITIAL_CONCURRENCY))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+
+
+class RateLimitScheduler:
+    """モデルごとの RPM / TPM トークンバケットと AIMD で OpenAI 呼び出しの流量を調整する。
+
+    acquire() / acquire_async() で送信枠を確保し、結果を release() で報告する。
+    レスポンスヘッダー（x-ratelimit-*）を受け取るとバケットの容量と残量を実際の値に合わせ、
+    成功のたびに同時実行数を 1/limit ずつ増やし、429 を受けたら半分にして
+    retry-after の間そのモデルへの送信を止める。スレッドとイベントループの両方から使える。
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, max_concurrency)
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _state(self, model):
+        st = self._models.get(model)
+        if st is None:
+            st = self._models[model] = _ModelState(self.max_concurrency)
+        return st
+
+    def _try_acquire(self, model, tokens):
+        """送信枠を確保できれば 0、できなければ次に試すまでの待ち時間（秒）を返す"""
+        with self._lock:
+            st = self._state(model)
+            now = time.monotonic()
+            if now < st.blocked_until:
+                return st.blocked_until - now
+            if st.in_flight >= int(st.limit):
+                return _POLL_INTERVAL
+            wait = max(st.requests.wait_time(1, now), st.tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            st.requests.take(1)
+            st.tokens.take(tokens)
+            st.in_flight += 1
+            return 0.0
+
+    def acquire(self, model, tokens):
+        """送信枠が空くまで呼び出し元スレッドで待つ"""
+        while True:
+            wait = self._try_acquire(model, tokens)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, 1.0))
+
+    async def acquire_async(self, model, tokens):
+        """送信枠が空くまでイベントループ上で待つ"""
+        while True:
+            wait = self._try_acquire(model, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, model, estimated, used_tokens=None, headers=None,
+                rate_limited=False, retry_after=None):
+        """送信結果を報告して枠を返す。
+
+        Args:
+            estimated: acquire 時に見積もったトークン数
+            used_tokens: 実際の使用トークン数（分かれば見積もりとの差を精算する）
+            headers: レスポンスヘッダー（x-ratelimit-* を読む）
+            rate_limited: 429 を受けた場合 True
+            retry_after: 429 のとき送信を止める秒数（None なら指数バックオフに任せる）
+        """
+        with self._lock:
+            st = self._state(model)
+            now = time.monotonic()
+            st.in_flight = max(0, st.in_flight - 1)
+            if used_tokens is not None:
+                st.tokens.refund(estimated - used_tokens)
+            elif not rate_limited:
+                # 送信できなかった等で使用量が不明な場合は見積もり分を戻す
+                st.tokens.refund(estimated)
+            if headers is not None:
+                self._apply_headers(st, headers)
+
+            if rate_limited:
+                if now - st.last_decrease >= _DECREASE_INTERVAL:
+                    st.limit = max(1.0, st.limit / 2)
+                    st.last_decrease = now
+                    print(f"  ⏳ {model}: レート制限 → 同時実行数を {int(st.limit)} に減らします")
+                if retry_after:
+                    st.blocked_until = max(st.blocked_until, now + retry_after)
+            elif used_tokens is not None:
+                st.limit = min(float(self.max_concurrency), st.limit + 1 / st.limit)
+
+    def _apply_headers(self, st, headers):
+        def number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        limit_requests = number('x-ratelimit-limit-requests')
+        limit_tokens = number('x-ratelimit-limit-tokens')
+        remaining_requests = number('x-ratelimit-remaining-requests')
+        remaining_tokens = number('x-ratelimit-remaining-tokens')
+        if limit_requests:
+            st.requests.set_limit(limit_requests)
+        if limit_tokens:
+            st.tokens.set_limit(limit_tokens)
+        if remaining_requests is not None:
+            st.requests.clamp(remaining_requests)
+        if remaining_tokens is not None:
+            st.tokens.clamp(remaining_tokens)
+
+    def backoff(self, attempt, retry_after=None):
+        """再試行までの待ち時間（秒）。retry_after があればそれを優先する。"""
+        if retry_after:
+            return retry_after + random.uniform(0, 0.5)
+        return min(30.0, 0.5 * (2 ** attempt)) * random.uniform(0.5, 1.0)
@@ -1,5 +1,6 @@
 import os
 import re
+import asyncio
 import json
 import html
 import shutil
@@ -7,10 +8,19 @@ import glob
 import hashlib
 import urllib.parse
 import math
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from openai import OpenAI
+import time
+import threading
+from concurrent.futures import Future, as_completed
+from openai import OpenAI, AsyncOpenAI
 from pydantic import BaseModel
 from typing import List
+from cache_store import llm_cache_key, load_llm_cache, save_llm_cache, RunCheckpoint
+from llm_engine import AsyncLLMEngine, chat_completion, chain_futures, shared_executor, LLM_ASYNC
+from rate_limiter import estimate_tokens
+from task_graph import TaskGraph
+import tracing
+from transcript import Transcript, TranscriptIndex, overlap_length
+from usage_ledger import UsageLedger, REFERENCE_PRICES, price_cost
 import tkinter as tk
 from tkinter import simpledialog
 
@@ -80,52 +90,54 @@ def get_api_key():
     else:
         raise ValueError("APIキーが設定されていません。")
 
-# APIキーを設定
-apikey = get_api_key()
-print('---apikey set!')
-
-# OpenAIクライアントを初期化
-client = OpenAI(api_key=apikey)
-
 # 使用するモデル（環境変数から取得、デフォルトはgpt-5.2）
 MODEL_NAME = os.environ.get('OPENAI_MODEL', 'gpt-5.2-2025-12-11')
 # Stage 1（分散指示）/ Stage 2（heading指示）で別モデルを使用可能
 MODEL_STAGE1 = os.environ.get('OPENAI_MODEL_STAGE1', MODEL_NAME)
 MODEL_STAGE2 = os.environ.get('OPENAI_MODEL_STAGE2', MODEL_NAME)
 
-# トークン使用量の累計
-total_usage = {'input': 0, 'output': 0}
+# 再実行時、字幕ブロックの変更割合がこれ以下なら前回の Stage 1 アウトラインを再利用し、
+# 内容の変わったセクションだけを Stage 2 で要約し直す（差分再要約）
+INCREMENTAL_MAX_CHANGE = float(os.environ.get('INCREMENTAL_MAX_CHANGE', '0.3'))
 
-def count_tokens(response):
-    """APIレスポンスからトークン数を取得して累計に加算"""
-    usage = response.usage
-    input_tokens = usage.prompt_tokens
-    output_tokens = usage.completion_tokens
+# 1 にすると Stage 1 の全区間を待たず、境界の確定したセクションから順に Stage 2 を開始する
+STAGE_PIPELINE = os.environ.get('STAGE_PIPELINE', '0') == '1'
 
-    # 累計に加算
-    total_usage['input'] += input_tokens
-    total_usage['output'] += output_tokens
+# Stage 2 の1リクエストあたりの入力トークン上限（プロンプトの文字数からローカルで見積もる）。
+# 超えるセクションは字幕ブロックの境目で分割して並列に要約し、短い統合リクエストでまとめる
+STAGE2_MAX_INPUT_TOKENS = int(os.environ.get('STAGE2_MAX_INPUT_TOKENS', '8000'))
 
-    return input_tokens, output_tokens
+# 詳細モードの1リクエストあたりの字幕の量（見積もりトークン数）。詳細テキストは入力と
+# ほぼ同じ長さを出力するため、章ごと・この量ごとに分けて並列に生成する
+DETAIL_CHUNK_TOKENS = int(os.environ.get('DETAIL_CHUNK_TOKENS', '3000'))
 
-def print_token_summary():
-    """トークン使用量の累計を表示"""
-    input_tok = total_usage['input']
-    output_tok = total_usage['output']
+# OpenAIクライアントはプロセス内で共有する（スレッドセーフ・接続プールを共有）
+_client = None
+_client_lock = threading.Lock()
 
-    # 通常モデル（入力$1.75/1M、出力$14.00/1M）
-    normal_cost = (input_tok / 1_000_000) * 1.75 + (output_tok / 1_000_000) * 14.00
-    # 安価モデル（入力$0.25/1M、出力$2.00/1M）
-    cheap_cost = (input_tok / 1_000_000) * 0.25 + (output_tok / 1_000_000) * 2.00
+def get_client():
+    """共有 OpenAI クライアントを返す。初回呼び出し時にAPIキーを読み込んで初期化する。"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            apikey = get_api_key()
+            print('---apikey set!')
+            # 再試行は llm_engine 側でレート制限に合わせて行うため、SDK の自動再試行は切る
+            _client = OpenAI(api_key=apikey, max_retries=0)
+        return _client
 
-    print(f"\n=== API使用量サマリー ===")
-    print(f"入力トークン: {input_tok:,}")
-    print(f"出力トークン: {output_tok:,}")
-    print(f"合計トークン: {input_tok + output_tok:,}")
-    print(f"価格目安: 通常モデル ${normal_cost:.4f} / 安価モデル ${cheap_cost:.4f}")
+_engine = None
 
-# グローバル変数
-url_base = ""
+def get_async_engine():
+    """共有の非同期エンジン（AsyncOpenAI + 専用イベントループ）を返す。
+
+    全動画・全ステージの OpenAI 呼び出しが1つの接続プールとレート制御を共有する。
+    """
+    global _engine
+    with _client_lock:
+        if _engine is None:
+            _engine = AsyncLLMEngine(AsyncOpenAI(api_key=get_api_key(), max_retries=0))
+        return _engine
 
 def get_vtt_duration_in_seconds(vtt_lines):
     last_time = None
@@ -217,25 +229,19 @@ def _seconds_to_label(sec: int) -> str:
     return f"{m}分{s}秒"
 
 
-def _dedup_join(texts) -> str:
+def _dedup_join(texts, max_overlap: int = 50) -> str:
     """字幕の連続テキスト断片を、重複・部分重なりを除去して連結する。
 
-    build_section_text のマージロジックと同じ（マーカー処理なし版）。
+    TranscriptIndex の重複除去と同じ規則（マーカー処理なし版）。
     """
     merged = []
     for text in texts:
         if merged and text == merged[-1]:
             continue
         if merged:
-            prev = merged[-1]
-            max_overlap = min(len(prev), len(text), 50)
-            overlap_found = False
-            for overlap_len in range(max_overlap, 2, -1):
-                if prev.endswith(text[:overlap_len]):
-                    merged[-1] = prev + text[overlap_len:]
-                    overlap_found = True
-                    break
-            if overlap_found:
+            overlap = overlap_length(merged[-1], text, max_overlap)
+            if overlap:
+                merged[-1] += text[overlap:]
                 continue
         merged.append(text)
     return ' '.join(merged)
@@ -275,6 +281,36 @@ def build_blocks(vtt_entries, target_block_sec: float = 10.0):
     return blocks
 
 
+def _hash_text(*parts) -> str:
+    """任意の値の並びから短い内容ハッシュを作る（チェックポイントのキー用）"""
+    joined = "\x1f".join(str(p) for p in parts)
+    return hashlib.sha1(joined.encode('utf-8')).hexdigest()[:16]
+
+
+def fingerprint_blocks(blocks) -> list:
+    """build_blocks の各ブロックを（開始秒・テキスト）の短いハッシュにする。
+
+    字幕の修正が入ったブロックだけハッシュが変わるので、前回実行時の
+    フィンガープリントと比べれば変更箇所をブロック単位で特定できる。
+    """
+    return [_hash_text(f"{start_sec:.3f}", text) for _bid, start_sec, text in blocks]
+
+
+def section_fingerprints(blocks, fingerprints, outline) -> list:
+    """各セクションの時間範囲に含まれるブロックのフィンガープリントをまとめたハッシュを返す"""
+    sections = outline.sections
+    n = len(sections)
+    grouped = [[] for _ in range(n)]
+    idx = 0
+    for (_bid, start_sec, _text), fp in zip(blocks, fingerprints):
+        # ブロックは時刻順なので、区間の終端を越えたら次のセクションへ進める
+        while idx + 1 < n and start_sec >= sections[idx + 1].start_seconds:
+            idx += 1
+        if n:
+            grouped[idx].append(fp)
+    return [_hash_text(*fps) for fps in grouped]
+
+
 def _render_blocks(blocks, lo: int, hi: int) -> str:
     """blocks[lo:hi] を「[id] (M:SS) テキスト」形式の文字列にする。
 
@@ -288,53 +324,92 @@ def _render_blocks(blocks, lo: int, hi: int) -> str:
     return "\n".join(lines)
 
 
+def _transcript_index(vtt_entries) -> TranscriptIndex:
+    """vtt_entries の時間範囲索引を返す（Transcript なら作成済みのものを使い回す）"""
+    if isinstance(vtt_entries, Transcript):
+        return vtt_entries.index()
+    return TranscriptIndex(vtt_entries)
+
+
 def build_section_text(vtt_entries, start_sec: int, end_sec: int, timestamps: bool = True) -> str:
     """指定時間範囲の字幕テキストを抽出して返す。
 
     timestamps=True のとき約60秒ごとに [MM:SS] マーカーを挿入する（Stage 1用）。
     timestamps=False のときテキストのみ返す（Stage 2用）。
+    重複除去は TranscriptIndex で字幕全体に対して一度だけ行い、ここでは範囲を二分探索で
+    切り出すだけなので、セクション数が多くても字幕全体を繰り返し走査しない。
     """
-    texts = []
-    last_marker_sec = -999
+    result = _transcript_index(vtt_entries).text(start_sec, end_sec, marker_interval=60 if timestamps else None)
+    # JSON シリアライズを壊す制御文字を除去（null バイト・改行以外の制御文字）
+    result = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]', '', result)
+    return result
 
-    for entry_start, _entry_end, text in vtt_entries:
-        if entry_start < start_sec:
-            continue
-        if entry_start >= end_sec:
-            break
 
-        if timestamps and entry_start - last_marker_sec >= 60:
-            m, s = divmod(int(entry_start), 60)
-            texts.append(f"[{m:02d}:{s:02d}]")
-            last_marker_sec = entry_start
+def _completed(value):
+    """結果が決まっている Future を返す（chain_futures の then から値をそのまま返す用）"""
+    future = Future()
+    future.set_result(value)
+    return future
 
-        texts.append(text)
 
-    # 重複除去（get_subtitle_for_range と同じロジック）
-    merged = []
-    for text in texts:
-        if text.startswith('[') and text.endswith(']'):
-            merged.append(text)
-            continue
-        if merged and text == merged[-1]:
-            continue
-        if merged and not (merged[-1].startswith('[') and merged[-1].endswith(']')):
-            prev = merged[-1]
-            max_overlap = min(len(prev), len(text), 50)
-            overlap_found = False
-            for overlap_len in range(max_overlap, 2, -1):
-                if prev.endswith(text[:overlap_len]):
-                    merged[-1] = prev + text[overlap_len:]
-                    overlap_found = True
-                    break
-            if overlap_found:
-                continue
-        merged.append(text)
+def split_section_ranges(blocks, start_sec, end_sec, text_budget: int) -> list:
+    """セクション [start_sec, end_sec) を字幕ブロックの境目で、各部分の字幕が
+    text_budget トークン程度に収まるよう分割し、[(開始秒, 終了秒), ...] を返す。
 
-    result = ' '.join(merged)
-    # JSON シリアライズを壊す制御文字を除去（null バイト・改行以外の制御文字）
-    result = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]', '', result)
-    return result
+    部分の数は必要最小限にし、各部分の量がそろうように切る（最も遅い部分が
+    全体の待ち時間を決めるため）。分割不要なら1要素のリストを返す。
+    """
+    inside = [(start, estimate_tokens([{"content": text}], output_tokens=0))
+              for _bid, start, text in blocks if start_sec <= start < end_sec]
+    total = sum(tokens for _start, tokens in inside)
+    n_parts = min(len(inside), math.ceil(total / max(1, text_budget)))
+    if n_parts <= 1:
+        return [(start_sec, end_sec)]
+
+    target = total / n_parts
+    cuts = []
+    acc = 0
+    for start, tokens in inside:
+        if acc >= target * (len(cuts) + 1) and len(cuts) < n_parts - 1:
+            cuts.append(start)
+        acc += tokens
+    edges = [start_sec] + cuts + [end_sec]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _window_entries(blocks, lo: int, hi: int, win_outline) -> list:
+    """Stage 1 の1区間分の結果を [(ブロックID, 見出し), ...] にする（区間内へクランプ）"""
+    lo_id, hi_id = blocks[lo][0], blocks[hi - 1][0]
+    entries = []
+    for s in win_outline.sections:
+        bid = max(lo_id, min(hi_id, s.start_block_id))
+        entries.append((bid, (s.heading or "").strip() or "（無題）"))
+    return entries
+
+
+def merge_window_entries(blocks, window_entries) -> list:
+    """区間ごとの結果を時系列に結合し、_Section のリストにする。
+
+    window_entries は先頭の区間から順に並べたリスト（途中までの区間でもよい）。
+    ブロックIDで重複排除し（先勝ち）、ブロックの実タイムスタンプへ変換する。
+    区間は互いに重ならないので、先頭からの一部だけを結合しても、その範囲の
+    セクションは全区間を結合した場合と同じになる。
+    """
+    block_start = {bid: start_sec for bid, start_sec, _t in blocks}
+    merged = {}  # block_id -> heading（先勝ち）
+    for entries in window_entries:
+        for bid, heading in entries:
+            merged.setdefault(bid, heading)
+
+    # 先頭は必ずブロック0始まりにする
+    first_bid = blocks[0][0]
+    if first_bid not in merged:
+        merged[first_bid] = next(iter(merged.values())) if merged else "導入"
+
+    return [
+        _Section(heading=merged[bid], start_seconds=int(block_start[bid]))
+        for bid in sorted(merged)
+    ]
 
 
 def _validate_outline(outline: _OutlineResult, video_duration_sec: int) -> bool:
@@ -351,210 +426,651 @@ def _validate_outline(outline: _OutlineResult, video_duration_sec: int) -> bool:
     return True
 
 
-def stage1_get_outline(vtt_entries, title: str, video_duration_sec: int, description: str = None) -> _OutlineResult:
-    """Stage 1: VTT全体からセクションのアウトライン（見出し＋開始秒数）を取得する。
+def assemble_markdown(outline: _OutlineResult, summaries: list, title: str) -> str:
+    """アウトラインとセクション要約から最終 Markdown を組み立てる。
 
-    LLMの long-context 特性（中盤の注意が薄れ、分割が前半に偏る）を避けるため、
-    字幕を時間でほぼ等分した「窓」に分け、各窓へ時間比例のセクション数ノルマを
-    与えて並列に切り分ける（map方式）。境界は秒数ではなくブロックIDで返させ、
-    ブロックの実タイムスタンプへ逆引きするので、推測による誤差が入らない。
+    見出しは Stage 2 が生成した結論を含む一行要約を使用する。
+    txt_to_html() が期待する形式:
+      ## タイトル
+      ### 見出し（動画：X分Y秒頃）
+      本文
+      以上
     """
-    blocks = build_blocks(vtt_entries)
-    n_blocks = len(blocks)
-    if n_blocks == 0:
-        raise ValueError("Stage 1: 字幕ブロックが空です。")
+    lines = [f"## {title}", ""]
+    for sec, result in zip(outline.sections, summaries):
+        label = _seconds_to_label(sec.start_seconds)
+        heading = result.heading if isinstance(result, _SectionSummary) else sec.heading
+        body = result.summary if isinstance(result, _SectionSummary) else (result or "")
+        lines.append(f"### {heading}（動画：{label}頃）")
+        lines.append(body)
+        lines.append("")
+    lines.append("以上")
+    return "\n".join(lines)
 
-    block_start = {bid: start_sec for bid, start_sec, _t in blocks}
 
-    duration_min = max(video_duration_sec // 60, 1)
-    # 目標セクション総数（おおむね2分に1個、5〜20の範囲）
-    target_total = min(max(round(duration_min / 2), 5), 20)
-    target_total = min(target_total, n_blocks)
+class SummaryPipeline:
+    """1本の動画の要約処理に必要な状態（クライアント・モデル設定・URL・使用量）を持つ。
 
-    # 窓数: 1窓あたり約5セクション。窓を小さく保つことで各ブロックが必ず
-    # どこかの窓の「フォーカス内」に入り、中盤の見落とし・前半偏重を防ぐ。
-    n_windows = max(1, math.ceil(target_total / 5))
-    n_windows = min(n_windows, n_blocks)
+    状態をモジュールのグローバル変数に置かないため、動画ごとにインスタンスを作れば
+    1つの常駐プロセスで複数の動画を別スレッドから同時に要約しても URL やトークン数が
+    混ざらない。クライアントは既定で get_client() の共有インスタンスを使う。
+    """
 
-    # ブロックを n_windows 個の連続レンジへ等分（ブロック数ベース＝ほぼ時間等分）
-    bounds = [round(i * n_blocks / n_windows) for i in range(n_windows + 1)]
+    def __init__(self, client=None, url_base: str = "", model_name: str = None,
+                 model_stage1: str = None, model_stage2: str = None, output_dir: str = None,
+                 engine=None):
+        # engine（AsyncLLMEngine）があれば全呼び出しを非同期エンジン経由で行う
+        self.engine = engine if engine is not None else (get_async_engine() if LLM_ASYNC else None)
+        self.client = client or (None if self.engine is not None else get_client())
+        self.url_base = url_base
+        self.model_name = model_name or MODEL_NAME
+        self.model_stage1 = model_stage1 or MODEL_STAGE1
+        self.model_stage2 = model_stage2 or MODEL_STAGE2
+        # リクエストごとの使用量・所要時間・再試行回数（各ステージのワーカースレッドから記録される）
+        self.ledger = UsageLedger()
+        # 出力フォルダ内のステージ途中結果（None なら保存・再利用しない）
+        self.checkpoint = RunCheckpoint(output_dir) if output_dir else None
+
+    def count_tokens(self, response):
+        """APIレスポンスからトークン数（入力・出力・入力のうちキャッシュ済み）を取得"""
+        usage = response.usage
+        input_tokens = usage.prompt_tokens
+        output_tokens = usage.completion_tokens
+        # cached は入力のうちプロバイダのプロンプトキャッシュに当たった分
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', None) or 0
+        return input_tokens, output_tokens, cached_tokens
+
+    def print_token_summary(self):
+        """トークン使用量の累計とステージ別の内訳を表示"""
+        totals = self.ledger.totals()
+        input_tok = totals['input']
+        output_tok = totals['output']
+        cached_tok = totals['cached']
+
+        print(f"\n=== API使用量サマリー ===")
+        print(f"入力トークン: {input_tok:,}")
+        if input_tok:
+            print(f"  うちキャッシュ済み: {cached_tok:,}（{cached_tok / input_tok * 100:.0f}%）")
+        print(f"出力トークン: {output_tok:,}")
+        print(f"合計トークン: {input_tok + output_tok:,}")
+        estimates = [f"{name} ${price_cost(price, input_tok, output_tok):.4f}"
+                     for name, price in REFERENCE_PRICES.items()]
+        print(f"価格目安: {' / '.join(estimates)}")
+
+        summary = self.ledger.summary()
+        summary.pop('total', None)
+        if summary:
+            print("ステージ別:")
+        for stage, s in summary.items():
+            latency = (f" / p50 {s['latency_p50']:.1f}s・p95 {s['latency_p95']:.1f}s"
+                       if s['latency_p50'] is not None else "")
+            notes = []
+            if s['cache_hits']:
+                notes.append(f"キャッシュ {s['cache_hits']}")
+            if s['retries']:
+                notes.append(f"再試行 {s['retries']}")
+            if s['errors']:
+                notes.append(f"失敗 {s['errors']}")
+            note = f"（{'・'.join(notes)}）" if notes else ""
+            print(f"  {stage}: {s['requests']}件{note} 入力 {s['input_tokens']:,} / "
+                  f"出力 {s['output_tokens']:,}{latency}")
+
+    def write_run_report(self, output_dir, title, wall_seconds):
+        """リクエストごとの記録とステージ別の集計を output_dir/run_report.json に書き出す"""
+        path = os.path.join(output_dir, 'run_report.json')
+        try:
+            self.ledger.write_report(
+                path,
+                title=title,
+                models={
+                    "default": self.model_name,
+                    "stage1": self.model_stage1,
+                    "stage2": self.model_stage2,
+                },
+                wall_seconds=round(wall_seconds, 3),
+            )
+        except OSError as e:
+            print(f"⚠️ 実行レポートの書き出しに失敗: {e}")
+            return None
+        print(f"📊 実行レポート: {path}")
+        return path
 
-    system_prompt = (
-        "あなたは動画字幕の構造分析スペシャリストです。"
-        "渡された区間だけを読み、話題の切れ目を正確に識別します。"
-    )
-    desc_block = (
-        f"\n【動画のDescription（参考情報）】\n{description}\n"
-        if description else ""
-    )
+    def _cached_result(self, key, model, response_format, label, stage):
+        """LLM 応答キャッシュにあれば結果を返す（無ければ None）"""
+        cached = load_llm_cache(key)
+        if cached is None:
+            return None
+        self._record(stage, model, outcome='cache')
+        if label:
+            print(f"  {label}: キャッシュを使用")
+        return response_format.model_validate(cached) if response_format is not None else cached
+
+    def _record(self, stage, model, *args, **kwargs):
+        """リクエスト1件分を使用量の記録に追加し、同じ内容をトレースのスパンにも付ける"""
+        entry = self.ledger.record(stage, model, *args, **kwargs)
+        tracing.annotate(**entry)
+        return entry
+
+    def _record_failure(self, model, stage, started, stats):
+        """再試行しても失敗したリクエストを記録する"""
+        self._record(stage, model, latency=time.perf_counter() - started,
+                     retries=stats.get('retries', 0), outcome='error')
+
+    def _finish_response(self, key, response, response_format, label, model, stage, started, stats):
+        """APIレスポンスから結果を取り出し、使用量の記録とキャッシュ保存を行う"""
+        latency = time.perf_counter() - started
+        if response_format is not None:
+            result = response.choices[0].message.parsed
+            data = result.model_dump()
+        else:
+            result = response.choices[0].message.content
+            data = result
+
+        in_tok, out_tok, cached_tok = self.count_tokens(response)
+        self._record(stage, model, in_tok, out_tok, cached_tok,
+                     latency=latency, retries=stats.get('retries', 0))
+        if label:
+            cached_note = f"（キャッシュ {cached_tok:,}）" if cached_tok else ""
+            print(f"  {label}: 入力 {in_tok:,}{cached_note} / 出力 {out_tok:,} トークン")
+        # 応答本文が無い場合（拒否など）はキャッシュしない
+        if data is not None:
+            save_llm_cache(key, data)
+        return result
 
-    def segment_window(win_idx):
-        lo, hi = bounds[win_idx], bounds[win_idx + 1]
-        # 窓のノルマ＝総数をブロック数で時間比例配分（最低1）
-        quota = max(1, round(target_total * (hi - lo) / n_blocks))
-        first_id, last_id = blocks[lo][0], blocks[hi - 1][0]
-        block_text = _render_blocks(blocks, lo, hi)
-        user_prompt = (
-            f"以下は動画「{title}」字幕の一部（全{n_windows}区間中の第{win_idx+1}区間）です。\n"
+    def _chat(self, model, messages, response_format=None, label=None, stage=None, span=None):
+        """chat completions 呼び出しの共通入口（呼び出し元スレッドで結果を待つ）。
+
+        model・messages・response_format が前回と完全に同じなら LLM 応答キャッシュの
+        結果を返し、API を呼ばない。response_format（Pydantic モデル）を渡すと
+        Structured Outputs でパースした結果を、省略時は本文テキストを返す。
+        label を渡すとトークン数（またはキャッシュ使用）を表示する。
+        stage は使用量の記録（self.ledger）に付けるステージ名、span はトレースの
+        スパン名（省略時は stage）。
+        """
+        if self.engine is not None:
+            return self.submit_chat(model, messages, response_format, label, stage, span).result()
+
+        with tracing.span(span or stage or 'llm'):
+            key = llm_cache_key(model, messages, response_format)
+            cached = self._cached_result(key, model, response_format, label, stage)
+            if cached is not None:
+                return cached
+
+            stats = {}
+            started = time.perf_counter()
+            try:
+                response = chat_completion(self.client, model, messages, response_format, stats=stats)
+            except Exception:
+                self._record_failure(model, stage, started, stats)
+                raise
+            return self._finish_response(key, response, response_format, label, model, stage, started, stats)
+
+    async def _achat(self, model, messages, response_format=None, label=None, stage=None, span=None):
+        """_chat の非同期版（AsyncLLMEngine のイベントループ上で実行される）
+
+        LLM 応答キャッシュの読み書き（保存時は容量超過分の削除で全走査することもある）は
+        ディスク I/O でループを止め、全動画の送信中リクエストを待たせてしまうため、
+        asyncio.to_thread でループの外のスレッドに逃がす。
+        """
+        with tracing.span(span or stage or 'llm'):
+            key = llm_cache_key(model, messages, response_format)
+            cached = await asyncio.to_thread(self._cached_result, key, model, response_format, label, stage)
+            if cached is not None:
+                return cached
+            stats = {}
+            started = time.perf_counter()
+            try:
+                response = await self.engine.chat(model, messages, response_format, stats=stats)
+            except Exception:
+                self._record_failure(model, stage, started, stats)
+                raise
+            return await asyncio.to_thread(self._finish_response, key, response, response_format, label,
+                                           model, stage, started, stats)
+
+    def submit_chat(self, model, messages, response_format=None, label=None, stage=None, span=None):
+        """_chat を並列実行用に投入し、concurrent.futures.Future を返す。
+
+        非同期モードではエンジンのイベントループにコルーチンとして、スレッドモードでは
+        プロセス共有のスレッドプールに投入する。どちらも送信の流量は全ステージ・
+        全動画で共有する RateLimitScheduler が調整する。トレースのスパンは投入元の
+        スパンの子として記録される。
+        """
+        if self.engine is not None:
+            return self.engine.submit(tracing.bind(self._achat(model, messages, response_format, label, stage, span)))
+        return shared_executor().submit(tracing.wrap(self._chat), model, messages, response_format, label, stage, span)
+
+    def stage1_get_outline(self, vtt_entries, title: str, video_duration_sec: int, description: str = None,
+                           blocks=None, on_window=None) -> _OutlineResult:
+        """Stage 1: VTT全体からセクションのアウトライン（見出し＋開始秒数）を取得する。
+
+        LLMの long-context 特性（中盤の注意が薄れ、分割が前半に偏る）を避けるため、
+        字幕を時間でほぼ等分した「窓」に分け、各窓へ時間比例のセクション数ノルマを
+        与えて並列に切り分ける（map方式）。境界は秒数ではなくブロックIDで返させ、
+        ブロックの実タイムスタンプへ逆引きするので、推測による誤差が入らない。
+
+        on_window を渡すと、窓が1つ終わるたびに on_window(window_entries) を呼ぶ
+        （window_entries は窓番号順のリストで、未完了の窓は None）。
+        """
+        if blocks is None:
+            blocks = build_blocks(vtt_entries)
+        n_blocks = len(blocks)
+        if n_blocks == 0:
+            raise ValueError("Stage 1: 字幕ブロックが空です。")
+
+        duration_min = max(video_duration_sec // 60, 1)
+        # 目標セクション総数（おおむね2分に1個、5〜20の範囲）
+        target_total = min(max(round(duration_min / 2), 5), 20)
+        target_total = min(target_total, n_blocks)
+
+        # 窓数: 1窓あたり約5セクション。窓を小さく保つことで各ブロックが必ず
+        # どこかの窓の「フォーカス内」に入り、中盤の見落とし・前半偏重を防ぐ。
+        n_windows = max(1, math.ceil(target_total / 5))
+        n_windows = min(n_windows, n_blocks)
+
+        # ブロックを n_windows 個の連続レンジへ等分（ブロック数ベース＝ほぼ時間等分）
+        bounds = [round(i * n_blocks / n_windows) for i in range(n_windows + 1)]
+
+        system_prompt = (
+            "あなたは動画字幕の構造分析スペシャリストです。"
+            "渡された区間だけを読み、話題の切れ目を正確に識別します。"
+        )
+        desc_block = (
+            f"\n【動画のDescription（参考情報）】\n{description}\n"
+            if description else ""
+        )
+
+        # 全区間で共通の部分（指示・description）を先頭に置き、区間ごとに変わる部分
+        # （区間番号・ノルマ・ブロックID・字幕）を末尾にまとめる。先頭がバイト単位で
+        # 同じになるので、プロバイダのプロンプトキャッシュが2区間目以降に効く。
+        shared_prompt = (
+            f"動画「{title}」の字幕を区間ごとに読み、話題の切れ目でセクションに分割しています。\n"
             f"各行は「[ブロックID] (時刻) テキスト」の形式です。\n"
-            f"この区間を話題の切れ目で {quota} 個のセクションに分割してください。\n"
             f"{desc_block}\n"
             f"【ルール】\n"
-            f"- セクションはちょうど {quota} 個にしてください。\n"
+            f"- セクション数は【今回の区間】で指定する数ちょうどにしてください。\n"
             f"- start_block_id には、その話題が始まる行の【ブロックID】を指定してください"
-            f"（この区間内 {first_id}〜{last_id} のいずれか）。秒数ではなくブロックIDです。\n"
-            f"- 最初のセクションの start_block_id は必ず {first_id} にしてください。\n"
+            f"（区間内のいずれか）。秒数ではなくブロックIDです。\n"
             f"- start_block_id は昇順で、重複させないでください。\n"
             f"- heading は日本語で、その話題を端的に表す20字以内にしてください。\n"
-            f"\n字幕（ブロックID付き）:\n{block_text}"
         )
-        response = client.beta.chat.completions.parse(
-            model=MODEL_STAGE1,
-            messages=[
+
+        def window_messages(win_idx):
+            lo, hi = bounds[win_idx], bounds[win_idx + 1]
+            # 窓のノルマ＝総数をブロック数で時間比例配分（最低1）
+            quota = max(1, round(target_total * (hi - lo) / n_blocks))
+            first_id, last_id = blocks[lo][0], blocks[hi - 1][0]
+            block_text = _render_blocks(blocks, lo, hi)
+            user_prompt = (
+                f"{shared_prompt}\n"
+                f"【今回の区間】\n"
+                f"- 全{n_windows}区間中の第{win_idx+1}区間です（ブロックID {first_id}〜{last_id}）。\n"
+                f"- この区間を話題の切れ目でちょうど {quota} 個のセクションに分割してください。\n"
+                f"- 最初のセクションの start_block_id は必ず {first_id} にしてください。\n"
+                f"\n字幕（ブロックID付き）:\n{block_text}"
+            )
+            return [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
-            ],
-            response_format=_WindowOutline,
-        )
-        count_tokens(response)
-        return win_idx, lo, hi, response.choices[0].message.parsed
+            ]
+
+        window_entries = [None] * n_windows
+        futures = {
+            self.submit_chat(self.model_stage1, window_messages(i), _WindowOutline, stage='stage1',
+                             span=f"stage1.window{i+1}"): i
+            for i in range(n_windows)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                parsed = future.result()
+            except Exception as e:
+                print(f"  [Stage 1] 第{i+1}区間でエラー: {e} → 再試行中...")
+                parsed = self._chat(self.model_stage1, window_messages(i), response_format=_WindowOutline,
+                                    stage='stage1', span=f"stage1.window{i+1}")
+            window_entries[i] = _window_entries(blocks, bounds[i], bounds[i + 1], parsed)
+            if on_window is not None:
+                on_window(window_entries)
+
+        # 窓の結果を時系列に結合（ブロックIDで重複排除し、実秒へ変換）
+        sections = merge_window_entries(blocks, window_entries)
+        outline = _OutlineResult(sections=sections)
+        print(f"  [Stage 1] {n_windows}区間から{len(sections)}セクションを検出")
+        return outline
+
+    def reuse_outline(self, fingerprints, title: str, description: str = None):
+        """前回実行時のアウトラインを再利用できれば返す（できなければ None）。
+
+        モデル・タイトル・description が同じで、字幕ブロックの変更割合が
+        INCREMENTAL_MAX_CHANGE 以下のときだけ再利用する。字幕が同一なら
+        Stage 1 を丸ごと省略でき、小さな修正なら章立てを保ったまま差分だけ再要約できる。
+        """
+        if self.checkpoint is None:
+            return None
+        state = self.checkpoint.load('stage1')
+        if not state:
+            return None
+        if (state.get('model') != self.model_stage1 or state.get('title') != title
+                or state.get('description') != _hash_text(description or "")):
+            return None
 
-    results = [None] * n_windows
-    if n_windows == 1:
-        results[0] = segment_window(0)
-    else:
-        with ThreadPoolExecutor(max_workers=min(5, n_windows)) as executor:
-            futures = {executor.submit(segment_window, i): i for i in range(n_windows)}
-            for future in as_completed(futures):
-                i = futures[future]
-                try:
-                    results[i] = future.result()
-                except Exception as e:
-                    print(f"  [Stage 1] 第{i+1}区間でエラー: {e} → 再試行中...")
-                    results[i] = segment_window(i)
+        old = set(state.get('blocks', []))
+        new = set(fingerprints)
+        changed = max(len(new - old), len(old - new))
+        ratio = changed / max(len(new), len(old), 1)
+        if ratio > INCREMENTAL_MAX_CHANGE:
+            print(f"  [Stage 1] 字幕の変更が大きいため（{ratio*100:.0f}%）アウトラインを作り直します")
+            return None
 
-    # 窓の結果を時系列に結合（ブロックIDで重複排除し、実秒へ変換）
-    merged = {}  # block_id -> heading（先勝ち）
-    for win_idx, lo, hi, win_outline in sorted(results, key=lambda r: r[0]):
-        lo_id, hi_id = blocks[lo][0], blocks[hi - 1][0]
-        for s in win_outline.sections:
-            bid = max(lo_id, min(hi_id, s.start_block_id))  # 区間内へクランプ
-            merged.setdefault(bid, (s.heading or "").strip() or "（無題）")
+        outline = _OutlineResult.model_validate(state['outline'])
+        if changed:
+            print(f"  [Stage 1] 字幕の変更 {changed} ブロック → 前回のアウトラインを再利用")
+        else:
+            print("  [Stage 1] 字幕に変更なし → 前回のアウトラインを再利用")
+        return outline
 
-    # 先頭は必ずブロック0始まりにする
-    first_bid = blocks[0][0]
-    if first_bid not in merged:
-        merged[first_bid] = next(iter(merged.values())) if merged else "導入"
+    def save_outline(self, outline: _OutlineResult, fingerprints, title: str, description: str = None):
+        """Stage 1 のアウトラインを、比較用のブロックフィンガープリントと一緒に保存する"""
+        if self.checkpoint is None:
+            return
+        self.checkpoint.save('stage1', {
+            "model": self.model_stage1,
+            "title": title,
+            "description": _hash_text(description or ""),
+            "blocks": list(fingerprints),
+            "outline": outline.model_dump(),
+        })
 
-    sections = [
-        _Section(heading=merged[bid], start_seconds=int(block_start[bid]))
-        for bid in sorted(merged)
-    ]
-    outline = _OutlineResult(sections=sections)
-    print(f"  [Stage 1] {n_windows}区間から{len(sections)}セクションを検出")
-    return outline
-
-
-def stage2_summarize_section(section: _Section, section_text: str,
-                              outline: _OutlineResult, title: str, idx: int, description: str = None) -> _SectionSummary:
-    """Stage 2: 1セクション分の字幕テキストを要約して _SectionSummary を返す"""
-    n = len(outline.sections)
-    outline_list = "\n".join(
-        f"{i+1}. {s.heading}（{_seconds_to_label(s.start_seconds)}〜）"
-        for i, s in enumerate(outline.sections)
-    )
+    def stage2_summarize_section(self, section: _Section, section_text: str,
+                                 outline: _OutlineResult, title: str, idx: int, description: str = None) -> _SectionSummary:
+        """Stage 2: 1セクション分の字幕テキストを要約して _SectionSummary を返す"""
+        messages = self.stage2_messages(section, section_text, outline, title, idx, description=description)
+        return self._chat(self.model_stage2, messages, response_format=_SectionSummary, stage='stage2',
+                          span=f"stage2.section{idx+1}")
+
+    def submit_stage2(self, vtt_entries, outline: _OutlineResult, idx: int, title: str,
+                      description: str = None, blocks=None, partial: bool = False):
+        """Stage 2 の1セクションを投入し、_SectionSummary を返す Future を返す。
+
+        リクエストの見積もり入力トークン数が STAGE2_MAX_INPUT_TOKENS を超える場合は、
+        セクションを字幕ブロックの境目で分割して各部分を並列に要約（map）し、
+        全部分が終わったら見出しと冒頭の結論だけを作る短い統合リクエスト（reduce）を
+        投げる。本文は部分ごとの要約を順につなげる。
+        """
+        sections = outline.sections
+        sec = sections[idx]
+        end_sec = sections[idx + 1].start_seconds if idx + 1 < len(sections) else float('inf')
+        section_text = build_section_text(vtt_entries, sec.start_seconds, end_sec, timestamps=False)
+        messages = self.stage2_messages(sec, section_text, outline, title, idx,
+                                        description=description, partial=partial)
+        estimated = estimate_tokens(messages, output_tokens=0)
+        span = f"stage2.section{idx+1}"
+        if estimated <= STAGE2_MAX_INPUT_TOKENS:
+            return self.submit_chat(self.model_stage2, messages, _SectionSummary, stage='stage2', span=span)
+
+        if blocks is None:
+            blocks = build_blocks(vtt_entries)
+        overhead = estimated - estimate_tokens([{"content": section_text}], output_tokens=0)
+        text_budget = max(STAGE2_MAX_INPUT_TOKENS - overhead, STAGE2_MAX_INPUT_TOKENS // 4)
+        ranges = split_section_ranges(blocks, sec.start_seconds, end_sec, text_budget)
+        if len(ranges) <= 1:
+            return self.submit_chat(self.model_stage2, messages, _SectionSummary, stage='stage2', span=span)
+
+        print(f"  [Stage 2] セクション {idx+1} は長いため {len(ranges)} 分割して要約"
+              f"（見積もり {estimated:,} トークン）")
+        part_futures = []
+        for k, (lo, hi) in enumerate(ranges):
+            part_text = build_section_text(vtt_entries, lo, hi, timestamps=False)
+            part_messages = self.stage2_messages(sec, part_text, outline, title, idx, description=description,
+                                                 partial=partial, part=(k, len(ranges), lo, hi))
+            part_futures.append(self.submit_chat(self.model_stage2, part_messages, _SectionSummary, stage='stage2',
+                                                 span=f"{span}.part{k+1}"))
+
+        def reduce(parts):
+            reduce_messages = self.stage2_reduce_messages(sec, parts, outline, title, idx, description=description)
+            lead_future = self.submit_chat(self.model_stage2, reduce_messages, _SectionSummary,
+                                           stage='stage2_reduce', span=f"{span}.reduce")
+            body = "\n\n".join(p.summary.strip() for p in parts)
+            return chain_futures([lead_future], lambda leads: _completed(_SectionSummary(
+                heading=leads[0].heading,
+                summary=(leads[0].summary.strip() + "\n\n" + body).strip(),
+            )))
+
+        # reduce は最後に終わった部分のコールバックから呼ばれるので、ここのスパンを引き継がせる
+        return chain_futures(part_futures, tracing.wrap(reduce))
+
+    def stage2_reduce_messages(self, section: _Section, parts: list,
+                               outline: _OutlineResult, title: str, idx: int, description: str = None) -> list:
+        """分割要約した部分の結果から、セクション全体の見出しと冒頭の結論を作るリクエストを組み立てる"""
+        n = len(outline.sections)
+        end_sec = outline.sections[idx + 1].start_seconds if idx + 1 < n else None
+        start_label = _seconds_to_label(section.start_seconds)
+        end_label = _seconds_to_label(end_sec) if end_sec else "動画終端"
+        listing = "\n\n".join(
+            f"第{k+1}部\n見出し: {p.heading}\n本文:\n{p.summary}"
+            for k, p in enumerate(parts)
+        )
+        user_prompt = (
+            f"動画「{title}」のセクション{idx+1}「{section.heading}」（{start_label}〜{end_label}）は長いため、"
+            f"{len(parts)}部に分けて要約しました。以下はその部分ごとの要約です。\n\n"
+            f"{listing}\n\n"
+            f"これらをまとめたセクション全体の heading と、冒頭に置く summary を作成してください。\n\n"
+            f"【headingのルール】\n"
+            f"- 「何についての話か」＋「その結論・評価」を20〜40字の一文で表してください。\n"
+            f"- 単なるトピックラベル（「○○の紹介」「○○について」）にはしないでください。\n\n"
+            f"【summaryのルール】\n"
+            f"- セクション全体で最も重要な結論・事実を1〜2文で直接述べてください。\n"
+            f"- 部分ごとの本文はこのあとにそのまま続けて表示するので、繰り返したり要約し直したりしないでください。\n"
+            f"- 文体は常体で、小見出しや箇条書きは使わないでください。"
+        )
+        return [
+            {"role": "system", "content": "あなたは動画字幕のセクション要約スペシャリストです。"},
+            {"role": "user", "content": user_prompt},
+        ]
 
-    end_sec = (outline.sections[idx + 1].start_seconds
-               if idx + 1 < n else None)
-    start_label = _seconds_to_label(section.start_seconds)
-    end_label = _seconds_to_label(end_sec) if end_sec else "動画終端"
-
-    system_prompt = (
-        "あなたは動画字幕のセクション要約スペシャリストです。\n"
-        "指定されたセクションの字幕を、内容を損なわず読みやすく要約します。\n"
-        "前のセクションで紹介された用語は再定義不要です。\n"
-        "文体は常体（だ・ます調ではなく）で書いてください。\n"
-        "ただし「〜である」を機械的に文末に付けないでください。\n"
-        "「〜する」「〜している」「〜なる」「〜だ」など、自然な常体の語尾を使い分けてください。"
-    )
+    def stage2_messages(self, section: _Section, section_text: str,
+                        outline: _OutlineResult, title: str, idx: int, description: str = None,
+                        partial: bool = False, part=None) -> list:
+        """Stage 2 の1セクション分のリクエスト（messages）を組み立てる
 
-    desc_block = (
-        f"\n【動画のDescription（参考情報）】\n{description}\n"
-        if description else ""
-    )
-    user_prompt = (
-        f"動画「{title}」の要約を作成しています。\n"
-        f"以下は動画全体のアウトライン（全{n}セクション）です：\n\n"
-        f"{outline_list}\n"
-        f"{desc_block}\n"
-        f"今回はセクション{idx+1}「{section.heading}」（{start_label}〜{end_label}）を要約してください。\n\n"
-        f"【headingのルール】\n"
-        f"- 「何についての話か」＋「その結論・評価」を20〜40字の一文で表してください。\n"
-        f"- 商品・人物・技術の紹介や評価が中心の内容では、対象の名前や種別を先に示し、続けて結論・評価を書いてください。\n"
-        f"  例：「○○（商品名）は旨味はあるが塩気が強くそのままではしょっぱめ」\n"
-        f"- 議論・解説・手順など対象が明確でない場合は、何が明らかになったかを結論として書いてください。\n"
-        f"- 単なるトピックラベル（「○○の紹介」「○○について」）にはしないでください。\n\n"
-        f"【summaryのルール】\n"
-        f"- このセクションの字幕テキストのみを扱ってください。他のセクションの内容は含めないでください。\n"
-        f"- 要約ではなくリライトとして扱ってください。元の意味・結論・温度感を保ちながら、重複・言い換え・枝葉の説明を整理して引き締めてください。\n"
-        f"  字数を削ることを目的にせず、冗長をなくすことで自然に締まった文章にしてください。\n"
-        f"- まず1文で、このセクションの最も重要な結論・事実を直接述べてください。\n"
-        f"  「本セクションでは〜が説明された」のようなメタ記述は避け、内容を直接書いてください。\n"
-        f"- 話題ごとに段落を分け、必要に応じて各段落の冒頭に短い小見出しを付けてください。\n"
-        f"  小見出しは `####` 形式で書いてください（例：`#### 音楽の評価`）。\n"
-        f"  小見出しを閉じるための単独の `####` 行は出力しないでください。\n"
-        f"  小見出しは分類名ではなく、その段落の要点が分かる表現にしてください。\n"
-        f"  小見出しだけ追っても、大まかな流れが分かるようにしてください。\n"
-        f"- 原則として本文は自然な文章で整えてください。\n"
-        f"  事実の列挙・比較・条件・注意点など、箇条書きのほうが明らかに読みやすい場合に限って使ってよいですが、前後の文脈が切れないようにしてください。\n"
-        f"- 1文を長くしすぎず、必要に応じて分割してください。関連する内容は同じ段落にまとめ、意味のないところで改行しないこと。\n"
-        f"- 具体例や補足が複数ある場合は代表例だけ残してよいですが、主張の根拠が失われないようにしてください。\n"
-        f"- 元のテキストの重要な論拠・専門用語を保持してください。\n"
-        f"- 見出し行は不要です（呼び出し元が付けます）。\n"
-        f"- Markdown形式で出力してください。\n\n"
-        f"セクションの字幕テキスト:\n{section_text}"
-    )
+        partial=True は、outline が冒頭から途中までしか確定していないことを示す
+        （Stage 1 とのパイプライン実行時）。
+        part=(k, 部分数, 開始秒, 終了秒) を渡すと、長いセクションを分割したうちの
+        第 k 部分（0始まり）だけを要約するリクエストにする。
+        """
+        n = len(outline.sections)
+        outline_list = "\n".join(
+            f"{i+1}. {s.heading}（{_seconds_to_label(s.start_seconds)}〜）"
+            for i, s in enumerate(outline.sections)
+        )
 
-    response = client.beta.chat.completions.parse(
-        model=MODEL_STAGE2,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        response_format=_SectionSummary,
-    )
-    count_tokens(response)
-    return response.choices[0].message.parsed
+        end_sec = (outline.sections[idx + 1].start_seconds
+                   if idx + 1 < n else None)
+        start_label = _seconds_to_label(section.start_seconds)
+        end_label = _seconds_to_label(end_sec) if end_sec else "動画終端"
+
+        system_prompt = (
+            "あなたは動画字幕のセクション要約スペシャリストです。\n"
+            "指定されたセクションの字幕を、内容を損なわず読みやすく要約します。\n"
+            "前のセクションで紹介された用語は再定義不要です。\n"
+            "文体は常体（だ・ます調ではなく）で書いてください。\n"
+            "ただし「〜である」を機械的に文末に付けないでください。\n"
+            "「〜する」「〜している」「〜なる」「〜だ」など、自然な常体の語尾を使い分けてください。"
+        )
 
+        desc_block = (
+            f"\n【動画のDescription（参考情報）】\n{description}\n"
+            if description else ""
+        )
+        # 全セクションで共通の部分（アウトライン・description・ルール）を先頭に置き、
+        # セクションごとに変わる部分（対象の指定と字幕）を末尾にまとめる。先頭がバイト単位で
+        # 同じになるので、プロバイダのプロンプトキャッシュが2セクション目以降に効く。
+        if part is None:
+            target_line = f"今回はセクション{idx+1}「{section.heading}」（{start_label}〜{end_label}）を要約してください。\n\n"
+            lead_rule = (
+                "- 本文の冒頭では、まず1文で、このセクションの最も重要な結論・事実を直接述べてください。\n"
+                "  「本セクションでは〜が説明された」のようなメタ記述は避け、内容を直接書いてください。\n"
+            )
+        else:
+            k, n_parts, part_start, part_end = part
+            part_end_label = _seconds_to_label(int(part_end)) if part_end != float('inf') else end_label
+            target_line = (
+                f"今回はセクション{idx+1}「{section.heading}」（{start_label}〜{end_label}）を"
+                f"{n_parts}部に分けたうちの第{k+1}部（{_seconds_to_label(int(part_start))}〜{part_end_label}）を要約してください。\n"
+                f"heading はこの部分の内容について付けてください。\n\n"
+            )
+            lead_rule = (
+                "- セクション全体の結論文は別途付けるので、冒頭の結論文は書かずに小見出しから始めてください。\n"
+                "- 前後の部分とつなげて表示するので、「前半では」「続いて」のような部分のつなぎの記述は不要です。\n"
+            )
+        outline_label = (
+            f"以下は動画のアウトラインのうち、冒頭から確定している{n}セクションです（以降は未確定）：\n\n"
+            if partial else
+            f"以下は動画全体のアウトライン（全{n}セクション）です：\n\n"
+        )
+        user_prompt = (
+            f"動画「{title}」の要約を作成しています。\n"
+            f"{outline_label}"
+            f"{outline_list}\n"
+            f"{desc_block}\n"
+            f"【headingのルール】\n"
+            f"- 「何についての話か」＋「その結論・評価」を20〜40字の一文で表してください。\n"
+            f"- 商品・人物・技術の紹介や評価が中心の内容では、対象の名前や種別を先に示し、続けて結論・評価を書いてください。\n"
+            f"  例：「○○（商品名）は旨味はあるが塩気が強くそのままではしょっぱめ」\n"
+            f"- 議論・解説・手順など対象が明確でない場合は、何が明らかになったかを結論として書いてください。\n"
+            f"- 単なるトピックラベル（「○○の紹介」「○○について」）にはしないでください。\n\n"
+            f"【summaryのルール】\n"
+            f"- このセクションの字幕テキストのみを扱ってください。他のセクションの内容は含めないでください。\n"
+            f"- 要約ではなくリライトとして扱ってください。元の意味・結論・温度感を保ちながら、重複・言い換え・枝葉の説明を整理して引き締めてください。\n"
+            f"  字数を削ることを目的にせず、冗長をなくすことで自然に締まった文章にしてください。\n"
+            f"- 話題ごとに段落を分け、必要に応じて各段落の冒頭に短い小見出しを付けてください。\n"
+            f"  小見出しは `####` 形式で書いてください（例：`#### 音楽の評価`）。\n"
+            f"  小見出しを閉じるための単独の `####` 行は出力しないでください。\n"
+            f"  小見出しは分類名ではなく、その段落の要点が分かる表現にしてください。\n"
+            f"  小見出しだけ追っても、大まかな流れが分かるようにしてください。\n"
+            f"- 原則として本文は自然な文章で整えてください。\n"
+            f"  事実の列挙・比較・条件・注意点など、箇条書きのほうが明らかに読みやすい場合に限って使ってよいですが、前後の文脈が切れないようにしてください。\n"
+            f"- 1文を長くしすぎず、必要に応じて分割してください。関連する内容は同じ段落にまとめ、意味のないところで改行しないこと。\n"
+            f"- 具体例や補足が複数ある場合は代表例だけ残してよいですが、主張の根拠が失われないようにしてください。\n"
+            f"- 元のテキストの重要な論拠・専門用語を保持してください。\n"
+            f"- 見出し行は不要です（呼び出し元が付けます）。\n"
+            f"- Markdown形式で出力してください。\n"
+            f"{lead_rule}\n"
+            f"{target_line}"
+            f"セクションの字幕テキスト:\n{section_text}"
+        )
 
-def stage2_summarize_all_parallel(vtt_entries, outline: _OutlineResult, title: str, description: str = None) -> list:
-    """Stage 2: 全セクションを ThreadPoolExecutor で並列要約する。
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
 
-    戻り値: セクション順に並んだ要約文字列のリスト
-    """
-    sections = outline.sections
-    n = len(sections)
-    results = [None] * n
+    def stage2_launcher(self, vtt_entries, title: str, description: str = None, blocks=None):
+        """Stage 1 の窓が終わるたびに Stage 2 を先行投入するコールバックを作る（STAGE_PIPELINE=1）。
 
-    def task(idx):
-        sec = sections[idx]
-        end_sec = sections[idx + 1].start_seconds if idx + 1 < n else float('inf')
-        section_text = build_section_text(vtt_entries, sec.start_seconds, end_sec, timestamps=False)
-        summary = stage2_summarize_section(sec, section_text, outline, title, idx, description=description)
-        return idx, summary
+        セクションの終了は次のセクションの開始で決まるため、窓 w のセクションは
+        先頭から窓 w+1 までが揃った時点で境界が確定する。その時点で Stage 2 を投入し、
+        プロンプトには確定済みのアウトライン（冒頭〜窓 w+1）を渡す。窓の完了順に
+        よらず同じプロンプトになるので、LLM 応答キャッシュも効く。
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(task, i): i for i in range(n)}
+        戻り値: (on_window, launched)。on_window は stage1_get_outline に渡し、
+        launched（セクション開始秒 → Future）は stage2_summarize_all_parallel に渡す。
+        """
+        if blocks is None:
+            blocks = build_blocks(vtt_entries)
+        launched = {}
+        next_window = [0]
+
+        def on_window(window_entries):
+            n_windows = len(window_entries)
+            before = len(launched)
+            prefix = 0
+            while prefix < n_windows and window_entries[prefix] is not None:
+                prefix += 1
+            while next_window[0] < prefix:
+                w = next_window[0]
+                if w + 1 < n_windows and prefix < w + 2:
+                    break
+                partial = w + 2 < n_windows
+                context = merge_window_entries(blocks, window_entries[:w + 2])
+                own = {sec.start_seconds for sec in merge_window_entries(blocks, window_entries[:w + 1])}
+                outline = _OutlineResult(sections=context)
+                for idx, sec in enumerate(context):
+                    if sec.start_seconds in launched or sec.start_seconds not in own:
+                        continue
+                    if partial and idx + 1 == len(context):
+                        break  # 次の窓が空で終了が未確定（次の窓の番で投入する）
+                    launched[sec.start_seconds] = self.submit_stage2(vtt_entries, outline, idx, title,
+                                                                     description=description, blocks=blocks,
+                                                                     partial=partial)
+                next_window[0] += 1
+            if len(launched) > before:
+                print(f"  [Stage 2] {len(launched) - before}セクションを先行投入（Stage 1 実行中）")
+
+        return on_window, launched
+
+    def stage2_summarize_all_parallel(self, vtt_entries, outline: _OutlineResult, title: str, description: str = None,
+                                      blocks=None, launched=None) -> list:
+        """Stage 2: 全セクションを並列要約する（submit_chat で共有の同時実行枠に投入）。
+
+        チェックポイントが有効なら、各セクションの結果をそのセクションに含まれる
+        字幕ブロックのフィンガープリントと一緒に保存し、再実行時は内容の変わって
+        いないセクションの要約をそのまま再利用する。
+        launched（stage2_launcher で先行投入した Future）にあるセクションは、
+        新たに投入せずその結果を待つ。
+
+        戻り値: セクション順に並んだ要約文字列のリスト
+        """
+        sections = outline.sections
+        n = len(sections)
+        results = [None] * n
+
+        # セクションごとのチェックポイント名（入力が変われば名前も変わる）
+        keys = [None] * n
+        if self.checkpoint is not None:
+            if blocks is None:
+                blocks = build_blocks(vtt_entries)
+            sec_fps = section_fingerprints(blocks, fingerprint_blocks(blocks), outline)
+            outline_key = _hash_text(*(f"{s.start_seconds}|{s.heading}" for s in sections))
+            context_key = _hash_text(self.model_stage2, title, description or "", outline_key)
+            keys = [f"stage2_{_hash_text(context_key, i, fp)}" for i, fp in enumerate(sec_fps)]
+            reused = 0
+            for i, key in enumerate(keys):
+                data = self.checkpoint.load(key)
+                if data:
+                    results[i] = _SectionSummary.model_validate(data)
+                    reused += 1
+            if reused:
+                print(f"  [Stage 2] 変更のない {reused}/{n} セクションは前回の要約を再利用")
+            # 今回使わないセクションの古い結果は削除する
+            for name in self.checkpoint.names("stage2_"):
+                if name not in keys:
+                    self.checkpoint.remove(name)
+
+        def submit(idx):
+            return self.submit_stage2(vtt_entries, outline, idx, title, description=description, blocks=blocks)
+
+        def finish(idx, summary):
+            results[idx] = summary
+            if keys[idx]:
+                self.checkpoint.save(keys[idx], summary.model_dump())
+
+        pending = [i for i in range(n) if results[i] is None]
+        launched = launched or {}
+        futures = {
+            (launched.get(sections[i].start_seconds)
+             or submit(i)): i
+            for i in pending
+        }
         for future in as_completed(futures):
+            idx = futures[future]
             try:
-                idx, summary = future.result()
-                results[idx] = summary
+                finish(idx, future.result())
                 print(f"  [Stage 2] セクション {idx+1}/{n} 完了")
             except Exception as e:
-                idx = futures[future]
                 print(f"  [Stage 2] セクション {idx+1}/{n} でエラー: {e} → リトライ中...")
                 try:
-                    _, results[idx] = task(idx)
+                    finish(idx, submit(idx).result())
                     print(f"  [Stage 2] セクション {idx+1}/{n} リトライ成功")
                 except Exception as e2:
                     print(f"  [Stage 2] セクション {idx+1}/{n} リトライ失敗: {e2}")
@@ -563,180 +1079,467 @@ def stage2_summarize_all_parallel(vtt_entries, outline: _OutlineResult, title: s
                         summary="（このセクションの要約を生成できませんでした）"
                     )
 
-    return results
-
-
-def stage3_polish(outline: _OutlineResult, summaries: list, title: str):
-    """Pass 3: 全セクションの見出し＋本文を一度に俯瞰し、見出しを横断的に整え、
-    実質同じ話題の隣接セクションを統合する。
-
-    並列のStage 2では原理的に不可能な「全体を見た上での」整合をここで行う。
-    本文は再生成せず（情報欠落・出力コスト増を避ける）、見出しと統合フラグのみを
-    LLMに返させる。失敗・不整合時は入力をそのまま返す（安全側フォールバック）。
-
-    戻り値: (新しい _OutlineResult, 新しい summaries[_SectionSummary])
-    """
-    n = len(outline.sections)
-    if n == 0:
-        return outline, summaries
+        return results
 
-    def heading_of(sec, res):
-        return res.heading if isinstance(res, _SectionSummary) else sec.heading
+    def stage3_polish(self, outline: _OutlineResult, summaries: list, title: str):
+        """Pass 3: 全セクションの見出し＋本文を一度に俯瞰し、見出しを横断的に整え、
+        実質同じ話題の隣接セクションを統合する。
 
-    def body_of(res):
-        return res.summary if isinstance(res, _SectionSummary) else (res or "")
+        並列のStage 2では原理的に不可能な「全体を見た上での」整合をここで行う。
+        本文は再生成せず（情報欠落・出力コスト増を避ける）、見出しと統合フラグのみを
+        LLMに返させる。失敗・不整合時は入力をそのまま返す（安全側フォールバック）。
 
-    headings = [heading_of(sec, res) for sec, res in zip(outline.sections, summaries)]
-    bodies = [body_of(res) for res in summaries]
-
-    listing = "\n\n".join(
-        f"{i+1}.\n見出し: {headings[i]}\n本文: {bodies[i]}"
-        for i in range(n)
-    )
-    system_prompt = (
-        "あなたは動画要約の編集者です。全セクションを俯瞰し、見出しを統一感のある"
-        "形に整え、実質同じ話題の隣接セクションを統合判断します。"
-    )
-    user_prompt = (
-        f"以下は動画「{title}」の全{n}セクションの見出しと本文です。\n"
-        f"全体を俯瞰して、各セクションの見出しを整えてください。\n\n"
-        f"【目的】\n"
-        f"- 各見出しは「対象＋結論・評価」を含む20〜40字の一文にし、語調と粒度をそろえる。\n"
-        f"- 見出しだけを上から読めば動画全体の流れが分かるようにする。\n"
-        f"- 直前のセクションと実質同じ話題（分割しすぎ）なら merge_with_previous=true にする。\n\n"
-        f"【制約】\n"
-        f"- 入力と同じ数（{n}個）・同じ順番で sections を返してください。"
-        f"統合する場合も枠は残し、merge_with_previous=true で示してください。\n"
-        f"- 先頭セクションの merge_with_previous は必ず false にしてください。\n"
-        f"- 本文は返さなくて構いません（見出しと統合フラグのみ）。\n\n"
-        f"セクション一覧:\n{listing}"
-    )
-    try:
-        response = client.beta.chat.completions.parse(
-            model=MODEL_STAGE1,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            response_format=_PolishResult,
+        戻り値: (新しい _OutlineResult, 新しい summaries[_SectionSummary])
+        """
+        n = len(outline.sections)
+        if n == 0:
+            return outline, summaries
+
+        def heading_of(sec, res):
+            return res.heading if isinstance(res, _SectionSummary) else sec.heading
+
+        def body_of(res):
+            return res.summary if isinstance(res, _SectionSummary) else (res or "")
+
+        headings = [heading_of(sec, res) for sec, res in zip(outline.sections, summaries)]
+        bodies = [body_of(res) for res in summaries]
+
+        # 入力（アウトライン・見出し・本文）が同じなら前回の整合結果を再利用する
+        ckpt_key = _hash_text(self.model_stage1, title, *(f"{s.start_seconds}|{h}|{b}" for s, h, b in zip(outline.sections, headings, bodies)))
+        if self.checkpoint is not None:
+            saved = self.checkpoint.load('stage3', key=ckpt_key)
+            if saved:
+                print("  [Stage 3] 前回の整合結果を再利用")
+                return (_OutlineResult.model_validate(saved['outline']),
+                        [_SectionSummary.model_validate(x) for x in saved['summaries']])
+
+        listing = "\n\n".join(
+            f"{i+1}.\n見出し: {headings[i]}\n本文: {bodies[i]}"
+            for i in range(n)
         )
-        count_tokens(response)
-        polished = response.choices[0].message.parsed.sections
-    except Exception as e:
-        print(f"  [Stage 3] 整合に失敗（元の見出しを使用）: {e}")
-        return outline, summaries
-
-    if len(polished) != n:
-        print(f"  [Stage 3] 返却数が不一致（{len(polished)}≠{n}）→ 元の見出しを使用")
-        return outline, summaries
-
-    new_sections = []
-    new_summaries = []
-    for i in range(n):
-        new_heading = (polished[i].heading or "").strip() or headings[i]
-        merge = polished[i].merge_with_previous and i > 0 and bool(new_summaries)
-        if merge:
-            # 直前セクションへ本文を連結（見出し・開始秒は直前を維持）
-            prev = new_summaries[-1]
-            prev.summary = (prev.summary.rstrip() + "\n\n" + bodies[i]).strip()
-        else:
-            new_sections.append(_Section(
-                heading=new_heading,
-                start_seconds=outline.sections[i].start_seconds,
-            ))
-            new_summaries.append(_SectionSummary(heading=new_heading, summary=bodies[i]))
-
-    merged_count = n - len(new_sections)
-    print(f"  [Stage 3] 見出しを整え、{merged_count}セクションを統合")
-    return _OutlineResult(sections=new_sections), new_summaries
-
-
-def assemble_markdown(outline: _OutlineResult, summaries: list, title: str) -> str:
-    """アウトラインとセクション要約から最終 Markdown を組み立てる。
-
-    見出しは Stage 2 が生成した結論を含む一行要約を使用する。
-    txt_to_html() が期待する形式:
-      ## タイトル
-      ### 見出し（動画：X分Y秒頃）
-      本文
-      以上
-    """
-    lines = [f"## {title}", ""]
-    for sec, result in zip(outline.sections, summaries):
-        label = _seconds_to_label(sec.start_seconds)
-        heading = result.heading if isinstance(result, _SectionSummary) else sec.heading
-        body = result.summary if isinstance(result, _SectionSummary) else (result or "")
-        lines.append(f"### {heading}（動画：{label}頃）")
-        lines.append(body)
-        lines.append("")
-    lines.append("以上")
-    return "\n".join(lines)
+        system_prompt = (
+            "あなたは動画要約の編集者です。全セクションを俯瞰し、見出しを統一感のある"
+            "形に整え、実質同じ話題の隣接セクションを統合判断します。"
+        )
+        # 動画によらない指示を先頭に置き、動画ごとの部分（タイトル・セクション数・一覧）を
+        # 末尾にまとめる（プロンプトキャッシュが効く共通の先頭を長くする）
+        user_prompt = (
+            f"動画の全セクションの見出しと本文を渡します。\n"
+            f"全体を俯瞰して、各セクションの見出しを整えてください。\n\n"
+            f"【目的】\n"
+            f"- 各見出しは「対象＋結論・評価」を含む20〜40字の一文にし、語調と粒度をそろえる。\n"
+            f"- 見出しだけを上から読めば動画全体の流れが分かるようにする。\n"
+            f"- 直前のセクションと実質同じ話題（分割しすぎ）なら merge_with_previous=true にする。\n\n"
+            f"【制約】\n"
+            f"- 入力と同じ数・同じ順番で sections を返してください。"
+            f"統合する場合も枠は残し、merge_with_previous=true で示してください。\n"
+            f"- 先頭セクションの merge_with_previous は必ず false にしてください。\n"
+            f"- 本文は返さなくて構いません（見出しと統合フラグのみ）。\n\n"
+            f"以下は動画「{title}」の全{n}セクション（{n}個を返してください）です。\n"
+            f"セクション一覧:\n{listing}"
+        )
+        try:
+            polished = self._chat(
+                self.model_stage1,
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                response_format=_PolishResult,
+                stage='stage3',
+            ).sections
+        except Exception as e:
+            print(f"  [Stage 3] 整合に失敗（元の見出しを使用）: {e}")
+            return outline, summaries
+
+        if len(polished) != n:
+            print(f"  [Stage 3] 返却数が不一致（{len(polished)}≠{n}）→ 元の見出しを使用")
+            return outline, summaries
+
+        new_sections = []
+        new_summaries = []
+        for i in range(n):
+            new_heading = (polished[i].heading or "").strip() or headings[i]
+            merge = polished[i].merge_with_previous and i > 0 and bool(new_summaries)
+            if merge:
+                # 直前セクションへ本文を連結（見出し・開始秒は直前を維持）
+                prev = new_summaries[-1]
+                prev.summary = (prev.summary.rstrip() + "\n\n" + bodies[i]).strip()
+            else:
+                new_sections.append(_Section(
+                    heading=new_heading,
+                    start_seconds=outline.sections[i].start_seconds,
+                ))
+                new_summaries.append(_SectionSummary(heading=new_heading, summary=bodies[i]))
+
+        merged_count = n - len(new_sections)
+        print(f"  [Stage 3] 見出しを整え、{merged_count}セクションを統合")
+        new_outline = _OutlineResult(sections=new_sections)
+        if self.checkpoint is not None:
+            self.checkpoint.save('stage3', {
+                "outline": new_outline.model_dump(),
+                "summaries": [x.model_dump() for x in new_summaries],
+            }, key=ckpt_key)
+        return new_outline, new_summaries
+
+    def yoyaku_gemini(self, transcript, title, output_html_path, images=None, detail_text=None, thumbnail_path=None,
+                      images_future=None, description=None, raw_description=None, detail_mode=False,
+                      llm_slots=None):
+        """字幕（Transcript）を要約してHTMLを生成する（3パス方式）
+
+        タイトル和訳・description フィルタ・Stage 1〜3・ポイント生成・詳細テキスト・
+        ストーリーボード待ち・HTML生成を依存グラフ（TaskGraph）として実行し、
+        互いに依存しない処理は並列に進める。
+
+        images_future: concurrent.futures.Future を渡すと、HTML生成直前に
+                       images_future.result() → (images, thumbnail_path) として解決する。
+                       ストーリーボードダウンロードと要約を並列実行するために使用。
+        raw_description: 未整理の description。渡すとグラフ内でフィルタしてから使う
+                         （description には整理済みのものを直接渡せる）。
+        detail_mode: True なら詳細テキストもグラフ内で生成する。
+        llm_slots: 複数の動画で共有する要約スロット（バッチ時の _summary_slots）。渡すと
+                   LLM を呼ぶ処理の間だけ確保し、ストーリーボード待ちと HTML 生成の前に返す。
+        """
+        # Transcript は (start, end, text) の反復を返すので、そのまま vtt_entries として使う
+        vtt_entries = transcript
+        video_duration_sec = transcript.duration
+        with tracing.span('build_blocks', cues=len(transcript)):
+            blocks = build_blocks(vtt_entries)
+            transcript.index()  # Stage 2 の各セクションが共有する時間範囲索引を先に作っておく
+            fingerprints = fingerprint_blocks(blocks)
+
+        print(f'要約中（Stage1: {self.model_stage1} / Stage2: {self.model_stage2}）')
+
+        # ── タイトル和訳（英語タイトルに日本語訳を付加）────────────────────────
+        def title_task():
+            print('  [Title] 和訳確認中...')
+            display_title = self.make_display_title(title)
+            if display_title != title:
+                print(f'  [Title] {display_title}')
+            return display_title
+
+        # ── description の整理（Stage 1 / 2 のプロンプトと HTML に使う）────────
+        def description_task():
+            if raw_description is not None:
+                return self.prepare_description(raw_description, title)
+            return description
+
+        # ── 詳細テキスト（詳細モードの場合のみ。章立ては Stage 1 に合わせる）────
+        def detail_task(outline):
+            if not detail_mode:
+                return detail_text
+            print('\n詳細テキストを生成中...')
+            return self.generate_detail_text(transcript, title, outline, blocks=blocks)
+
+        # ── ストーリーボード（並列ダウンロードの完了待ち）──────────────────────
+        def storyboard_task():
+            if images_future is None:
+                return images, thumbnail_path
+            with tracing.span('images_future.result'):
+                return images_future.result()
+
+        # ── Stage 1: アウトライン取得（AIプロンプトには原題を使用）────────────
+        # 前回の実行結果があり字幕の変更が小さければ、そのアウトラインを再利用する
+        launchers = []  # STAGE_PIPELINE 時に先行投入した Stage 2 の Future（開始秒 → Future）
+
+        def stage1_task(desc):
+            outline = self.reuse_outline(fingerprints, title, description=desc)
+            if outline is None:
+                print('  [Stage 1] アウトライン生成中...')
+                on_window = None
+                if STAGE_PIPELINE:
+                    # 境界の確定したセクションから Stage 2 を先行投入する
+                    on_window, launched = self.stage2_launcher(vtt_entries, title, description=desc, blocks=blocks)
+                    launchers.append(launched)
+                outline = self.stage1_get_outline(vtt_entries, title, video_duration_sec, description=desc,
+                                                  blocks=blocks, on_window=on_window)
+            self.save_outline(outline, fingerprints, title, description=desc)
+            return outline
+
+        # ── Stage 2: セクション並列要約 ────────────────────────────────────────
+        def stage2_task(outline, desc):
+            print(f'  [Stage 2] {len(outline.sections)}セクションを並列要約中...')
+            return self.stage2_summarize_all_parallel(vtt_entries, outline, title, description=desc,
+                                                      blocks=blocks, launched=launchers[0] if launchers else None)
+
+        # ── Stage 3: 全体整合（見出しの統一・分割しすぎの統合）──────────────────
+        def stage3_task(outline, summaries, display_title):
+            print('  [Stage 3] 全体整合中...')
+            return self.stage3_polish(outline, summaries, display_title)
+
+        # ── ハイライト生成（Stage 2 の結果だけを使い、Stage 3 と並行）───────────
+        def highlights_task(outline, summaries):
+            print('  [Highlights] ポイント生成中...')
+            return self.generate_highlights(title, assemble_markdown(outline, summaries, title))
+
+        # ── Markdown 組み立て（表示用タイトルを使用）と HTML 生成 ───────────────
+        def render_task(display_title, desc, detail, storyboard, polished, highlights):
+            outline, summaries = polished
+            responseA_text = assemble_markdown(outline, summaries, display_title)
+            result = highlights.split('\n') + ['\n'] + [self.url_base] + responseA_text.split('\n')
+            images, thumbnail_path = storyboard
+            with tracing.span('txt_to_html'):
+                txt_to_html(result, output_html_path, self.url_base, images, detail, thumbnail_path, vtt_entries,
+                            display_title, description=desc)
+
+        # ── 要約スロットの返却（LLM を呼ぶ処理がすべて終わった時点）───────────────
+        held = [False]
+
+        def release_slots():
+            if held[0]:
+                held[0] = False
+                llm_slots.release()
+
+        def llm_done_task(*_):
+            release_slots()
+
+        graph = TaskGraph()
+        graph.add('title', title_task)
+        graph.add('description', description_task)
+        graph.add('storyboard', storyboard_task)
+        graph.add('stage1', stage1_task, deps=('description',))
+        graph.add('detail', detail_task, deps=('stage1',))
+        graph.add('stage2', stage2_task, deps=('stage1', 'description'))
+        graph.add('stage3', stage3_task, deps=('stage1', 'stage2', 'title'))
+        graph.add('highlights', highlights_task, deps=('stage1', 'stage2'))
+        graph.add('render', render_task,
+                  deps=('title', 'description', 'detail', 'storyboard', 'stage3', 'highlights'))
+        graph.add('llm_done', llm_done_task, deps=('title', 'description', 'detail', 'stage3', 'highlights'))
+        if llm_slots is not None:
+            with tracing.span('wait_summary_slot'):
+                llm_slots.acquire()
+            held[0] = True
+        try:
+            graph.run()
+        finally:
+            release_slots()
+
+    def generate_highlights(self, title: str, summary_text: str) -> str:
+        """要約全体から「動画のポイント」（200字程度）を生成する"""
+        ckpt_key = _hash_text(self.model_name, title, summary_text)
+        if self.checkpoint is not None:
+            saved = self.checkpoint.load('highlights', key=ckpt_key)
+            if saved:
+                print("  ポイント: 前回の結果を再利用")
+                return saved
+
+        highlights_messages = [
+            {"role": "user", "content": f"以下は動画「{title}」の要約です。\n\n{summary_text}"},
+            {"role": "assistant", "content": "要約を確認しました。"},
+            {
+                "role": "user",
+                "content": "では、その内容の興味深いポイントをまとめて。200文字程度で日本語で。「動画のポイント」という見出しを付けて。この講演に興味を持つ人が特記したいような内容を。全般的でなくとも、特徴的な点を。またこっちは文末に「以上」は不要。"
+            },
+        ]
+        text = self._chat(self.model_name, highlights_messages, label="ポイント", stage='highlights')
+        if self.checkpoint is not None and text:
+            self.checkpoint.save('highlights', text, key=ckpt_key)
+        return text
+
+    def generate_detail_text(self, transcript, title, outline: _OutlineResult, blocks=None):
+        """字幕（Transcript）から詳細テキストを生成
+
+        字幕を Stage 1 のアウトラインの章ごとに分け、長い章はさらに字幕ブロックの境目で
+        DETAIL_CHUNK_TOKENS 程度に分けて、すべて並列に整形する。VTT のタイムコード行は
+        送らず、本文のテキストだけを渡す。結果は時刻順につなげ、章の見出し
+        （### 見出し（X分Y秒〜））はアウトラインに合わせてこちらで付ける。
+        字幕の無い範囲（字幕ブロックの無い章など）はリクエストを送らずに飛ばす。
+        """
+        if blocks is None:
+            blocks = build_blocks(transcript)
+        sections = outline.sections
+        chunks = []  # (章番号, 部分番号, 部分数, 字幕テキスト)
+        for idx, sec in enumerate(sections):
+            end_sec = sections[idx + 1].start_seconds if idx + 1 < len(sections) else float('inf')
+            texts = []
+            for lo, hi in split_section_ranges(blocks, sec.start_seconds, end_sec, DETAIL_CHUNK_TOKENS):
+                text = build_section_text(transcript, lo, hi, timestamps=False)
+                if text.strip():
+                    texts.append(text)
+            for k, text in enumerate(texts):
+                chunks.append((idx, k, len(texts), text))
+
+        if not chunks:
+            print("詳細テキストを生成する字幕がありません")
+            return None
 
+        def messages_for(chunk):
+            idx, k, n_parts, text = chunk
+            position = f"（この章を{n_parts}部に分けたうちの第{k+1}部）" if n_parts > 1 else ""
+            format_prompt = (
+                "字幕のテキストを整形し、 必要なら和訳して、読みやすい日本語の文章にして。"
+                "内容は省略せず、ただし誤字や、文意から見て明らかな単語の間違いや、重複はなくして整理して。"
+                "話題の区切りには `####` の小見出しを付けて。章の見出しはこちらで付けるので不要です。"
+                "この指示への返答や「以上」などの結びは不要です。出力は内容のみを表示してください。"
+                f"タイトルは「{title}」、この字幕は章「{sections[idx].heading}」の部分です{position}。\n\n"
+                + text
+            )
+            return [{"role": "user", "content": format_prompt}]
 
-def yoyaku_gemini(vtt, title, output_html_path, images=None, detail_text=None, thumbnail_path=None, images_future=None, description=None):
-    """字幕ファイルを要約してHTMLを生成する（3パス方式）
+        def span_for(chunk):
+            return f"detail.section{chunk[0]+1}.part{chunk[1]+1}"
 
-    images_future: concurrent.futures.Future を渡すと、HTML生成直前に
-                   images_future.result() → (images, thumbnail_path) として解決する。
-                   ストーリーボードダウンロードと要約を並列実行するために使用。
-    """
-    result_merged_txt = read_vtt(vtt)
-    vtt_entries = parse_vtt_with_timestamps(result_merged_txt)
-    video_duration_sec = get_vtt_duration_in_seconds(result_merged_txt)
-
-    print(f'要約中（Stage1: {MODEL_STAGE1} / Stage2: {MODEL_STAGE2}）')
-
-    # ── タイトル和訳（英語タイトルに日本語訳を付加）────────────────────────
-    print('  [Title] 和訳確認中...')
-    display_title = make_display_title(title)
-    if display_title != title:
-        print(f'  [Title] {display_title}')
-
-    # ── Stage 1: アウトライン取得（AIプロンプトには原題を使用）────────────
-    print('  [Stage 1] アウトライン生成中...')
-    outline = stage1_get_outline(vtt_entries, title, video_duration_sec, description=description)
-
-    # ── Stage 2: セクション並列要約 ────────────────────────────────────────
-    print(f'  [Stage 2] {len(outline.sections)}セクションを並列要約中...')
-    summaries = stage2_summarize_all_parallel(vtt_entries, outline, title, description=description)
-
-    # ── Stage 3: 全体整合（見出しの統一・分割しすぎの統合）──────────────────
-    print('  [Stage 3] 全体整合中...')
-    outline, summaries = stage3_polish(outline, summaries, display_title)
-
-    # ── Markdown 組み立て（表示用タイトルを使用）──────────────────────────
-    responseA_text = assemble_markdown(outline, summaries, display_title)
-
-    # ── ハイライト生成 ─────────────────────────────────────────────────────
-    print('  [Highlights] ポイント生成中...')
-    highlights_messages = [
-        {"role": "user", "content": f"以下は動画「{title}」の要約です。\n\n{responseA_text}"},
-        {"role": "assistant", "content": "要約を確認しました。"},
-        {
-            "role": "user",
-            "content": "では、その内容の興味深いポイントをまとめて。200文字程度で日本語で。「動画のポイント」という見出しを付けて。この講演に興味を持つ人が特記したいような内容を。全般的でなくとも、特徴的な点を。またこっちは文末に「以上」は不要。"
-        },
-    ]
+        print(f"  [詳細] {len(sections)}章を {len(chunks)} 分割して並列に生成中...")
+        futures = [self.submit_chat(self.model_name, messages_for(chunk), stage='detail', span=span_for(chunk))
+                   for chunk in chunks]
+        texts = []
+        for chunk, future in zip(chunks, futures):
+            try:
+                texts.append(future.result())
+            except Exception as e:
+                print(f"  [詳細] 第{chunk[0]+1}章の第{chunk[1]+1}部でエラー: {e} → 再試行中...")
+                try:
+                    texts.append(self._chat(self.model_name, messages_for(chunk), stage='detail', span=span_for(chunk)))
+                except Exception as e2:
+                    print(f"  [詳細] 再試行にも失敗: {e2}")
+                    texts.append(None)
 
-    responseB = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=highlights_messages
-    )
+        if not any(texts):
+            print("詳細テキスト生成でエラーが発生しました（全部分が失敗）")
+            return None
 
-    in_tok, out_tok = count_tokens(responseB)
-    print(f"  ポイント: 入力 {in_tok:,} / 出力 {out_tok:,} トークン")
+        lines = []
+        for chunk, text in zip(chunks, texts):
+            idx, k = chunk[0], chunk[1]
+            if k == 0:
+                sec = sections[idx]
+                lines.append(f"### {sec.heading}（{_seconds_to_label(sec.start_seconds)}〜）")
+            lines.append((text or "（この部分の詳細テキストを生成できませんでした）").strip())
+            lines.append("")
+        lines.append("以上")
+        return "\n".join(lines)
+
+    def make_display_title(self, title: str) -> str:
+        """タイトルが日本語以外の場合、原題の後ろに和訳を付けて返す。
+        日本語が主体の場合はそのまま返す。"""
+        if not title:
+            return title
+        prompt = (
+            f"以下の動画タイトルを確認してください。\n"
+            f"日本語以外（英語など）で書かれている場合は、自然な日本語訳だけを出力してください。\n"
+            f"日本語が主体の場合は何も出力しないでください（空文字）。\n"
+            f"タイトルの訳のみを出力し、説明・記号・引用符は不要です。\n\n"
+            f"{title}"
+        )
+        try:
+            ja = self._chat(self.model_name, [{"role": "user", "content": prompt}], stage='title',
+                            span='make_display_title').strip()
+            if ja:
+                return f"{title}　{ja}"
+        except Exception as e:
+            print(f"⚠️ タイトル和訳エラー: {str(e)}")
+        return title
 
-    responseB_text = responseB.choices[0].message.content
+    def prepare_description(self, description: str, title: str) -> str:
+        """description を表示し、要約の補足用にフィルタしたものを返す。
 
-    result = responseB_text.split('\n') + ['\n'] + [url_base] + responseA_text.split('\n')
+        フィルタ結果が空なら原文を、description が無ければ None を返す。
+        """
+        if not description:
+            print("⚠️ descriptionを取得できませんでした")
+            return None
+        # 他のタスクと並行して動くため、ひとまとまりの表示は1回の print で出す
+        rule = '=' * 50
+        print(f"\n{rule}\n[Description 原文]\n{description}\n{rule}")
+
+        print("\n[Description フィルタ済み] AIで整理中...")
+        filtered = self.filter_description(description, title)
+        if not filtered:
+            print("⚠️ descriptionフィルタ結果が空でした（原文をそのまま使用）")
+            return description
+        print(f"\n{rule}\n[Description フィルタ済み]\n{filtered}\n{rule}")
+        return filtered
+
+    def filter_description(self, description: str, title: str) -> str:
+        """descriptionから要約補足に使えそうな部分を抜粋して返す。日本語以外は和訳。失敗時はNone。"""
+        if not description:
+            return None
+        ckpt_key = _hash_text(self.model_name, title, description)
+        if self.checkpoint is not None:
+            saved = self.checkpoint.load('description', key=ckpt_key)
+            if saved:
+                print("  [Description] 前回のフィルタ結果を再利用")
+                return saved
+        prompt = (
+            f"以下のdescriptionから、動画字幕の要約に補足として使えそうな箇所だけを抜粋してください。\n\n"
+            f"【言語について】\n"
+            f"- descriptionが日本語で書かれている場合は、原文のまま一字一句変えずに抜粋してください。\n"
+            f"- 日本語以外の言語で書かれている場合は、抜粋する箇所を日本語に訳して出力してください。\n"
+            f"  訳す際も要約・言い換えはせず、原文の意味を忠実に日本語にしてください。\n\n"
+            f"【共通条件】\n"
+            f"- 要約しない\n"
+            f"- 言い換えしない\n"
+            f"- 箇条書きに再構成しない\n"
+            f"- 情報を分類しない\n"
+            f"- 原文にない見出しを足さない\n"
+            f"- 順番は原文どおり\n"
+            f"- 不要な箇所は省略してよい\n"
+            f"- 広告、関連動画、チャンネル登録、共有、視聴回数、ハッシュタグ、画像出典は除外\n"
+            f"- 時間を含む見出し（例：00:23 【兵士】甘煮）は重要なので残す\n"
+            f"- 動画のなかで紹介してるものの情報やURLも残す\n"
+            f"- 出力は抜粋・訳出した内容だけにする\n\n"
+            f"動画タイトル：{title}\n\n"
+            f"Description:\n{description}"
+        )
+        try:
+            result = self._chat(self.model_name, [{"role": "user", "content": prompt}], stage='description',
+                                span='filter_description').strip()
+            if self.checkpoint is not None and result:
+                self.checkpoint.save('description', result, key=ckpt_key)
+            return result or None
+        except Exception as e:
+            print(f"⚠️ description フィルタエラー: {str(e)}")
+            return None
 
-    # ストーリーボードの並列ダウンロードが完了するまで待機
-    if images_future is not None:
-        print('  [Images] ストーリーボードの完了を待機中...')
-        images, thumbnail_path = images_future.result()
+    def run(self, vtt_path, video_title, output_dir, images=None, detail_mode=False, thumbnail_path=None,
+            images_future=None, description=None, raw_description=None, transcript=None, llm_slots=None):
+        """VTTファイルを要約してHTMLを生成し、生成した index.html のパスを返す（引数は do() と同じ）
+
+        raw_description を渡すと、description のフィルタも要約と並行して行う。
+        llm_slots（バッチ時の共有スロット）を渡すと、LLM を呼ぶ処理の間だけ確保する。
+        transcript（Transcript）を渡すと VTT ファイルは読まずにそれを使う。
+        終了時に、リクエストごとの使用量・所要時間をまとめた run_report.json を
+        data.js と同じフォルダに書き出す。呼び出し元で Tracer が有効になっていなければ
+        この実行用の Tracer を作り、各処理のスパンを trace.jsonl に書き出して
+        クリティカルパスを表示する（有効なら呼び出し元のスパンの子として記録するだけ）。
+        """
+        started = time.perf_counter()
+        tracer = tracing.current_tracer()
+        owns_tracer = tracer is None
+        if owns_tracer:
+            tracer = tracing.Tracer()
+        with tracing.activate(tracer), tracing.span('summary', title=video_title):
+            if transcript is None:
+                with tracing.span('read_vtt'):
+                    transcript = Transcript.from_vtt_file(vtt_path.replace('\\','/'))
+            title = video_title
+
+            # HTMLファイルのパスを設定（index.html に統一）
+            html_path = os.path.join(output_dir, 'index.html')
+
+            # ステージの途中結果を出力フォルダに保存し、再実行時に再利用する
+            if self.checkpoint is None:
+                self.checkpoint = RunCheckpoint(output_dir)
+
+            # 詳細テキスト（詳細モードの場合のみ）も要約と並行して生成する
+            self.yoyaku_gemini(transcript, title, html_path, images, None, thumbnail_path, images_future=images_future,
+                               description=description, raw_description=raw_description, detail_mode=detail_mode,
+                               llm_slots=llm_slots)
+
+            # トークン使用量サマリーを表示し、実行レポートを書き出す
+            self.print_token_summary()
+            self.write_run_report(output_dir, title, time.perf_counter() - started)
+
+            # 出力フォルダ全体のテンプレートを自動更新
+            base_dir = os.path.dirname(output_dir)
+            with tracing.span('update_templates'):
+                update_templates(base_dir)
+
+        if owns_tracer:
+            tracer.export(output_dir)
+            tracer.print_summary()
+        return html_path
 
-    # HTMLファイルを生成
-    txt_to_html(result, output_html_path, url_base, images, detail_text, thumbnail_path, vtt_entries, display_title, description=description)
 
 def extract_timestamp(line):
     """行から時間情報を抽出する"""
@@ -833,7 +1636,8 @@ def get_html_header():
 def markdown_to_html(text):
     """MarkdownテキストをHTMLに変換する"""
     text = text.replace('\\r\\n', '\n').replace('\\n', '\n')
-    text = re.sub(r'(?<!^)(?<!\n)(#{1,6}\s+\S)', r'\n\1', text)
+    # 行の途中に紛れた見出しを改行で分ける（### の2文字目以降で切らないよう # の直後は除く）
+    text = re.sub(r'(?<!^)(?<![\n#])(#{1,6}\s+\S)', r'\n\1', text)
     lines = text.split('\n')
     html_lines = []
     in_list = False
@@ -891,10 +1695,9 @@ def _join_transcript_text(base, addition):
     if not addition or base.endswith(addition):
         return base
 
-    max_overlap = min(len(base), len(addition), 80)
-    for overlap in range(max_overlap, 2, -1):
-        if base.endswith(addition[:overlap]):
-            return base + addition[overlap:]
+    overlap = overlap_length(base, addition, max_overlap=80)
+    if overlap:
+        return base + addition[overlap:]
 
     # 英数字の単語境界だけ空白を補う。日本語字幕の途中改行には空白を入れない。
     separator = ' ' if re.search(r'[A-Za-z0-9]$', base) and re.match(r'[A-Za-z0-9]', addition) else ''
@@ -1026,11 +1829,20 @@ def txt_to_html(lines, output_html_path, urlbase: str = "", images=None, detail_
         return h * 3600 + mnt * 60 + s
 
     def build_image_data(match_list):
-        """画像マッチ結果を data.js 用の辞書リストに変換"""
+        """画像マッチ結果を data.js 用の辞書リストに変換
+
+        画像が (シートのパス, 開始, 終了, crop) の場合は、シート内の位置を
+        "x,y,幅,高さ,シート幅,シート高さ" の文字列 crop として書く。
+        """
         result = []
-        for path, img_start, img_end in match_list:
+        for image in match_list:
+            path, img_start, img_end = image[:3]
             rel = os.path.relpath(path, output_dir).replace('\\', '/')
-            result.append({"src": rel, "start": img_start, "end": img_end})
+            entry = {"src": rel, "start": img_start, "end": img_end}
+            if len(image) > 3 and image[3]:
+                # data.js は indent 付きで書き出すため、配列ではなく1行の文字列にする
+                entry["crop"] = ",".join(str(v) for v in image[3])
+            result.append(entry)
         return result
 
     def parse_markdown_heading(line: str):
@@ -1250,97 +2062,22 @@ def parse_vtt_with_timestamps(vtt_lines):
     Returns:
         list of tuples: [(start_seconds, end_seconds, text), ...]
     """
-    # より柔軟な正規表現（1-2桁の時間/分/秒、1-3桁のミリ秒に対応）
-    timecode_pattern = re.compile(r'(\d{1,2}):(\d{1,2}):(\d{1,2})[\.,](\d{1,3})\s*-->\s*(\d{1,2}):(\d{1,2}):(\d{1,2})[\.,](\d{1,3})')
-
-    entries = []
-    current_start = None
-    current_end = None
-    current_text_lines = []
-
-    for line in vtt_lines:
-        line = line.strip()
-
-        # タイムコード行をチェック
-        match = timecode_pattern.match(line)
-        if match:
-            # 前のエントリがあれば保存
-            if current_start is not None and current_text_lines:
-                text = ' '.join(current_text_lines).strip()
-                if text:
-                    entries.append((current_start, current_end, text))
-
-            # 新しいタイムコードを解析
-            h1, m1, s1, ms1 = map(int, match.groups()[:4])
-            h2, m2, s2, ms2 = map(int, match.groups()[4:])
-            current_start = h1 * 3600 + m1 * 60 + s1 + ms1 / 1000.0
-            current_end = h2 * 3600 + m2 * 60 + s2 + ms2 / 1000.0
-            current_text_lines = []
-        elif line and current_start is not None:
-            # テキスト行（メタデータ行は除外）
-            # WEBVTT、数字のみの行、Kind:、Language:、NOTE などを除外
-            if (not line.startswith('WEBVTT') and
-                not re.match(r'^\d+$', line) and
-                not line.startswith('Kind:') and
-                not line.startswith('Language:') and
-                not line.startswith('NOTE')):
-                current_text_lines.append(line)
-
-    # 最後のエントリを保存
-    if current_start is not None and current_text_lines:
-        text = ' '.join(current_text_lines).strip()
-        if text:
-            entries.append((current_start, current_end, text))
-
-    return entries
+    return list(Transcript.from_vtt_lines(vtt_lines))
 
 def get_subtitle_for_range(vtt_entries, start_sec, end_sec):
     """指定した時間範囲の字幕テキストを取得して整形する
 
     Args:
-        vtt_entries: parse_vtt_with_timestamps()の戻り値
+        vtt_entries: Transcript または parse_vtt_with_timestamps()の戻り値
         start_sec: 開始秒数
         end_sec: 終了秒数（Noneの場合は最後まで）
 
     Returns:
         str: 整形された字幕テキスト
     """
-    if end_sec is None:
-        end_sec = float('inf')
-
-    # 指定範囲のテキストを収集
-    texts = []
-    for entry_start, _entry_end, text in vtt_entries:
-        if entry_start >= start_sec and entry_start < end_sec:
-            texts.append(text)
-
     # 重複を除去しながら結合（YouTubeのスクロール字幕形式に対応）
-    merged_texts = []
-    for text in texts:
-        # 前のテキストと完全に同じなら除去
-        if merged_texts and text == merged_texts[-1]:
-            continue
-
-        # 前のテキストの末尾と現在のテキストの先頭が重複している場合、重複部分を除去してマージ
-        if merged_texts:
-            prev_text = merged_texts[-1]
-            # 重複部分を探す（前のテキストの末尾と現在のテキストの先頭）
-            overlap_found = False
-            # 最大で前のテキストの半分程度まで重複をチェック
-            max_overlap = min(len(prev_text), len(text), 50)
-            for overlap_len in range(max_overlap, 2, -1):
-                if prev_text.endswith(text[:overlap_len]):
-                    # 重複部分を除いて追加
-                    merged_texts[-1] = prev_text + text[overlap_len:]
-                    overlap_found = True
-                    break
-            if overlap_found:
-                continue
-
-        merged_texts.append(text)
-
-    # テキストを結合
-    raw_text = ' '.join(merged_texts)
+    # [音楽] などの角括弧だけの cue も前後と同じく重なりで連結する（従来どおり）
+    raw_text = _transcript_index(vtt_entries).merged_text(start_sec, end_sec)
 
     # 整形: 句読点で改行を追加
     formatted_text = format_subtitle_text(raw_text)
@@ -1379,94 +2116,10 @@ def format_subtitle_text(text):
 
     return text
 
-def generate_detail_text(vtt_content, title):
-    """VTTファイルから詳細テキストを生成"""
-    format_prompt = (
-        "字幕ファイルを整形し、 必要なら和訳して、読みやすい日本語の文章にして。"
-        "内容は省略せず、ただし誤字や、文意から見て明らかな単語の間違いや、重複はなくして整理して。"
-        "見出しを付けて。この指示への返答は不要です。出力は内容のみを表示し、最後に「以上」と記載してください。"
-        f"タイトルは「{title}」です。\n\n"
-        + '\n'.join(vtt_content)
-    )
-
-    try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": format_prompt}]
-        )
-        # トークン数を記録
-        in_tok, out_tok = count_tokens(response)
-        print(f"  詳細テキスト: 入力 {in_tok:,} / 出力 {out_tok:,} トークン")
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"詳細テキスト生成でエラーが発生しました: {str(e)}")
-        return None
-
-def make_display_title(title: str) -> str:
-    """タイトルが日本語以外の場合、原題の後ろに和訳を付けて返す。
-    日本語が主体の場合はそのまま返す。"""
-    if not title:
-        return title
-    prompt = (
-        f"以下の動画タイトルを確認してください。\n"
-        f"日本語以外（英語など）で書かれている場合は、自然な日本語訳だけを出力してください。\n"
-        f"日本語が主体の場合は何も出力しないでください（空文字）。\n"
-        f"タイトルの訳のみを出力し、説明・記号・引用符は不要です。\n\n"
-        f"{title}"
-    )
-    try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        count_tokens(response)
-        ja = response.choices[0].message.content.strip()
-        if ja:
-            return f"{title}　{ja}"
-    except Exception as e:
-        print(f"⚠️ タイトル和訳エラー: {str(e)}")
-    return title
-
-def filter_description(description: str, title: str) -> str:
-    """descriptionから要約補足に使えそうな部分を抜粋して返す。日本語以外は和訳。失敗時はNone。"""
-    if not description:
-        return None
-    prompt = (
-        f"以下のdescriptionから、動画字幕の要約に補足として使えそうな箇所だけを抜粋してください。\n\n"
-        f"【言語について】\n"
-        f"- descriptionが日本語で書かれている場合は、原文のまま一字一句変えずに抜粋してください。\n"
-        f"- 日本語以外の言語で書かれている場合は、抜粋する箇所を日本語に訳して出力してください。\n"
-        f"  訳す際も要約・言い換えはせず、原文の意味を忠実に日本語にしてください。\n\n"
-        f"【共通条件】\n"
-        f"- 要約しない\n"
-        f"- 言い換えしない\n"
-        f"- 箇条書きに再構成しない\n"
-        f"- 情報を分類しない\n"
-        f"- 原文にない見出しを足さない\n"
-        f"- 順番は原文どおり\n"
-        f"- 不要な箇所は省略してよい\n"
-        f"- 広告、関連動画、チャンネル登録、共有、視聴回数、ハッシュタグ、画像出典は除外\n"
-        f"- 時間を含む見出し（例：00:23 【兵士】甘煮）は重要なので残す\n"
-        f"- 動画のなかで紹介してるものの情報やURLも残す\n"
-        f"- 出力は抜粋・訳出した内容だけにする\n\n"
-        f"動画タイトル：{title}\n\n"
-        f"Description:\n{description}"
-    )
-    try:
-        response = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        count_tokens(response)
-        result = response.choices[0].message.content.strip()
-        return result or None
-    except Exception as e:
-        print(f"⚠️ description フィルタエラー: {str(e)}")
-        return None
-
-def do(vtt_path, video_title, output_dir, url=None, images=None, detail_mode=False, thumbnail_path=None, images_future=None, description=None):
+def do(vtt_path, video_title, output_dir, url=None, images=None, detail_mode=False, thumbnail_path=None, images_future=None, description=None,
+       transcript=None):
     """
-    VTTファイルを要約してHTMLを生成する
+    VTTファイルを要約してHTMLを生成する（SummaryPipeline の薄いラッパー）
 
     Args:
         vtt_path: VTTファイルのパス
@@ -1476,40 +2129,16 @@ def do(vtt_path, video_title, output_dir, url=None, images=None, detail_mode=Fal
         images: 画像情報のリスト（オプション）
         detail_mode: 詳細モードかどうか（オプション）
         thumbnail_path: サムネイル画像のパス（オプション）
+        transcript: 取得済みの字幕（Transcript）。渡すと vtt_path は読まない（オプション）
 
     Returns:
         str: 生成されたHTMLファイルのパス（index.html）
     """
-    # パスの正規化
-    vtt = vtt_path.replace('\\','/')
-    title = video_title
-    
-    # HTMLファイルのパスを設定（index.html に統一）
-    html_path = os.path.join(output_dir, 'index.html')
-    
-    # URLをグローバル変数に設定（要約時に使用）
     # 注: プロキシURL変換はテンプレート側で行うため、正規URLのまま保持
-    global url_base
-    if url:
-        url_base = url
-    
-    # 詳細テキストを生成（詳細モードの場合のみ）
-    detail_text = None
-    if detail_mode:
-        print('\n詳細テキストを生成中...')
-        vtt_content = read_vtt(vtt)
-        detail_text = generate_detail_text(vtt_content, title)
-    
-    yoyaku_gemini(vtt, title, html_path, images, detail_text, thumbnail_path, images_future=images_future, description=description)
-
-    # トークン使用量サマリーを表示
-    print_token_summary()
-
-    # 出力フォルダ全体のテンプレートを自動更新
-    base_dir = os.path.dirname(output_dir)
-    update_templates(base_dir)
-
-    return html_path
+    pipeline = SummaryPipeline(url_base=url or "")
+    return pipeline.run(vtt_path, video_title, output_dir, images=images, detail_mode=detail_mode,
+                        thumbnail_path=thumbnail_path, images_future=images_future, description=description,
+                        transcript=transcript)
 
 
 # ====================== テンプレート自動更新 ====================== #
@@ -1626,8 +2255,7 @@ def migrate_legacy_html(base_dir):
             vtt_entries = None
             vtt_files = glob.glob(os.path.join(folder_path, '*.vtt'))
             if vtt_files:
-                vtt_content = read_vtt(vtt_files[0])
-                vtt_entries = parse_vtt_with_timestamps(vtt_content)
+                vtt_entries = Transcript.from_vtt_file(vtt_files[0])
 
             # 5. 旧HTMLから詳細セクションを取得（あれば）
             detail_text = _extract_detail_from_legacy_html(folder_path)
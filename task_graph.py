@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import tracing
+
+
+class TaskGraph:
+    """名前付きタスクの依存グラフを、依存が揃ったものから順に並列実行する。
+
+    add() でタスクと依存先の名前を登録し、run() で実行する。各タスクの関数は
+    依存先の結果を deps の順に位置引数として受け取る。全体の所要時間は
+    タスクの合計ではなく、依存関係の最も長い連鎖でおおむね決まる。
+
+    タスクは OpenAI 呼び出しの結果を待ってブロックするため、共有スレッドプール
+    （llm_engine.shared_executor）ではなく、グラフ専用のスレッドで実行する。
+
+    トレース（tracing）が有効なら、各タスクを run() の呼び出し元のスパンの子スパンとして
+    記録し、依存先の名前を attrs['deps'] に残す（クリティカルパスの計算に使う）。
+    """
+
+    def __init__(self):
+        self._tasks = {}  # name -> (fn, deps)
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"未登録の依存タスクです: {name} → {dep}")
+        self._tasks[name] = (fn, tuple(deps))
+
+    def run(self):
+        """全タスクを実行して {名前: 結果} を返す。いずれかが失敗したらその例外を送出する。"""
+        results = {}
+        remaining = dict(self._tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(self._tasks)), thread_name_prefix='task') as executor:
+            while remaining or running:
+                for name, (fn, deps) in list(remaining.items()):
+                    if all(dep in results for dep in deps):
+                        args = [results[dep] for dep in deps]
+                        task = tracing.traced(name, fn, deps=list(deps))
+                        running[executor.submit(task, *args)] = name
+                        del remaining[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    # 失敗したら未着手のタスクは投入せず、実行中のものの終了を待って例外を送出する
+                    error = future.exception()
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    results[name] = future.result()
+        return results
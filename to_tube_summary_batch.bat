@@ -0,0 +1,17 @@
+@echo off
+chcp 65001 > nul
+echo === YouTube字幕ダウンローダー（バッチ版） ===
+echo クリップボードのプレイリスト / チャンネルURL（またはURLリストのファイルパス）から全動画を要約します...
+
+:: モデル名を環境変数で設定
+set OPENAI_MODEL_STAGE1=gpt-5.4-mini-2026-03-17
+set OPENAI_MODEL_STAGE2=gpt-5.4-mini-2026-03-17
+
+:: 同時実行数（動画数 / 字幕取得 / ストーリーボード / 要約）
+set BATCH_MAX_VIDEOS=4
+set BATCH_MAX_FETCH=3
+set BATCH_MAX_STORYBOARD=2
+set BATCH_MAX_SUMMARY=3
+
+:: 仮想環境のPythonを使用
+.\.venv\Scripts\python.exe youtube_transcript_downloader.py --from-bat --batch %*
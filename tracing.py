@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import asyncio
+import itertools
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+# 0 にすると処理ごとの所要時間（スパン）を記録しない
+TRACE_ENABLED = os.environ.get('TRACE', '1') != '0'
+# 1 にすると trace.jsonl に加えて Chrome のトレース形式（trace.json）も書き出す
+TRACE_CHROME = os.environ.get('TRACE_CHROME', '0') == '1'
+# クリティカルパスの表示で省略する短いスパン（秒）
+TRACE_MIN_SECONDS = float(os.environ.get('TRACE_MIN_SECONDS', '0.05'))
+
+_current_tracer = contextvars.ContextVar('tracer', default=None)
+_current_span = contextvars.ContextVar('trace_span', default=None)
+
+
+def _task_name():
+    """asyncio のタスク内ならタスク名、そうでなければ None"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return None
+    return task.get_name() if task is not None else None
+
+
+class Span:
+    """処理1つ分の区間（開始・終了時刻、実行したスレッド・タスク、親スパン、属性）"""
+
+    __slots__ = ('tracer', 'id', 'parent_id', 'name', 'attrs', 'start', 'end',
+                 'thread', 'thread_id', 'task')
+
+    def __init__(self, tracer, span_id, parent_id, name, attrs):
+        self.tracer = tracer
+        self.id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        current = threading.current_thread()
+        self.thread = current.name
+        self.thread_id = current.ident
+        self.task = _task_name()
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attrs):
+        """属性を追加する"""
+        self.attrs.update(attrs)
+
+    def finish(self, *_):
+        """スパンを終了して記録する（Future の add_done_callback にもそのまま渡せる）"""
+        if self.end is None:
+            self.end = time.perf_counter()
+            self.tracer._finished(self)
+
+    def to_dict(self):
+        tracer = self.tracer
+        return {
+            "id": self.id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start": round(self.start - tracer.epoch, 6),
+            "end": round(self.end - tracer.epoch, 6),
+            "duration": round(self.end - self.start, 6),
+            "timestamp": round(tracer.wall_epoch + (self.start - tracer.epoch), 6),
+            "thread": self.thread,
+            "thread_id": self.thread_id,
+            "task": self.task,
+            "attrs": self.attrs,
+        }
+
+
+class Tracer:
+    """1回の実行（動画1本分）のスパンを集める。
+
+    スパンの親子関係は contextvars で追跡するので、同じスレッド・同じ asyncio
+    タスクの中で入れ子にした span() は自動的に親子になる。スレッドプールや
+    イベントループへ処理を渡すときは wrap() / traced() / bind() で現在の
+    スパンを引き継ぐ。各スレッドから同時に記録されるため、記録はロックで保護する。
+    """
+
+    def __init__(self):
+        self.epoch = time.perf_counter()
+        self.wall_epoch = time.time()
+        self._ids = itertools.count(1)
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def start(self, name, **attrs):
+        """現在のスパンの子としてスパンを開始する（終了は Span.finish() で行う）"""
+        parent = _current_span.get()
+        parent_id = parent.id if parent is not None and parent.tracer is self else None
+        return Span(self, next(self._ids), parent_id, name, attrs)
+
+    def _finished(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self):
+        """終了済みのスパンを開始順に返す"""
+        with self._lock:
+            spans = list(self._spans)
+        return sorted(spans, key=lambda s: s.start)
+
+    def write_jsonl(self, path):
+        """スパンを1行1件の JSON で書き出す"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for span in self.spans():
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False) + "\n")
+        return path
+
+    def write_chrome(self, path):
+        """Chrome のトレース形式（chrome://tracing や Perfetto で開ける）で書き出す。
+
+        asyncio のタスク内のスパンはタスクごとに別の行（tid）に並べる。
+        """
+        pid = os.getpid()
+        events = []
+        lanes = {}
+        for span in self.spans():
+            lane = span.task or span.thread
+            if lane not in lanes:
+                lanes[lane] = len(lanes) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": lanes[lane],
+                               "args": {"name": lane}})
+            events.append({
+                "name": span.name,
+                "cat": "pipeline",
+                "ph": "X",
+                "ts": round((span.start - self.epoch) * 1e6),
+                "dur": round((span.end - span.start) * 1e6),
+                "pid": pid,
+                "tid": lanes[lane],
+                "args": span.attrs,
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return path
+
+    def export(self, output_dir):
+        """output_dir に trace.jsonl（TRACE_CHROME=1 なら trace.json も）を書き出す"""
+        if not TRACE_ENABLED:
+            return None
+        try:
+            path = self.write_jsonl(os.path.join(output_dir, 'trace.jsonl'))
+            if TRACE_CHROME:
+                self.write_chrome(os.path.join(output_dir, 'trace.json'))
+        except OSError as e:
+            print(f"⚠️ トレースの書き出しに失敗: {e}")
+            return None
+        return path
+
+    def critical_path(self):
+        """実行時間を決めたスパンの連鎖を [(深さ, スパン), ...] で返す。
+
+        兄弟スパンの中で最後に終わったものから、依存先（TaskGraph が attrs['deps'] に
+        記録する）のうち最後に終わったもの、依存の記録が無ければその開始前に
+        最後に終わった兄弟へと遡る。連鎖上の各スパンについて、その子スパンにも
+        同じ規則を当てはめて入れ子で返す。
+        """
+        spans = self.spans()
+        children = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        def chain(siblings):
+            by_name = {s.name: s for s in siblings}
+            current = max(siblings, key=lambda s: s.end)
+            path = []
+            while current is not None:
+                path.append(current)
+                deps = current.attrs.get('deps')
+                if deps is not None:
+                    done = [by_name[d] for d in deps if d in by_name]
+                    current = max(done, key=lambda s: s.end) if done else None
+                else:
+                    before = [s for s in siblings if s.end <= current.start]
+                    current = max(before, key=lambda s: s.end) if before else None
+            path.reverse()
+            return path
+
+        def expand(siblings, depth):
+            result = []
+            for span in chain(siblings):
+                result.append((depth, span))
+                if span.id in children:
+                    result.extend(expand(children[span.id], depth + 1))
+            return result
+
+        roots = children.get(None)
+        return expand(roots, 0) if roots else []
+
+    def print_summary(self):
+        """クリティカルパス（全体の所要時間を決めた処理の連鎖）を表示する"""
+        path = self.critical_path()
+        if not path:
+            return
+        total = max(span.end for _, span in path) - min(span.start for _, span in path)
+        print(f"\n=== クリティカルパス（{total:.1f} 秒）===")
+        for depth, span in path:
+            if span.duration < TRACE_MIN_SECONDS:
+                continue
+            start = span.start - self.epoch
+            label = f"{'  ' * depth}{span.name}"
+            print(f"  {label:<40} {span.duration:7.2f}s  （{start:6.1f}s 〜 {start + span.duration:6.1f}s）")
+
+
+def current_tracer():
+    """現在のコンテキストで有効な Tracer（無ければ None）"""
+    return _current_tracer.get()
+
+
+@contextmanager
+def activate(tracer):
+    """with ブロックの間、tracer を現在の Tracer にする"""
+    token = _current_tracer.set(tracer if TRACE_ENABLED else None)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def span(name, **attrs):
+    """現在の Tracer にスパンを記録する（Tracer が無ければ何もしない）。Span（または None）を返す。"""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    current = tracer.start(name, **attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+
+def annotate(**attrs):
+    """現在のスパンに属性を追加する（スパンが無ければ何もしない）"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def wrap(fn):
+    """現在の Tracer・スパンを引き継いで fn を呼ぶ関数を返す（別スレッドに渡す用）"""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def traced(name, fn, **attrs):
+    """現在のスパンの子として、name のスパンの中で fn を呼ぶ関数を返す（別スレッドに渡す用）"""
+    def run(*args, **kwargs):
+        with span(name, **attrs):
+            return fn(*args, **kwargs)
+    return wrap(run)
+
+
+def bind(coro):
+    """現在の Tracer・スパンを引き継いでコルーチンを実行するコルーチンを返す。
+
+    run_coroutine_threadsafe で作られるタスクはイベントループのスレッドの
+    コンテキストで動くため、投入元のスパンを明示的に渡す。
+    """
+    tracer = _current_tracer.get()
+    parent = _current_span.get()
+
+    async def run():
+        _current_tracer.set(tracer)
+        _current_span.set(parent)
+        return await coro
+    return run()
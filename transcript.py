@@ -0,0 +1,324 @@
+import re
+from array import array
+from bisect import bisect_left
+
+# タイムコード行（1-2桁の時間/分/秒、1-3桁のミリ秒に対応）
+_TIMECODE_RE = re.compile(r'(\d{1,2}):(\d{1,2}):(\d{1,2})[\.,](\d{1,3})\s*-->\s*(\d{1,2}):(\d{1,2}):(\d{1,2})[\.,](\d{1,3})')
+_DIGITS_RE = re.compile(r'^\d+$')
+
+
+def format_time_vtt(seconds):
+    """秒数をVTT形式の時間文字列に変換 (HH:MM:SS.mmm)"""
+    hours = int(seconds / 3600)
+    minutes = int((seconds % 3600) / 60)
+    seconds = seconds % 60
+    milliseconds = int((seconds - int(seconds)) * 1000)
+
+    return f"{hours:02d}:{minutes:02d}:{int(seconds):02d}.{milliseconds:03d}"
+
+
+def _vtt_seconds(seconds):
+    """format_time_vtt で書いて読み直したときと同じ値（ミリ秒未満切り捨て）にする。
+
+    VTT ファイル経由で読み込んだ場合と開始秒・ブロック境界・フィンガープリントが
+    一致するよう、スニペットから直接作るときもこの値に揃える。
+    """
+    hours = int(seconds / 3600)
+    minutes = int((seconds % 3600) / 60)
+    seconds = seconds % 60
+    milliseconds = int((seconds - int(seconds)) * 1000)
+    return hours * 3600 + minutes * 60 + int(seconds) + milliseconds / 1000.0
+
+
+def _format_ms(seconds):
+    """ミリ秒単位に揃えた秒数を HH:MM:SS.mmm にする（浮動小数の誤差で1ミリ秒ずれないよう丸める）"""
+    ms = int(round(seconds * 1000))
+    hours, ms = divmod(ms, 3600_000)
+    minutes, ms = divmod(ms, 60_000)
+    secs, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{ms:03d}"
+
+
+def _cue_text(lines):
+    """cue のテキスト行を1行にまとめる（空行・WEBVTT・数字のみ・メタデータ行は除外）"""
+    kept = []
+    for line in lines:
+        line = line.strip()
+        if (line and
+                not line.startswith('WEBVTT') and
+                not _DIGITS_RE.match(line) and
+                not line.startswith('Kind:') and
+                not line.startswith('Language:') and
+                not line.startswith('NOTE')):
+            kept.append(line)
+    return ' '.join(kept).strip()
+
+
+def overlap_length(prev, text, max_overlap=50, min_overlap=3):
+    """prev の末尾と text の先頭が重なる最長の文字数を返す（min_overlap 未満なら 0）。
+
+    ローリング字幕で前の cue の末尾が次の cue の先頭に繰り返される部分を見つけるための
+    共通処理。重なりは max_overlap 文字まで調べる（prev には末尾 max_overlap 文字だけを
+    渡してもよい）。重なりの候補は text の先頭 min_overlap 文字が prev の末尾に現れる
+    位置に限られるので、str.find で候補を左から（長い重なりから）探し、startswith で
+    残りを確かめる。長さごとに endswith を試す方法と結果は同じ。
+    """
+    m = min(len(prev), len(text), max_overlap)
+    if m < min_overlap:
+        return 0
+    tail = prev[-m:]
+    head = text[:min_overlap]
+    i = tail.find(head)
+    while i != -1:
+        if text.startswith(tail[i:]):
+            return m - i
+        i = tail.find(head, i + 1)
+    return 0
+
+
+def _is_marker(text):
+    """[MM:SS] マーカーや [音楽] のような角括弧だけの cue か"""
+    return text.startswith('[') and text.endswith(']')
+
+
+class _RollingMerge:
+    """ローリング字幕の重複除去の状態（現在の文の断片・長さ・末尾）。
+
+    push(text) は cue を1つ足し、直前の文に足す断片を返す（None なら新しい文を始める、
+    '' なら文全体と完全一致する重複で何も足さない）。isolate_markers=True のときは
+    角括弧だけの cue を常に独立させ、次の cue も新しい文から始める。
+    """
+
+    __slots__ = ('max_overlap', 'isolate_markers', 'group', 'group_len', 'tail')
+
+    def __init__(self, max_overlap=50, isolate_markers=True):
+        self.max_overlap = max_overlap
+        self.isolate_markers = isolate_markers
+        self.group = None     # 現在の文を構成する断片のリスト（完全一致の判定用）
+        self.group_len = 0
+        self.tail = ''        # 現在の文の末尾 max_overlap 文字（重なりの判定にはこれで足りる）
+
+    def reset(self):
+        """次の cue から新しい文を始める"""
+        self.group = None
+
+    def push(self, text):
+        if self.isolate_markers and _is_marker(text):
+            self.group = None
+            return None
+        if self.group is not None:
+            if len(text) == self.group_len and text == ''.join(self.group):
+                return ''
+            overlap = overlap_length(self.tail, text, self.max_overlap)
+            if overlap:
+                piece = text[overlap:]
+                self.group.append(piece)
+                self.group_len += len(piece)
+                self.tail = (self.tail + piece)[-self.max_overlap:]
+                return piece
+        self.group = [text]
+        self.group_len = len(text)
+        self.tail = text[-self.max_overlap:]
+        return None
+
+
+class TranscriptIndex:
+    """字幕の時間範囲 [start, end) のテキストを高速に取り出すための索引。
+
+    ローリング字幕の重複除去（文全体と完全一致する cue を捨て、前の文と先頭が重なる
+    cue は重なりを除いて連結する）を字幕全体に対して一度だけ行い、各 cue が連結後の
+    テキストに足す断片を覚えておく。範囲の取り出しは開始秒の二分探索と、
+    範囲内の断片をつなぐだけで済む（セクション数 × 字幕全体の走査をしない）。
+
+    範囲の先頭と [MM:SS] マーカーの直後は、範囲ごとに重複除去をやり直した場合と
+    同じ結果になるよう、全体で新しい文が始まる cue（範囲内でも新しい文になる cue）まで
+    範囲内で重複除去をやり直し、そこからは全体の断片を使う。開始秒は時刻順に並んでいる前提。
+    """
+
+    def __init__(self, entries, max_overlap=50):
+        self.max_overlap = max_overlap
+        self.starts = array('d')
+        self.texts = []
+        # 各 cue が直前の文に足す断片（None なら新しい文を始める、'' なら重複で何も足さない）
+        self.pieces = []
+
+        merge = _RollingMerge(max_overlap)
+        for start, _end, text in entries:
+            self.starts.append(start)
+            self.texts.append(text)
+            self.pieces.append(merge.push(text))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def span(self, start_sec, end_sec=None):
+        """開始秒が [start_sec, end_sec) に入る cue の添字範囲 (lo, hi) を返す"""
+        lo = bisect_left(self.starts, start_sec)
+        hi = len(self.starts) if end_sec is None else bisect_left(self.starts, end_sec, lo)
+        return lo, hi
+
+    def text(self, start_sec, end_sec=None, marker_interval=None):
+        """時間範囲の字幕を重複除去して連結した文字列を返す。
+
+        marker_interval（秒）を渡すと、その間隔ごとに [MM:SS] マーカーを挿入する。
+        角括弧だけの cue とマーカーは独立させ、その次の cue から新しい文を始める。
+        """
+        lo, hi = self.span(start_sec, end_sec)
+        out = []
+        local = _RollingMerge(self.max_overlap)
+        synced = False  # 範囲内の重複除去が全体の断片と一致する状態になったか
+        last_marker_sec = -999
+        for i in range(lo, hi):
+            if marker_interval and self.starts[i] - last_marker_sec >= marker_interval:
+                m, s = divmod(int(self.starts[i]), 60)
+                if out:
+                    out.append(' ')
+                out.append(f"[{m:02d}:{s:02d}]")
+                last_marker_sec = self.starts[i]
+                local.reset()
+                synced = False
+            if synced:
+                piece = self.pieces[i]
+            else:
+                piece = local.push(self.texts[i])
+                # 範囲内でも全体でもこの cue から新しい文が始まれば、以降は全体の断片と同じになる
+                synced = piece is None and self.pieces[i] is None
+            self._append_piece(out, i, piece)
+        return ''.join(out)
+
+    def merged_text(self, start_sec, end_sec=None):
+        """時間範囲の字幕を範囲内だけで重複除去して連結した文字列を返す。
+
+        text() と違い、角括弧だけの cue（[音楽] など）も他の cue と同じく重なりで連結する。
+        範囲の cue は二分探索で取り出すので、走査するのは範囲内だけ。
+        """
+        lo, hi = self.span(start_sec, end_sec)
+        out = []
+        local = _RollingMerge(self.max_overlap, isolate_markers=False)
+        for i in range(lo, hi):
+            self._append_piece(out, i, local.push(self.texts[i]))
+        return ''.join(out)
+
+    def _append_piece(self, out, i, piece):
+        if piece is None:
+            if out:
+                out.append(' ')
+            out.append(self.texts[i])
+        else:
+            out.append(piece)
+
+
+class Transcript:
+    """時刻付き字幕をメモリ上に保持する（開始秒・終了秒・テキストの並列配列）。
+
+    取得したスニペットから直接作り、VTT 文字列に書き出して読み直す往復をしない。
+    秒数は array('d') に持つため、10時間級の配信でもタプルのリストより軽い。
+    反復すると従来の parse_vtt_with_timestamps() と同じ (start, end, text) を返すので、
+    vtt_entries を受け取る既存の関数にそのまま渡せる。VTT ファイルは成果物として
+    to_vtt() / write_vtt() で書き出す。
+    """
+
+    __slots__ = ('starts', 'ends', 'texts', 'language', '_index')
+
+    def __init__(self, starts=(), ends=(), texts=(), language=None):
+        self.starts = array('d', starts)
+        self.ends = array('d', ends)
+        self.texts = list(texts)
+        self.language = language
+        self._index = None
+
+    @classmethod
+    def from_snippets(cls, snippets, language=None):
+        """youtube-transcript-api のスニペット [{"text", "start", "duration"}, ...] から作る"""
+        transcript = cls(language=language)
+        for i, entry in enumerate(snippets, 1):
+            try:
+                start = entry['start']
+                end = start + entry['duration']
+                text = _cue_text(str(entry['text']).splitlines())
+            except Exception as e:
+                print(f"字幕エントリ {i} の処理中にエラー: {str(e)}")
+                # エラーが発生しても処理を継続
+                continue
+            if text:
+                transcript._append(_vtt_seconds(start), _vtt_seconds(end), text)
+        return transcript
+
+    @classmethod
+    def from_vtt_lines(cls, vtt_lines):
+        """VTT の行のリストから作る（保存済みの VTT を読み直す場合用）"""
+        transcript = cls()
+        current_start = None
+        current_end = None
+        current_lines = []
+        for line in vtt_lines:
+            line = line.strip()
+            match = _TIMECODE_RE.match(line)
+            if match:
+                # 前のエントリがあれば保存
+                if current_start is not None:
+                    text = _cue_text(current_lines)
+                    if text:
+                        transcript._append(current_start, current_end, text)
+                h1, m1, s1, ms1 = map(int, match.groups()[:4])
+                h2, m2, s2, ms2 = map(int, match.groups()[4:])
+                current_start = h1 * 3600 + m1 * 60 + s1 + ms1 / 1000.0
+                current_end = h2 * 3600 + m2 * 60 + s2 + ms2 / 1000.0
+                current_lines = []
+            elif line and current_start is not None:
+                current_lines.append(line)
+
+        # 最後のエントリを保存
+        if current_start is not None:
+            text = _cue_text(current_lines)
+            if text:
+                transcript._append(current_start, current_end, text)
+        return transcript
+
+    @classmethod
+    def from_vtt_file(cls, path):
+        """VTT ファイルを読み込んで作る"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_vtt_lines(f)
+
+    def _append(self, start, end, text):
+        self._index = None
+        self.starts.append(start)
+        self.ends.append(end)
+        self.texts.append(text)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __bool__(self):
+        return bool(self.texts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.texts)
+
+    def __getitem__(self, i):
+        return self.starts[i], self.ends[i], self.texts[i]
+
+    @property
+    def duration(self):
+        """動画の長さ（最後の cue の終了秒、整数に切り捨て）。字幕が無ければ 0。"""
+        return int(self.ends[-1]) if self.ends else 0
+
+    def index(self):
+        """時間範囲の取り出し用の TranscriptIndex（初回に作って使い回す）"""
+        if self._index is None:
+            self._index = TranscriptIndex(self)
+        return self._index
+
+    def to_vtt(self):
+        """VTT 形式の文字列にする"""
+        cues = [
+            f"{_format_ms(start)} --> {_format_ms(end)}\n{text}\n\n"
+            for start, end, text in self
+        ]
+        return "WEBVTT\n\n" + "".join(cues)
+
+    def write_vtt(self, path):
+        """VTT ファイルとして保存する"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_vtt())
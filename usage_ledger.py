@@ -0,0 +1,175 @@
+import os
+import json
+import math
+import threading
+
+# モデルごとの料金（USD / 100万トークン）。モデル名の前方一致（最長一致）で引く。
+# cached_input を省略したモデルは、キャッシュ済みの入力も通常の入力単価で計算する（上限の見積もり）。
+# 表に無いモデルの料金は不明（None）として扱う。環境変数 LLM_PRICES に
+# '{"モデル名": {"input": 0.25, "output": 2.0, "cached_input": 0.025}}' の形の JSON を渡すと追加・上書きできる。
+MODEL_PRICES = {
+    'gpt-5.2': {'input': 1.75, 'output': 14.00},
+}
+# 使用量サマリーに表示する価格目安（モデルによらず全体の使用量に掛ける）
+REFERENCE_PRICES = {
+    '通常モデル': {'input': 1.75, 'output': 14.00},
+    '安価モデル': {'input': 0.25, 'output': 2.00},
+}
+
+
+def load_prices():
+    """MODEL_PRICES に環境変数 LLM_PRICES の内容を重ねた料金表を返す"""
+    prices = {name: dict(price) for name, price in MODEL_PRICES.items()}
+    raw = os.environ.get('LLM_PRICES')
+    if raw:
+        try:
+            for name, price in json.loads(raw).items():
+                prices[name] = {key: float(value) for key, value in price.items()}
+        except (ValueError, AttributeError, TypeError) as e:
+            print(f"⚠️ LLM_PRICES を読み込めませんでした（無視します）: {e}")
+    return prices
+
+
+def price_cost(price, input_tokens, output_tokens, cached_tokens=0):
+    """料金表の1項目からコスト（USD）を計算する"""
+    cached_rate = price.get('cached_input', price['input'])
+    return ((input_tokens - cached_tokens) * price['input']
+            + cached_tokens * cached_rate
+            + output_tokens * price['output']) / 1_000_000
+
+
+def percentile(values, p):
+    """p パーセンタイル（最近順位法）。空なら None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class UsageLedger:
+    """LLM リクエスト1件ごとの使用量・所要時間・再試行回数・結果を記録する。
+
+    Stage 1 / Stage 2 のワーカースレッドや非同期エンジンのイベントループから
+    同時に record() されるため、記録はロックで保護する。集計（summary）と
+    実行レポート（report / write_report）は記録のスナップショットから作る。
+
+    outcome は 'ok'（API 呼び出し成功）、'cache'（LLM 応答キャッシュを使用）、
+    'error'（再試行しても失敗）のいずれか。
+    """
+
+    def __init__(self, prices=None):
+        self.prices = prices if prices is not None else load_prices()
+        self._records = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, model, input_tokens=0, output_tokens=0, cached_tokens=0,
+               latency=0.0, retries=0, outcome='ok'):
+        """リクエスト1件分を記録する"""
+        entry = {
+            "stage": stage or 'other',
+            "model": model,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cached_tokens": cached_tokens,
+            "latency": round(latency, 3),
+            "retries": retries,
+            "outcome": outcome,
+        }
+        with self._lock:
+            self._records.append(entry)
+        return entry
+
+    def records(self):
+        """記録のコピーを記録順に返す"""
+        with self._lock:
+            return list(self._records)
+
+    def price_for(self, model):
+        """モデル名に前方一致する料金表の項目（最長一致）を返す。無ければ None。"""
+        matches = [name for name in self.prices if model and model.startswith(name)]
+        if not matches:
+            return None
+        return self.prices[max(matches, key=len)]
+
+    def cost(self, model, input_tokens, output_tokens, cached_tokens=0):
+        """料金表からコスト（USD）を計算する。料金が分からないモデルは None。"""
+        price = self.price_for(model)
+        if price is None:
+            return None
+        return price_cost(price, input_tokens, output_tokens, cached_tokens)
+
+    def totals(self):
+        """全リクエストのトークン数の合計 {'input', 'output', 'cached'}"""
+        records = self.records()
+        return {
+            'input': sum(r['input_tokens'] for r in records),
+            'output': sum(r['output_tokens'] for r in records),
+            'cached': sum(r['cached_tokens'] for r in records),
+        }
+
+    def summary(self):
+        """ステージごと（と全体 'total'）の集計を {ステージ名: 集計} で返す。
+
+        レイテンシの p50 / p95 は API を呼んだリクエスト（キャッシュ使用を除く）から求める。
+        コストは料金の分からないモデルが含まれる場合、分かった分だけの合計と
+        cost_complete=False を返す。料金の分かるリクエストが1件も無いステージの
+        cost_usd は 0.0 ではなく None にする。
+        """
+        groups = {}
+        for r in self.records():
+            groups.setdefault(r['stage'], []).append(r)
+            groups.setdefault('total', []).append(r)
+
+        summary = {}
+        for stage, records in groups.items():
+            latencies = [r['latency'] for r in records if r['outcome'] != 'cache']
+            cost = 0.0
+            cost_complete = True
+            priced = False
+            for r in records:
+                c = self.cost(r['model'], r['input_tokens'], r['output_tokens'], r['cached_tokens'])
+                if c is None:
+                    cost_complete = cost_complete and r['outcome'] == 'cache'
+                else:
+                    cost += c
+                    priced = True
+            summary[stage] = {
+                "requests": len(records),
+                "api_calls": len(latencies),
+                "cache_hits": sum(1 for r in records if r['outcome'] == 'cache'),
+                "errors": sum(1 for r in records if r['outcome'] == 'error'),
+                "retries": sum(r['retries'] for r in records),
+                "input_tokens": sum(r['input_tokens'] for r in records),
+                "output_tokens": sum(r['output_tokens'] for r in records),
+                "cached_tokens": sum(r['cached_tokens'] for r in records),
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "latency_max": max(latencies) if latencies else None,
+                "latency_sum": round(sum(latencies), 3),
+                "cost_usd": round(cost, 6) if priced or cost_complete else None,
+                "cost_complete": cost_complete,
+            }
+        return summary
+
+    def report(self, **extra):
+        """実行レポート（JSON にできる辞書）を返す。extra はそのまま先頭に入れる。"""
+        records = self.records()
+        totals = self.totals()
+        reference = {
+            name: round(price_cost(price, totals['input'], totals['output']), 6)
+            for name, price in REFERENCE_PRICES.items()
+        }
+        return {
+            **extra,
+            "stages": self.summary(),
+            "reference_cost_usd": reference,
+            "prices": self.prices,
+            "requests": records,
+        }
+
+    def write_report(self, path, **extra):
+        """実行レポートを JSON ファイルに書き出し、パスを返す"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(**extra), f, ensure_ascii=False, indent=2)
+        return path
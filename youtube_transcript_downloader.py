@@ -1,12 +1,18 @@
 import re
+import math
 import os
 import pyperclip
 import sys
 import requests
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #import subprocess
 from youtube_transcript_api import YouTubeTranscriptApi
-from ret_youyaku_html import do as create_summary, filter_description
+from ret_youyaku_html import SummaryPipeline
+from cache_store import load_video_cache, save_video_cache, RunCheckpoint
+from transcript import Transcript, format_time_vtt
+import tracing
 
 import yt_dlp
 from PIL import Image
@@ -21,6 +27,69 @@ from datetime import datetime
 
 BASE_DIR = r"C:\temp\html"
 
+# ── バッチモードの同時実行上限（環境変数で調整可能）────────────────────────
+# 動画単位の並列数とは別に、各ステージにプロセス全体で共有する上限を設ける。
+# これにより、あるステージ（字幕取得など）が他の動画の別ステージ（要約など）と
+# 重なって進みつつ、YouTube / OpenAI へ同時に投げるリクエスト数は抑えられる。
+BATCH_MAX_VIDEOS = int(os.environ.get('BATCH_MAX_VIDEOS', '4'))
+BATCH_MAX_FETCH = int(os.environ.get('BATCH_MAX_FETCH', '3'))
+BATCH_MAX_STORYBOARD = int(os.environ.get('BATCH_MAX_STORYBOARD', '2'))
+BATCH_MAX_SUMMARY = int(os.environ.get('BATCH_MAX_SUMMARY', '3'))
+
+_fetch_slots = threading.BoundedSemaphore(max(1, BATCH_MAX_FETCH))
+_storyboard_slots = threading.BoundedSemaphore(max(1, BATCH_MAX_STORYBOARD))
+_summary_slots = threading.BoundedSemaphore(max(1, BATCH_MAX_SUMMARY))
+
+# ── ストーリーボード画像の取得設定 ────────────────────────────────────────
+# 1動画あたりのフラグメント同時ダウンロード数と、HTTP のタイムアウト（接続, 読み込み 秒）
+STORYBOARD_FETCH_WORKERS = int(os.environ.get('STORYBOARD_FETCH_WORKERS', '6'))
+STORYBOARD_TIMEOUT = (5, 20)
+# 1 にするとセルごとの JPEG に切り出さず、フラグメント（シート）を1枚のまま保存し、
+# data.js にはシート内の位置（crop）を書く。ファイル数がセル数分の1になり、再エンコードもしない。
+STORYBOARD_SPRITES = os.environ.get('STORYBOARD_SPRITES', '0') == '1'
+# 保存するコマ数の上限。STORYBOARD_FRAME_BUDGET（固定枚数）を指定しなければ、
+# 動画の長さ × STORYBOARD_FRAMES_PER_MINUTE（STORYBOARD_MAX_FRAMES まで）にする。0 で無制限。
+STORYBOARD_FRAME_BUDGET = int(os.environ.get('STORYBOARD_FRAME_BUDGET', '0'))
+STORYBOARD_FRAMES_PER_MINUTE = float(os.environ.get('STORYBOARD_FRAMES_PER_MINUTE', '6'))
+STORYBOARD_MAX_FRAMES = int(os.environ.get('STORYBOARD_MAX_FRAMES', '600'))
+# ストーリーボードの解像度（sb0〜sb3）は、取得するシート数と推定バイト数がこの範囲に
+# 収まるもののうち最も高解像度のものを選ぶ
+STORYBOARD_MAX_FRAGMENTS = int(os.environ.get('STORYBOARD_MAX_FRAGMENTS', '80'))
+STORYBOARD_MAX_MB = float(os.environ.get('STORYBOARD_MAX_MB', '30'))
+# JPEG のシート1ピクセルあたりのおおよそのバイト数（推定用）
+_JPEG_BYTES_PER_PIXEL = 0.15
+# 連続するほぼ同じコマ（dHash のハミング距離が STORYBOARD_DEDUP_DISTANCE 以下）を
+# 1コマにまとめる（時間範囲は連続部分全体）。STORYBOARD_DEDUP=0 で無効。
+STORYBOARD_DEDUP = os.environ.get('STORYBOARD_DEDUP', '1') == '1'
+STORYBOARD_DEDUP_DISTANCE = int(os.environ.get('STORYBOARD_DEDUP_DISTANCE', '5'))
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """画像・ページ取得用の共有 requests.Session を返す（keep-alive で接続を再利用する）"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            pool_size = max(1, STORYBOARD_FETCH_WORKERS) * max(1, BATCH_MAX_STORYBOARD)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=2)
+            _http_session = requests.Session()
+            _http_session.mount('https://', adapter)
+            _http_session.mount('http://', adapter)
+        return _http_session
+
+def fetch_image_bytes(url):
+    """共有セッションで画像を取得し、本文（bytes）を返す。失敗時は None。"""
+    try:
+        response = get_http_session().get(url, timeout=STORYBOARD_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"⚠️ 画像のダウンロードに失敗: {str(e)}")
+        return None
+    if response.status_code != 200:
+        print(f"⚠️ 画像のダウンロードに失敗: {response.status_code}")
+        return None
+    return response.content
+
 def create_output_dirs(title):
     """出力用のディレクトリを作成"""
     # ファイル名をフォルダ名として使用
@@ -33,73 +102,186 @@ def create_output_dirs(title):
     
     return output_dir, images_dir
 
-def download_and_slice_image(url, video_id, start_time, duration, cols, rows, fragment_idx, base_cell_size, images_dir):
-    """画像をダウンロードしてスライスする"""
+def storyboard_frame_budget(duration_sec):
+    """動画の長さから保存するコマ数の上限を返す（None は無制限）"""
+    if STORYBOARD_FRAME_BUDGET > 0:
+        return STORYBOARD_FRAME_BUDGET
+    if STORYBOARD_FRAMES_PER_MINUTE <= 0:
+        return None
+    budget = max(1, math.ceil(duration_sec / 60 * STORYBOARD_FRAMES_PER_MINUTE))
+    return min(budget, STORYBOARD_MAX_FRAMES) if STORYBOARD_MAX_FRAMES > 0 else budget
+
+def select_storyboard_cells(fragments, cells_per_fragment, budget):
+    """動画全体をほぼ等間隔にカバーするよう、保存するコマを先に選ぶ。
+
+    動画を budget 個の区間に分け、各区間の中央時刻を含むコマを選ぶ。
+    ダウンロード前に決めるので、選ばれたコマを含まないフラグメントは取得しない。
+
+    Returns:
+        dict: {フラグメント番号: [コマ番号, ...]}（budget が None なら None＝全コマ）
+    """
+    if budget is None:
+        return None
+    total_cells = len(fragments) * cells_per_fragment
+    if budget >= total_cells:
+        return None
+
+    total = sum(fragment['duration'] for fragment in fragments)
+    selected = {}
+    fragment_idx = 0
+    fragment_start = 0
+    for k in range(budget):
+        target = (k + 0.5) * total / budget
+        # 区間の中央時刻を含むフラグメントまで進める（target は単調増加）
+        while (fragment_idx + 1 < len(fragments)
+               and target >= fragment_start + fragments[fragment_idx]['duration']):
+            fragment_start += fragments[fragment_idx]['duration']
+            fragment_idx += 1
+        duration = fragments[fragment_idx]['duration']
+        cell = int((target - fragment_start) / duration * cells_per_fragment) if duration > 0 else 0
+        cells = selected.setdefault(fragment_idx, [])
+        cell = min(cell, cells_per_fragment - 1)
+        if not cells or cells[-1] != cell:
+            cells.append(cell)
+    return selected
+
+def choose_storyboard_format(storyboards):
+    """yt-dlp のストーリーボード形式（sb0〜sb3）から、取得量が上限に収まる最も高解像度のものを選ぶ。
+
+    各形式について、コマ数の上限（storyboard_frame_budget）で実際に取得することになる
+    シート数と、コマの解像度から推定したバイト数を求め、STORYBOARD_MAX_FRAGMENTS と
+    STORYBOARD_MAX_MB の両方に収まるものを解像度の高い順に探す。どれも収まらなければ
+    推定バイト数が最小のものを返す。
+
+    Returns:
+        tuple: (選んだ形式, 取得するシート数, 推定バイト数)。形式が無ければ (None, 0, 0)
+    """
+    candidates = [
+        f for f in storyboards
+        if f.get('fragments') and f.get('columns') and f.get('rows')
+    ]
+    if not candidates:
+        return None, 0, 0
+
+    def plan(fmt):
+        fragments = fmt['fragments']
+        cells = fmt['columns'] * fmt['rows']
+        total = sum(fragment.get('duration') or 0 for fragment in fragments)
+        selected = select_storyboard_cells(fragments, cells, storyboard_frame_budget(total))
+        n_fetch = len(fragments) if selected is None else len(selected)
+        pixels = cells * (fmt.get('width') or 0) * (fmt.get('height') or 0)
+        return n_fetch, n_fetch * pixels * _JPEG_BYTES_PER_PIXEL
+
+    def resolution(fmt):
+        return (fmt.get('width') or 0) * (fmt.get('height') or 0)
+
+    plans = [(fmt, *plan(fmt)) for fmt in sorted(candidates, key=resolution, reverse=True)]
+    for fmt, n_fetch, est_bytes in plans:
+        if n_fetch <= STORYBOARD_MAX_FRAGMENTS and est_bytes <= STORYBOARD_MAX_MB * 1024 * 1024:
+            return fmt, n_fetch, est_bytes
+    return min(plans, key=lambda p: p[2])
+
+def download_storyboard_fragment(url, video_id, start_time, duration, cols, rows, fragment_idx, base_cell_size, images_dir,
+                                 content=None, cells=None):
+    """フラグメント画像を取得し、選んだコマを保存前のコマ情報として返す（content に取得済みの画像があればダウンロードしない）
+
+    cells（コマ番号のリスト）を渡すと、そのコマだけを返す。シートの外にはみ出すコマ
+    （最後のシートの空き）は返さない。スプライトシートモードでは、取得した JPEG を
+    再エンコードせずシートとしてそのまま保存する。
+
+    Returns:
+        list: [(start, end, crop, sheet_image, sheet_path, fragment_idx), ...]
+            - crop: (x, y, 幅, 高さ, シート幅, シート高さ)
+            - sheet_path: スプライトシートモードで保存したシートのパス（通常モードでは None）
+    """
     try:
         # 画像をダウンロード
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"⚠️ 画像のダウンロードに失敗: {response.status_code}")
-            return []
+        if content is None:
+            content = fetch_image_bytes(url)
+            if content is None:
+                return []
 
         # 画像をPILで開く
-        img = Image.open(io.BytesIO(response.content))
-        
-        # デバッグ用に元画像を保存
-        original_filename = f"{video_id}_original_{fragment_idx}.jpg"
-        original_filepath = os.path.join(images_dir, original_filename)
-        img.save(original_filepath, "JPEG")
-        print(f"✅ 元画像を保存: {original_filename}")
-        
+        img = Image.open(io.BytesIO(content))
+        img.load()
+
+        sheet_path = None
+        if STORYBOARD_SPRITES:
+            # スプライトシートモードではシートを1枚のまま保存する
+            sheet_path = os.path.join(images_dir, f"{video_id}_sheet_{fragment_idx}.jpg")
+            with open(sheet_path, 'wb') as f:
+                f.write(content)
+        else:
+            # デバッグ用に元画像を保存
+            original_filename = f"{video_id}_original_{fragment_idx}.jpg"
+            original_filepath = os.path.join(images_dir, original_filename)
+            img.save(original_filepath, "JPEG")
+            print(f"✅ 元画像を保存: {original_filename}")
+
         # 実際の画像サイズを取得
-        actual_width, actual_height = img.size
-        print(f"実際の画像サイズ: {actual_width}x{actual_height}")
-        
+        sheet_width, sheet_height = img.size
+
         # 基準のセルサイズを使用
         cell_width, cell_height = base_cell_size
-        print(f"基準セルサイズ: {cell_width}x{cell_height}, 分割: {cols}x{rows}")
-        
+
         # 1セルあたりの時間を計算（デュレーションを総セル数で割る）
-        cells_count = cols * rows
-        time_per_cell = duration / cells_count
-        
-        sliced_images = []
-        
-        # 画像をグリッドに従ってスライス
-        for row in range(rows):
-            for col in range(cols):
-                # 画像の切り出し範囲を計算
-                left = col * cell_width
-                top = row * cell_height
-                right = left + cell_width
-                bottom = top + cell_height
-                
-                # セル画像を切り出して保存
-                cell = img.crop((left, top, right, bottom))
-                print(f"セルサイズ: {cell.size[0]}x{cell.size[1]}")
-                
-                # グリッドポジションからタイムスタンプを計算
-                cell_index = row * cols + col
-                cell_start_time = start_time + (cell_index * time_per_cell)
-                cell_end_time = cell_start_time + time_per_cell
-                
-                # 時間を文字列に変換（HHMMSS形式）
-                start_time_str = format_time_vtt(cell_start_time).replace(":", "").replace(".", "")
-                end_time_str = format_time_vtt(cell_end_time).replace(":", "").replace(".", "")
-                
-                # ファイル名を生成（Windows対応のタイムスタンプ形式）
-                filename = f"{video_id}_t{start_time_str}_to_{end_time_str}_f{fragment_idx}.jpg"
-                filepath = os.path.join(images_dir, filename)
-                
-                # 画像を保存
-                cell.save(filepath, "JPEG")
-                sliced_images.append((filepath, cell_start_time, cell_end_time))
-        
-        return sliced_images
+        time_per_cell = duration / (cols * rows)
+
+        frames = []
+        for cell_index in (cells if cells is not None else range(cols * rows)):
+            row, col = divmod(cell_index, cols)
+            left = col * cell_width
+            top = row * cell_height
+            if left + cell_width > sheet_width or top + cell_height > sheet_height:
+                continue
+            # グリッドポジションからタイムスタンプを計算
+            cell_start_time = start_time + cell_index * time_per_cell
+            crop = (left, top, cell_width, cell_height, sheet_width, sheet_height)
+            frames.append((cell_start_time, cell_start_time + time_per_cell, crop, img, sheet_path, fragment_idx))
+        return frames
     except Exception as e:
         print(f"⚠️ 画像処理エラー: {str(e)}")
         return []
 
+def _cell_image(frame):
+    """コマ情報からセル画像を切り出す"""
+    left, top, width, height = frame[2][:4]
+    return frame[3].crop((left, top, left + width, top + height))
+
+def save_storyboard_frame(frame, video_id, images_dir):
+    """コマを保存し、txt_to_html に渡す画像情報を返す
+
+    通常モードはセルを JPEG で保存して (path, start, end) を、スプライトシートモードは
+    保存済みのシートを指す (sheet_path, start, end, crop) を返す。
+    """
+    start, end, crop, _img, sheet_path, fragment_idx = frame
+    if sheet_path is not None:
+        return (sheet_path, start, end, crop)
+
+    # 時間を文字列に変換（HHMMSS形式）
+    start_time_str = format_time_vtt(start).replace(":", "").replace(".", "")
+    end_time_str = format_time_vtt(end).replace(":", "").replace(".", "")
+
+    # ファイル名を生成（Windows対応のタイムスタンプ形式）
+    filename = f"{video_id}_t{start_time_str}_to_{end_time_str}_f{fragment_idx}.jpg"
+    filepath = os.path.join(images_dir, filename)
+    _cell_image(frame).save(filepath, "JPEG")
+    return (filepath, start, end)
+
+def storyboard_dhash(image):
+    """コマの差分ハッシュ（dHash, 64bit）を返す
+
+    9x8 のグレースケールに縮小し、横に隣り合う画素の明暗をビットにする。
+    スライドが同じコマは、圧縮ノイズや小さな動きがあってもほぼ同じ値になる。
+    """
+    small = image.convert('L').resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
 def download_thumbnail_from_info(thumbnails, output_dir):
     """
     yt-dlpから取得したサムネイル情報を使ってサムネイル画像を保存
@@ -136,7 +318,7 @@ def download_thumbnail_from_info(thumbnails, output_dir):
             continue
 
         try:
-            response = requests.get(thumb_url, timeout=10)
+            response = get_http_session().get(thumb_url, timeout=STORYBOARD_TIMEOUT)
             if response.status_code == 200:
                 content_length = len(response.content)
                 # 小さすぎる画像はスキップ（プレースホルダーの可能性）
@@ -156,49 +338,69 @@ def download_thumbnail_from_info(thumbnails, output_dir):
     print("⚠️ サムネイル画像の取得に失敗しました")
     return None
 
-def dl_images(url, images_dir, output_dir=None):
+def dl_images(metadata, images_dir, output_dir=None, checkpoint=None):
     """
     ストーリーボード画像とサムネイル画像をダウンロード
 
+    フラグメントは共有の requests.Session で STORYBOARD_FETCH_WORKERS 件ずつ並列に取得し、
     各フラグメントの画像は以下のように処理されます：
     1. 元画像を保存（デバッグ用）
     2. 実際の画像サイズを取得して動的にスライス
     3. グリッドに従って画像を分割
     4. 各スライスに正確なタイムスタンプを付与
+    5. 時刻順に並べ、dHash がほぼ同じ連続コマを1コマにまとめてから保存
 
     Args:
-        url: YouTube動画URL
+        metadata: resolve_video_metadata() の戻り値（yt-dlp を再度呼ばずに使う）
         images_dir: ストーリーボード画像の保存先
         output_dir: サムネイル画像の保存先（HTMLと同じ階層）
+        checkpoint: RunCheckpoint。指定すると取得結果の一覧（マニフェスト）を保存し、
+                    次回は画像が揃っていればダウンロードを省略する
 
     Returns:
         tuple: (storyboard_images, thumbnail_path)
             - storyboard_images: [(filepath, start_time, end_time), ...]
+              （STORYBOARD_SPRITES 時は (シートのパス, start_time, end_time, crop)）
             - thumbnail_path: サムネイル画像のパス、失敗時はNone
     """
-    with yt_dlp.YoutubeDL({'skip_download': True}) as ydl:
-        info = ydl.extract_info(url, download=False)
-        video_id = info['id']
+    video_id = metadata['video_id']
+
+    # 前回取得したストーリーボードが揃っていれば再利用する（内容は動画ごとに不変）
+    manifest_key = (f"{video_id}|{len(metadata['storyboards'])}|{bool(output_dir)}|{STORYBOARD_SPRITES}"
+                    f"|{STORYBOARD_FRAME_BUDGET}|{STORYBOARD_FRAMES_PER_MINUTE}|{STORYBOARD_MAX_FRAMES}"
+                    f"|{STORYBOARD_MAX_FRAGMENTS}|{STORYBOARD_MAX_MB}|{STORYBOARD_DEDUP}|{STORYBOARD_DEDUP_DISTANCE}")
+    if checkpoint is not None:
+        manifest = checkpoint.load('storyboard', key=manifest_key)
+        if manifest is not None:
+            base = output_dir or images_dir
+            images = [
+                (os.path.join(base, item[0]), item[1], item[2], *(tuple(c) for c in item[3:]))
+                for item in manifest['images']
+            ]
+            thumbnail_path = os.path.join(base, manifest['thumbnail']) if manifest['thumbnail'] else None
+            if all(os.path.exists(image[0]) for image in images):
+                print(f"✅ ストーリーボード {len(images)} 枚を前回の結果から再利用")
+                return images, thumbnail_path
 
     # サムネイル画像を取得（output_dirが指定されている場合）
     thumbnail_path = None
     if output_dir:
         print("\nサムネイル画像を取得中...")
-        thumbnails = info.get('thumbnails', [])
-        thumbnail_path = download_thumbnail_from_info(thumbnails, output_dir)
+        thumbnail_path = download_thumbnail_from_info(metadata['thumbnails'], output_dir)
 
         # メタ情報をinfo.jsonとして保存
         print("\n動画情報を保存中...")
         video_info = {
-            "title": info.get('title', ''),
-            "uploader": info.get('uploader', ''),
-            "channel": info.get('channel', ''),
-            "description": info.get('description', ''),
-            "upload_date": info.get('upload_date', ''),  # YYYYMMDD形式
-            "duration": info.get('duration', 0),
-            "view_count": info.get('view_count', 0),
+            "title": metadata['title'],
+            "uploader": metadata['uploader'],
+            "channel": metadata['channel'],
+            "description": metadata['description'],
+            "upload_date": metadata['upload_date'],  # YYYYMMDD形式
+            "duration": metadata['duration'],
+            "view_count": metadata['view_count'],
+            "chapters": metadata['chapters'],
             "video_id": video_id,
-            "url": url,
+            "url": metadata['url'],
             "processed_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         info_path = os.path.join(output_dir, "info.json")
@@ -206,55 +408,105 @@ def dl_images(url, images_dir, output_dir=None):
             json.dump(video_info, f, ensure_ascii=False, indent=2)
         print(f"✅ 動画情報を保存: {info_path}")
 
-    # ストーリーボード形式を取得
-    sb1_format = next((f for f in info.get("formats", [])
-                    if f.get("format_note") == "storyboard" and f.get("format_id") == "sb0"), None)
+    # ストーリーボード形式を選ぶ（動画の長さに応じて取得量が上限に収まる解像度）
+    sb1_format, n_fetch, est_bytes = choose_storyboard_format(metadata['storyboards'])
 
     if sb1_format:
-        print("✅ ストーリーボード情報:")
+        print(f"✅ ストーリーボード情報: {sb1_format.get('format_id')}"
+              f"（シート {n_fetch} 枚・推定 {est_bytes / 1024 / 1024:.1f}MB を取得）")
         print(f"画像サイズ: {sb1_format['width']}x{sb1_format['height']}")
         print(f"分割: {sb1_format['columns']}列 × {sb1_format['rows']}行")
         print(f"フラグメント数: {len(sb1_format['fragments'])}")
         
-        # 最初のフラグメントから基準となるセルサイズを計算
+        fragments = sb1_format['fragments']
+
+        # 最初のフラグメントから基準となるセルサイズを計算（取得した画像はスライスにも使う）
         try:
-            # 最初のフラグメントの画像を取得
-            first_response = requests.get(sb1_format['fragments'][0]['url'])
-            if first_response.status_code == 200:
-                first_img = Image.open(io.BytesIO(first_response.content))
-                base_width = first_img.size[0] // sb1_format['columns']
-                base_height = first_img.size[1] // sb1_format['rows']
-                base_cell_size = (base_width, base_height)
-                print(f"基準セルサイズを設定: {base_width}x{base_height}")
-            else:
+            first_content = fetch_image_bytes(fragments[0]['url'])
+            if first_content is None:
                 raise Exception("最初のフラグメントの取得に失敗しました")
+            first_img = Image.open(io.BytesIO(first_content))
+            base_width = first_img.size[0] // sb1_format['columns']
+            base_height = first_img.size[1] // sb1_format['rows']
+            base_cell_size = (base_width, base_height)
+            print(f"基準セルサイズを設定: {base_width}x{base_height}")
         except Exception as e:
             print(f"⚠️ 基準セルサイズの計算エラー: {str(e)}")
-            return []
-        
-        all_images = []
+            return [], thumbnail_path
+
+        # 各フラグメントの開始時刻はフラグメント長の累積で決まる
+        start_times = []
         current_time = 0
-        
-        # 各フラグメントを処理
-        for idx, fragment in enumerate(sb1_format['fragments']):
-            print(f"フラグメント {idx + 1}/{len(sb1_format['fragments'])} を処理中...")
-              # 画像をダウンロードしてスライス
-            images = download_and_slice_image(
+        for fragment in fragments:
+            start_times.append(current_time)
+            current_time += fragment['duration']
+
+        # 保存するコマを先に選び、必要なフラグメントだけを取得する
+        cells_per_fragment = sb1_format['columns'] * sb1_format['rows']
+        budget = storyboard_frame_budget(current_time)
+        selected = select_storyboard_cells(fragments, cells_per_fragment, budget)
+        if selected is None:
+            fragment_indices = list(range(len(fragments)))
+        else:
+            fragment_indices = sorted(selected)
+            print(f"コマ数の上限 {budget}: {sum(len(c) for c in selected.values())} コマ"
+                  f"（{len(fragment_indices)}/{len(fragments)} フラグメント）を保存します")
+
+        def process_fragment(idx):
+            fragment = fragments[idx]
+            frames = download_storyboard_fragment(
                 fragment['url'],
                 video_id,
-                current_time,
+                start_times[idx],
                 fragment['duration'],
                 sb1_format['columns'],
                 sb1_format['rows'],
                 idx,
                 base_cell_size,
-                images_dir
+                images_dir,
+                content=first_content if idx == 0 else None,
+                cells=selected[idx] if selected is not None else None,
             )
-            
-            all_images.extend(images)
-            current_time += fragment['duration']
-        
+            print(f"フラグメント {idx + 1}/{len(fragments)} を処理しました")
+            return frames
+
+        # フラグメントを共有セッションで並列に取得・スライスし、時刻順に受け取る。
+        # 連続するほぼ同じコマは保存前に1コマへまとめ、残ったコマだけを書き出す。
+        collapsed = 0
+        with ThreadPoolExecutor(max_workers=max(1, STORYBOARD_FETCH_WORKERS)) as executor:
+            saves = []
+
+            def keep(frame):
+                saves.append(executor.submit(save_storyboard_frame, frame, video_id, images_dir))
+
+            run = None  # まとめ中の連続コマ [代表コマ, 代表コマの dHash]
+            for frames in executor.map(process_fragment, fragment_indices):
+                for frame in frames:
+                    if not STORYBOARD_DEDUP:
+                        keep(frame)
+                        continue
+                    frame_hash = storyboard_dhash(_cell_image(frame))
+                    if run is not None and bin(run[1] ^ frame_hash).count('1') <= STORYBOARD_DEDUP_DISTANCE:
+                        # 代表コマの終了時刻を延ばす
+                        run[0] = run[0][:1] + (frame[1],) + run[0][2:]
+                        collapsed += 1
+                        continue
+                    if run is not None:
+                        keep(run[0])
+                    run = [frame, frame_hash]
+            if run is not None:
+                keep(run[0])
+            all_images = [future.result() for future in saves]
+
+        if collapsed:
+            print(f"ほぼ同じ連続コマ {collapsed} 枚をまとめました")
         print(f"✅ 合計 {len(all_images)} 枚の画像を保存しました")
+        if checkpoint is not None:
+            base = output_dir or images_dir
+            checkpoint.save('storyboard', {
+                "images": [(os.path.relpath(image[0], base), *image[1:]) for image in all_images],
+                "thumbnail": os.path.relpath(thumbnail_path, base) if thumbnail_path else None,
+            }, key=manifest_key)
         return all_images, thumbnail_path
     else:
         print("⚠️ ストーリーボード形式が見つかりませんでした")
@@ -291,38 +543,101 @@ def sanitize_filename(title):
     return title
 
 _ID_RE = re.compile(r'(?:v=|/)([0-9A-Za-z_-]{11})(?=[?&#/]|$)')
+_ID_ONLY_RE = re.compile(r'^[0-9A-Za-z_-]{11}$')
+_YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtube-nocookie.com', 'www.youtube-nocookie.com')
+
+def parse_video_id(url):
+    """正規形の YouTube URL から通信せずに動画 ID を取り出す（判別できなければ None）
+
+    対応: watch?v=ID / youtu.be/ID / shorts/ID / embed/ID / live/ID / v/ID
+    """
+    try:
+        parsed = urllib.parse.urlparse(url.strip())
+    except ValueError:
+        return None
+    host = (parsed.hostname or '').lower()
+    parts = [p for p in parsed.path.split('/') if p]
+
+    candidate = None
+    if host == 'youtu.be' and parts:
+        candidate = parts[0]
+    elif host in _YOUTUBE_HOSTS:
+        if parsed.path == '/watch':
+            candidate = (urllib.parse.parse_qs(parsed.query).get('v') or [None])[0]
+        elif len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+            candidate = parts[1]
+    if candidate and _ID_ONLY_RE.match(candidate):
+        return candidate
+    return None
 
 def get_video_id(url):
-    """短縮 URL を含むあらゆる YouTube URL から動画 ID を取得（失敗時 None）"""
+    """短縮 URL を含むあらゆる YouTube URL から動画 ID を取得（失敗時 None）
+
+    正規形の URL はローカルで解析し、それ以外のときだけリダイレクトを追跡する。
+    """
+    video_id = parse_video_id(url)
+    if video_id:
+        return video_id
     try:
-        url = requests.get(url, allow_redirects=True, timeout=5).url  # 常にリダイレクトを追跡
+        url = requests.get(url, allow_redirects=True, timeout=5).url
     except requests.RequestException:
         return None
     m = _ID_RE.search(url)
     return m.group(1) if m else None
 
-'''
-def get_video_id(url):
-    """URLから動画IDを抽出"""
-    pattern = r'(?:v=|\/)([0-9A-Za-z_-]{11}).*'
-    match = re.search(pattern, url)
-    return match.group(1) if match else None
-'''
-def fetch_video_description(url):
-    """動画のdescriptionをyt-dlpで取得して返す（失敗時はNone）"""
+def _video_metadata_from_info(info, video_id, url):
+    """yt-dlp の info から、各処理で使う項目だけを取り出した辞書を作る"""
+    storyboards = [
+        f for f in info.get('formats') or []
+        if f.get('format_note') == 'storyboard' or str(f.get('format_id', '')).startswith('sb')
+    ]
+    return {
+        "video_id": info.get('id') or video_id,
+        "url": url,
+        "title": info.get('title') or '',
+        "description": info.get('description') or '',
+        "duration": info.get('duration') or 0,
+        "chapters": info.get('chapters') or [],
+        "thumbnails": info.get('thumbnails') or [],
+        "storyboards": storyboards,
+        "uploader": info.get('uploader') or '',
+        "channel": info.get('channel') or '',
+        "upload_date": info.get('upload_date') or '',
+        "view_count": info.get('view_count') or 0,
+    }
+
+def resolve_video_metadata(video_id):
+    """yt-dlp を1回だけ呼び、タイトル・description・長さ・チャプター・サムネイル・
+    ストーリーボード形式をまとめて取得する（video_id ごとにキャッシュする）
+
+    以降の処理（出力フォルダ名、字幕ファイル名、description フィルタ、
+    サムネイル・ストーリーボード取得、info.json）はすべてこの結果を共有する。
+    yt-dlp が失敗した場合はタイトルだけWebページから取得し、他は空にする。
+    """
+    metadata = load_video_cache(video_id, 'metadata')
+    if metadata is not None:
+        print("動画メタ情報をキャッシュから読み込みました")
+        return metadata
+
+    url = f"https://www.youtube.com/watch?v={video_id}"
     try:
         with yt_dlp.YoutubeDL({'skip_download': True, 'quiet': True}) as ydl:
             info = ydl.extract_info(url, download=False)
-            return info.get('description', '') or None
+        metadata = _video_metadata_from_info(info, video_id, url)
+        save_video_cache(video_id, 'metadata', metadata)
+        return metadata
     except Exception as e:
-        print(f"⚠️ description取得エラー: {str(e)}")
-        return None
+        print(f"⚠️ 動画メタ情報の取得エラー: {str(e)}")
+        metadata = _video_metadata_from_info({}, video_id, url)
+        metadata['title'] = get_youtube_title(video_id) or ''
+        return metadata
 
 def get_youtube_title(video_id):
     """YouTubeの動画タイトルをWebページから取得"""
     try:
         url = f"https://www.youtube.com/watch?v={video_id}"
-        response = requests.get(url)
+        # _fetch_slots を確保したまま呼ばれるため、応答が無くても待ち続けないよう timeout を付ける
+        response = get_http_session().get(url, timeout=10)
         if response.status_code == 200:
             # タイトルを抽出（<title>タグの内容を取得）
             title_match = re.search(r'<title>(.*?)</title>', response.text)
@@ -337,14 +652,113 @@ def get_youtube_title(video_id):
         print(f"タイトル取得エラー: {str(e)}")
     return None
 
-def download_transcript(video_id, output_dir):
+def _list_available_transcripts(ytt_api, video_id):
+    """利用可能な字幕言語の一覧を返す（キャッシュ優先）。取得できなければ (None, None)。
+
+    キャッシュするのは言語のメタ情報だけで、取得に使う TranscriptList は
+    list() を呼んだときにだけ返す（字幕本体の取得で一覧を取り直さないため）。
+
+    Returns:
+        tuple: (available, transcript_list)
+            - available: [{"language": ..., "language_code": ..., "is_generated": ...}, ...]
+            - transcript_list: list() の結果（キャッシュから読んだ場合は None）
+    """
+    available = load_video_cache(video_id, 'transcript_list')
+    if available is not None:
+        print("利用可能な字幕（キャッシュ）")
+        return available, None
+
+    print("利用可能な字幕を確認中...")
+    try:
+        transcript_list = ytt_api.list(video_id)
+    except Exception as e:
+        print(f"字幕リスト取得エラー: {str(e)}")
+        # 英語エラーメッセージを日本語に変換して表示
+        if "No transcripts were found" in str(e):
+            print("この動画には字幕が見つかりませんでした。")
+        elif "Request failed" in str(e):
+            print("YouTubeへのリクエストが失敗しました。ネットワーク接続を確認してください。")
+        return None, None
+
+    available = [
+        {"language": t.language, "language_code": t.language_code, "is_generated": bool(t.is_generated)}
+        for t in transcript_list
+    ]
+    save_video_cache(video_id, 'transcript_list', available)
+    return available, transcript_list
+
+def fetch_transcript_snippets(video_id):
+    """優先順位（日本語 > 英語 > その他）に従って字幕を取得する
+
+    取得結果は video_id ごとのキャッシュに保存し、リトライや別モデルでの
+    再実行では YouTube に問い合わせずに再利用する。
+
+    Returns:
+        tuple: (snippets, transcript_language)
+            - snippets: [{"text": ..., "start": ..., "duration": ...}, ...]、失敗時はNone
+            - transcript_language: 表示用の字幕言語名
+    """
+    cached = load_video_cache(video_id, 'transcript')
+    if cached is not None:
+        print(f"字幕をキャッシュから読み込みました（{cached['language']}）")
+        return cached['snippets'], cached['language']
+
+    ytt_api = YouTubeTranscriptApi()
+    available, transcript_list = _list_available_transcripts(ytt_api, video_id)
+    if available is None:
+        return None, None
+
+    # まずすべての利用可能な字幕を表示
+    print("\n利用可能な字幕言語:")
+    for t in available:
+        print(f"- {t['language']} ({t['language_code']})")
+
+    # 優先順位: 日本語（通常 > 自動生成） > 英語 > 英語(US) > 最初に見つかる字幕
+    candidates = [('ja', '日本語'), ('en', '英語'), ('en-US', '英語(US)')]
+    if available:
+        first = available[0]
+        candidates.append((first['language_code'], f"{first['language']} ({first['language_code']})"))
+
+    if available and transcript_list is None:
+        # 一覧はキャッシュから読んだので、取得用の TranscriptList をここで一度だけ取り直す
+        try:
+            transcript_list = ytt_api.list(video_id)
+        except Exception as e:
+            print(f"字幕リスト取得エラー: {str(e)}")
+            return None, None
+
+    codes = {t['language_code'] for t in available}
+    for language_code, language_label in candidates:
+        if language_code not in codes:
+            continue
+        try:
+            # find_transcript は通常字幕を優先し、なければ自動生成字幕を返す
+            found = transcript_list.find_transcript([language_code])
+            fetched = found.fetch()
+        except Exception as e:
+            print(f"{language_label}字幕の取得に失敗: {str(e)}")
+            continue
+        if language_code == 'ja' and found.is_generated:
+            language_label = '日本語(自動生成)'
+        snippets = [{"text": s.text, "start": s.start, "duration": s.duration} for s in fetched]
+        print(f"{language_label}字幕が見つかりました")
+        save_video_cache(video_id, 'transcript', {"language": language_label, "snippets": snippets})
+        return snippets, language_label
+
+    print("対象の字幕が見つかりませんでした")
+    return None, None
+
+def download_transcript(video_id, output_dir, video_title=None):
+    """字幕を取得して VTT ファイルに保存する
+
+    Returns:
+        tuple: (VTTファイルのパス, Transcript)、失敗時は (None, None)
+    """
     try:
         # 出力ディレクトリ作成
         os.makedirs(output_dir, exist_ok=True)
         
-        # 動画のタイトルをWebページから取得
-        print("動画タイトルを取得中...")
-        video_title = get_youtube_title(video_id)
+        # 動画のタイトルは resolve_video_metadata() で取得済みのものを使う
         if video_title:
             original_title = video_title
             video_title = sanitize_filename(video_title)
@@ -354,111 +768,23 @@ def download_transcript(video_id, output_dir):
             video_title = video_id
             print("タイトルを取得できませんでした。動画IDを使用します。")
         
-        print("利用可能な字幕を確認中...")
-        # 利用可能な字幕のリストを取得
-        try:
-            ytt_api = YouTubeTranscriptApi()
-            transcript_list = ytt_api.list(video_id)
-        except Exception as e:
-            print(f"字幕リスト取得エラー: {str(e)}")
-            # 英語エラーメッセージを日本語に変換して表示
-            if "No transcripts were found" in str(e):
-                print("この動画には字幕が見つかりませんでした。")
-            elif "Request failed" in str(e):
-                print("YouTubeへのリクエストが失敗しました。ネットワーク接続を確認してください。")
-            return None
-        
-        # 字幕の優先順位: 日本語 > 英語 > その他
-        transcript = None
-        transcript_language = None
-        
-        # まずすべての利用可能な字幕を表示
-        available_transcripts = []
-        print("\n利用可能な字幕言語:")
-        for t in transcript_list:
-            print(f"- {t.language} ({t.language_code})")
-            available_transcripts.append(t)
-            
-        # 優先順位をつけて字幕を取得
-        # 1. 日本語の通常字幕
-        try:
-            transcript = transcript_list.find_transcript(['ja']).fetch()
-            transcript_language = '日本語'
-            print("日本語字幕が見つかりました")
-        except Exception as e:
-            print("日本語字幕が見つかりませんでした")
-            
-            # 2. 日本語の自動生成字幕を探す
-            auto_ja_found = False
-            for t in available_transcripts:
-                if (t.language_code == 'ja' and 'auto' in str(t.language).lower()) or t.language == 'Japanese (auto-generated)':
-                    try:
-                        transcript = t.fetch()
-                        transcript_language = '日本語(自動生成)'
-                        print("日本語(自動生成)字幕が見つかりました")
-                        auto_ja_found = True
-                        break
-                    except Exception as e:
-                        print(f"日本語自動生成字幕の取得に失敗: {str(e)}")
-            
-            # 3. 英語字幕
-            if not auto_ja_found:
-                print("英語字幕を試します...")
-                try:
-                    transcript = transcript_list.find_transcript(['en']).fetch()
-                    transcript_language = '英語'
-                    print("英語字幕が見つかりました")
-                except Exception as e1:
-                    try:
-                        transcript = transcript_list.find_transcript(['en-US']).fetch()
-                        transcript_language = '英語(US)'
-                        print("英語(US)字幕が見つかりました")
-                    except Exception as e2:
-                        print("英語字幕が見つかりませんでした")
-                        
-                        # 4. 最初に見つかる字幕を使用
-                        if available_transcripts:
-                            try:
-                                first_transcript = available_transcripts[0]
-                                transcript = first_transcript.fetch()
-                                transcript_language = f"{first_transcript.language} ({first_transcript.language_code})"
-                                print(f"{transcript_language}字幕を使用します")
-                            except Exception as e3:
-                                print(f"字幕の取得に失敗: {str(e3)}")
-                                return None
+        snippets, transcript_language = fetch_transcript_snippets(video_id)
         
         # 字幕が取得できたか確認
-        if not transcript:
+        if snippets is None:
             print("字幕が取得できませんでした")
-            return None
+            return None, None
             
-        if len(transcript) == 0:
+        if len(snippets) == 0:
             print("字幕データが空です")
-            return None
+            return None, None
             
-        # VTT形式に変換
-        print("VTT形式に変換中...")
-        print(f"字幕エントリ数: {len(transcript)}")
-        vtt_content = "WEBVTT\n\n"
-        for i, entry in enumerate(transcript, 1):
-            try:
-                # FetchedTranscriptSnippetオブジェクトから直接属性にアクセス
-                start_time = entry.start
-                duration = entry.duration
-                end_time = start_time + duration
-                
-                # 時間をVTT形式に変換 (HH:MM:SS.mmm)
-                start_str = format_time_vtt(start_time)
-                end_str = format_time_vtt(end_time)
-                
-                text = entry.text
-                
-                # VTTエントリを追加
-                vtt_content += f"{start_str} --> {end_str}\n{text}\n\n"
-            except Exception as e:
-                print(f"字幕エントリ {i} の処理中にエラー: {str(e)}")
-                # エラーが発生しても処理を継続
-        
+        print(f"字幕言語: {transcript_language}")
+        print(f"字幕エントリ数: {len(snippets)}")
+
+        # スニペットからメモリ上の字幕を直接作る（要約はこれを使い、VTT は成果物として保存するだけ）
+        transcript = Transcript.from_snippets(snippets, language=transcript_language)
+
         # ファイル名を動画タイトルから生成
         if not video_title:
             # タイトルが取得できなかった場合は動画IDを使用
@@ -467,14 +793,13 @@ def download_transcript(video_id, output_dir):
             output_file = os.path.join(output_dir, f"{video_title}.vtt")
         
         # ファイル保存
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(vtt_content)
+        transcript.write_vtt(output_file)
         
-        return output_file
+        return output_file, transcript
         
     except Exception as e:
         print(f"エラーが発生しました: {str(e)}")
-        return None
+        return None, None
 
 def format_time(seconds):
     """秒数をSRT形式の時間文字列に変換 (HH:MM:SS,mmm)"""
@@ -485,15 +810,6 @@ def format_time(seconds):
     
     return f"{hours:02d}:{minutes:02d}:{int(seconds):02d},{milliseconds:03d}"
 
-def format_time_vtt(seconds):
-    """秒数をVTT形式の時間文字列に変換 (HH:MM:SS.mmm)"""
-    hours = int(seconds / 3600)
-    minutes = int((seconds % 3600) / 60)
-    seconds = seconds % 60
-    milliseconds = int((seconds - int(seconds)) * 1000)
-    
-    return f"{hours:02d}:{minutes:02d}:{int(seconds):02d}.{milliseconds:03d}"
-
 def is_running_from_bat():
     """batファイルから実行されているかどうかを判定"""
     return "--from-bat" in sys.argv
@@ -502,86 +818,241 @@ def is_detail_mode():
     """詳細モードかどうかを判定"""
     return "--detail" in sys.argv
 
-def process_video(url):
-    """動画処理のメインロジック"""
-    video_id = get_video_id(url)
-    
-    if not video_id:
-        print("有効なYouTube URLではありません")
-        return False
-    
-    # タイトルを取得してディレクトリを作成
-    video_title = get_youtube_title(video_id)
-    if not video_title:
-        video_title = video_id
-    safe_title = sanitize_filename(video_title)
+def is_batch_mode():
+    """バッチモード（プレイリスト / チャンネル / URLリスト）かどうかを判定"""
+    return "--batch" in sys.argv
+
+def get_batch_source():
+    """--batch の直後に指定されたURLまたはファイルパスを返す（未指定時はNone）"""
+    idx = sys.argv.index("--batch")
+    if idx + 1 < len(sys.argv) and not sys.argv[idx + 1].startswith("--"):
+        return sys.argv[idx + 1]
+    return None
+
+def _flat_video_urls(url, depth=0):
+    """yt-dlp のフラット抽出でプレイリスト / チャンネルを動画URLの列に展開する
+
+    チャンネルURLはタブ（動画・ライブ等）のプレイリストを entries に持つため、
+    ネストしたプレイリストは2階層まで再帰的に展開する。
+    """
+    opts = {'skip_download': True, 'quiet': True, 'extract_flat': 'in_playlist'}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [info.get('webpage_url') or url]
+
+    urls = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        if entry.get('ie_key') == 'Youtube' or (entry.get('id') and len(entry['id']) == 11 and entry.get('ie_key') != 'YoutubeTab'):
+            urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
+        elif entry.get('url') and depth < 2:
+            try:
+                urls.extend(_flat_video_urls(entry['url'], depth + 1))
+            except Exception as e:
+                print(f"⚠️ プレイリストの展開に失敗: {entry.get('url')} ({str(e)})")
+    return urls
+
+def expand_batch_source(source):
+    """バッチ入力（プレイリスト / チャンネルURL、またはURLを1行ずつ書いたテキストファイル）を
+    重複のない動画URLのリストに展開する"""
+    if os.path.isfile(source):
+        with open(source, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f]
+        sources = [line for line in lines if line and not line.startswith('#')]
+    else:
+        sources = [source]
+
+    urls = []
+    for src in sources:
+        # 単体の動画URLは yt-dlp を呼ばずにそのまま使う
+        # （/@handle/livestreams のようなチャンネルのタブを動画と誤認しないよう正規形のみ判定）
+        if parse_video_id(src) and 'list=' not in src:
+            urls.append(src)
+            continue
+        print(f"プレイリストを展開中: {src}")
+        try:
+            urls.extend(_flat_video_urls(src))
+        except Exception as e:
+            print(f"⚠️ 展開エラー: {src} ({str(e)})")
+
+    # 順序を保ったまま重複を除去
+    seen = set()
+    unique = []
+    for u in urls:
+        key = parse_video_id(u) or u
+        if key not in seen:
+            seen.add(key)
+            unique.append(u)
+    return unique
+
+def _run_limited(slots, func, *args, **kwargs):
+    """共有スロット（セマフォ）を確保してから func を実行する"""
+    with slots:
+        return func(*args, **kwargs)
+
+def process_video(url, open_browser=True, resume=False, unique_dir=False):
+    """動画処理のメインロジック
+
+    各ステージの結果は出力フォルダの _checkpoints/ に保存される。resume=True
+    （リトライ時）は保存済みの字幕ファイルも再利用し、最初の未完了ステージから再開する。
+    unique_dir=True（バッチ時）は出力フォルダ名に動画IDを付け、同名・先頭100文字が
+    同じタイトルの動画どうしが並行実行中に出力やチェックポイントを上書きしないようにする。
+    各処理の所要時間はスパンとして記録し、終了時に出力フォルダの trace.jsonl に
+    書き出してクリティカルパスを表示する。
+    """
+    tracer = tracing.Tracer()
+    output_dir = None
+    try:
+        with tracing.activate(tracer), tracing.span('process_video', url=url):
+            video_id = get_video_id(url)
     
-    # 出力ディレクトリを作成
-    output_dir, images_dir = create_output_dirs(safe_title)
+            if not video_id:
+                print("有効なYouTube URLではありません")
+                return False
     
-    # 字幕を処理
-    result = download_transcript(video_id, output_dir)
+            # メタ情報取得と字幕取得はネットワーク待ちが主なので、バッチ時は共有上限内で行う
+            with _fetch_slots:
+                # メタ情報（タイトル・description・ストーリーボード等）を一度に取得
+                print("動画メタ情報を取得中...")
+                with tracing.span('fetch_metadata', video_id=video_id):
+                    metadata = resolve_video_metadata(video_id)
+                video_title = metadata['title'] or video_id
+                safe_title = sanitize_filename(video_title)
+                if unique_dir:
+                    safe_title = f"{safe_title}_{video_id}" if safe_title else video_id
+
+                # 出力ディレクトリを作成
+                output_dir, images_dir = create_output_dirs(safe_title)
+                checkpoint = RunCheckpoint(output_dir)
+
+                # 字幕を処理（リトライ時は前回保存したVTTを再利用）
+                result = None
+                transcript = None
+                if resume:
+                    saved = checkpoint.load('transcript', key=video_id)
+                    if saved and os.path.exists(os.path.join(output_dir, saved['file'])):
+                        result = os.path.join(output_dir, saved['file'])
+                        with tracing.span('read_vtt'):
+                            transcript = Transcript.from_vtt_file(result)
+                        print("字幕: 前回保存したVTTを再利用します")
+                if not result:
+                    with tracing.span('fetch_transcript', video_id=video_id):
+                        result, transcript = download_transcript(video_id, output_dir, video_title=metadata['title'])
+                    if result:
+                        checkpoint.save('transcript', {"file": os.path.basename(result)}, key=video_id)
     
-    if result:
-        print(f"字幕が保存されました: {result}")
+            if result:
+                print(f"字幕が保存されました: {result}")
         
-        # 要約処理の実行
-        print("\n要約処理を開始します...")
-        try:
-            video_url = f"https://www.youtube.com/watch?v={video_id}&t="
-
-            # 詳細モードかどうかを確認
-            detail_mode = is_detail_mode()
-            if detail_mode:
-                print("詳細モードで実行中...")
-
-            # description を並列処理の前に取得
-            print("\n動画のdescriptionを取得中...")
-            description = fetch_video_description(url)
-            if description:
-                print(f"\n{'='*50}")
-                print("[Description 原文]")
-                print(description)
-                print('='*50)
-
-                print("\n[Description フィルタ済み] AIで整理中...")
-                description_filtered = filter_description(description, video_title)
-                if description_filtered:
-                    print(f"\n{'='*50}")
-                    print("[Description フィルタ済み]")
-                    print(description_filtered)
-                    print('='*50)
-                else:
-                    print("⚠️ descriptionフィルタ結果が空でした（原文をそのまま使用）")
-                    description_filtered = description
-            else:
-                print("⚠️ descriptionを取得できませんでした")
-                description_filtered = None
-
-            # ストーリーボードを裏で並列ダウンロードしながら要約を実行
-            print("\nストーリーボード画像とサムネイルのダウンロードを開始（要約と並列実行）...")
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                images_future = executor.submit(dl_images, url, images_dir, output_dir)
-                html_path = create_summary(result, video_title, output_dir, video_url, images_future=images_future, detail_mode=detail_mode, description=description_filtered)
-            print(f"要約HTMLが作成されました: {html_path}")
+                # 要約処理の実行
+                print("\n要約処理を開始します...")
+                try:
+                    video_url = f"https://www.youtube.com/watch?v={video_id}&t="
+                    # 動画ごとにパイプラインを作り、URL・トークン使用量を他の動画と分離する
+                    pipeline = SummaryPipeline(url_base=video_url, output_dir=output_dir)
+
+                    # 詳細モードかどうかを確認
+                    detail_mode = is_detail_mode()
+                    if detail_mode:
+                        print("詳細モードで実行中...")
+
+                    # description はメタ情報取得時に取得済み（フィルタは要約処理の中で並行して行う）
+                    raw_description = metadata['description'] or ""
+
+                    # ストーリーボードを裏で並列ダウンロードしながら要約を実行
+                    print("\nストーリーボード画像とサムネイルのダウンロードを開始（要約と並列実行）...")
+                    with ThreadPoolExecutor(max_workers=1) as executor:
+                        images_future = executor.submit(tracing.traced('download_storyboard', _run_limited),
+                                                        _storyboard_slots, dl_images, metadata, images_dir, output_dir, checkpoint)
+                        # 要約スロットは LLM を呼ぶ処理の間だけ確保し、ストーリーボード待ちの間は他の動画に譲る
+                        html_path = pipeline.run(result, video_title, output_dir, images_future=images_future, detail_mode=detail_mode,
+                                                 raw_description=raw_description, transcript=transcript, llm_slots=_summary_slots)
+                    print(f"要約HTMLが作成されました: {html_path}")
             
-            # VTTファイルを削除
-            #os.remove(result)
-            print("VTTファイルを削除しました")
+                    # VTTファイルを削除
+                    #os.remove(result)
+                    print("VTTファイルを削除しました")
             
-            # HTMLをブラウザで開く
-            os.startfile(html_path)
-            print("ブラウザでHTMLを開きました")
-            return True
-        except Exception as e:
-            print(f"要約処理でエラーが発生しました: {str(e)}")
-            return False
-    else:
-        print("字幕の取得に失敗しました")
+                    # HTMLをブラウザで開く
+                    if open_browser:
+                        os.startfile(html_path)
+                        print("ブラウザでHTMLを開きました")
+                    return True
+                except Exception as e:
+                    print(f"要約処理でエラーが発生しました: {str(e)}")
+                    return False
+            else:
+                print("字幕の取得に失敗しました")
+                return False
+    finally:
+        if output_dir:
+            tracer.export(output_dir)
+            tracer.print_summary()
+
+
+def process_batch(source, max_retries=3):
+    """プレイリスト / チャンネル / URLリストの全動画を並列に処理する
+
+    動画ごとにワーカースレッドを割り当て、process_video 内の各ステージは
+    プロセス全体で共有する上限（_fetch_slots / _storyboard_slots / _summary_slots）
+    の範囲で重なり合って進む。失敗した動画は対話なしで max_retries 回まで再試行する。
+
+    Returns:
+        list: 失敗した動画URLのリスト
+    """
+    urls = expand_batch_source(source)
+    if not urls:
+        print("処理対象の動画が見つかりませんでした")
+        return []
+    print(f"\n=== バッチ処理: {len(urls)} 本の動画（同時 {BATCH_MAX_VIDEOS} 本まで） ===")
+
+    def run(url):
+        for attempt in range(max_retries):
+            try:
+                if process_video(url, open_browser=False, resume=attempt > 0, unique_dir=True):
+                    return True
+            except Exception as e:
+                print(f"⚠️ 処理エラー: {url} ({str(e)})")
+            if attempt < max_retries - 1:
+                print(f"\n同じURL({url})でリトライします... ({attempt+1}/{max_retries})")
+                time.sleep(2)
         return False
 
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_MAX_VIDEOS)) as executor:
+        futures = {executor.submit(run, url): url for url in urls}
+        for done, future in enumerate(as_completed(futures), 1):
+            url = futures[future]
+            ok = future.result()
+            if not ok:
+                failed.append(url)
+            print(f"\n[Batch] {done}/{len(urls)} {'完了' if ok else '失敗'}: {url}")
+
+    print(f"\n=== バッチ結果: 成功 {len(urls) - len(failed)} / 失敗 {len(failed)} ===")
+    for url in failed:
+        print(f"  失敗: {url}")
+    return failed
+
 if __name__ == "__main__":
     print("=== YouTube字幕ダウンローダー (Transcript API版) ===")
+    if is_batch_mode():
+        try:
+            source = get_batch_source()
+            if not source:
+                try:
+                    source = pyperclip.paste().strip()
+                except Exception:
+                    source = ""
+                if not source.startswith("http") and not os.path.isfile(source):
+                    source = input("プレイリスト / チャンネルURL、またはURLリストのファイルを入力してください: ").strip()
+            process_batch(source)
+        except Exception as e:
+            print(f"予期せぬエラー: {str(e)}")
+        input("Enterキーを押して終了...")
+        sys.exit(0)
     try:
         # 実行方法に応じてURLを取得
         if not is_running_from_bat():
@@ -599,8 +1070,9 @@ if __name__ == "__main__":
         
         # 動画処理を実行
         max_retries = 8
+        # 2回目以降は保存済みのステージ結果から再開する
         for i in range(max_retries):
-            if process_video(url):
+            if process_video(url, resume=i > 0):
                 # 処理成功
                 break
             else:
@@ -619,7 +1091,7 @@ if __name__ == "__main__":
                             # リトライ処理を3回まで行う
                             max_retries_after_limit = 3
                             for j in range(max_retries_after_limit):
-                                if process_video(url):
+                                if process_video(url, resume=True):
                                     # 処理成功
                                     break  # 内側のループを抜ける
                                 else: